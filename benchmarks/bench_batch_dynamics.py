@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''
+Scaling benchmark for the mapped (batched) model functions of CasadiDynamicsModel.
+Evaluates fd and the linearizations fAd/fBd for a batch of random states with serial
+evaluation and with 'thread' parallelization over an increasing number of worker threads.
+
+Usage: python benchmarks/bench_batch_dynamics.py [--batch_size 1000 10000] [--n_rep 10]
+'''
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from mpclab_common.models.dynamics_models import get_dynamics_model
+from mpclab_common.models.model_types import DynamicBicycleConfig
+from mpclab_common.track import get_track
+
+
+def time_fn(fn, n_rep):
+    fn()  # Warm up (builds and caches the mapped function)
+    t = time.perf_counter()
+    for _ in range(n_rep):
+        fn()
+    return (time.perf_counter() - t) / n_rep
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--n_rep', type=int, default=10)
+    parser.add_argument('--model_name', type=str, default='dynamic_bicycle_cl')
+    args = parser.parse_args()
+
+    track = get_track('L_track_barc')
+    model = get_dynamics_model(0, DynamicBicycleConfig(model_name=args.model_name, dt=0.1,
+                                                       discretization_method='rk4', M=10), track=track)
+
+    n_cores = os.cpu_count() or 1
+    thread_counts = sorted(set([2**i for i in range(int(np.log2(n_cores)) + 1)] + [n_cores]))
+    settings = [('serial', None)] + [('thread', n) for n in thread_counts]
+
+    print('%i cores available' % n_cores)
+    print('%-8s %-8s %-10s %14s %14s %10s' % ('fn', 'B', 'mode', 'ms / call', 'us / sample', 'speedup'))
+    rng = np.random.default_rng(0)
+    for B in args.batch_size:
+        Q = np.column_stack([rng.uniform(0.5, 3.0, B), rng.uniform(-0.2, 0.2, B), rng.uniform(-1, 1, B),
+                             rng.uniform(0, track.track_length, B), rng.uniform(-0.3, 0.3, B), rng.uniform(-0.3, 0.3, B)])
+        U = np.column_stack([rng.uniform(-2, 2, B), rng.uniform(-0.45, 0.45, B)])
+        for fn_name in ['fd', 'fAd', 'fBd']:
+            t_serial = None
+            for mode, n_threads in settings:
+                t = time_fn(lambda: model.evaluate_batch(fn_name, Q, U, parallelization=mode, n_threads=n_threads), args.n_rep)
+                if t_serial is None:
+                    t_serial = t
+                label = mode if n_threads is None else '%s-%i' % (mode, n_threads)
+                print('%-8s %-8i %-10s %14.3f %14.3f %10.2f' % (fn_name, B, label, t * 1e3, t / B * 1e6, t_serial / t))
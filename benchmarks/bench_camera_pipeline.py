@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+'''
+Throughput of BarcEnv with the CARLA camera, synchronous and pipelined (camera_pipelined=True), against the local fake
+CARLA client (fake_carla) with a given server tick and rendering latency, so it runs without a CARLA server.
+Also checks that every camera observation is the image of the expected tick: the fake camera writes the frame id in
+the red channel, the synchronous mode must return the frame of the current step and the pipelined mode the frame of
+the previous step (of the current step right after a reset).
+
+Usage: python benchmarks/bench_camera_pipeline.py [--tick_latency 0.005] [--render_latency 0.005] [--n_steps 100]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from gym_carla.envs.barc.cameras import fake_carla
+
+
+def run(pipelined, n_steps):
+    env = BarcEnv('L_track_barc', do_render=False, enable_camera=True, camera_pipelined=pipelined,
+                  camera_kwargs=dict(carla_module=fake_carla), integrator='rk4', substeps=2)
+    ob, info = env.reset(seed=0)
+    reset_frame = env.camera_bridge.world.n_ticks
+    assert ob['camera'][0, 0, 0] == reset_frame % 256, 'reset image is not the image of the reset state'
+    ac = np.array([0.5, 0.0])
+    t = time.perf_counter()
+    for k in range(1, n_steps + 1):
+        ob, rew, terminated, truncated, info = env.step(ac)
+        expected = reset_frame + k - (1 if pipelined else 0)
+        assert ob['camera'][0, 0, 0] == expected % 256, 'step %i: frame %i instead of %i' % (k, ob['camera'][0, 0, 0], expected % 256)
+    return n_steps / (time.perf_counter() - t)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tick_latency', type=float, default=0.005, help='Server time of a world tick (s)')
+    parser.add_argument('--render_latency', type=float, default=0.005, help='Delay of the image after the tick (s)')
+    parser.add_argument('--n_steps', type=int, default=100)
+    args = parser.parse_args()
+
+    fake_carla.TICK_LATENCY, fake_carla.RENDER_LATENCY = args.tick_latency, args.render_latency
+    print('Fake CARLA: tick %.1f ms, rendering %.1f ms' % (args.tick_latency * 1e3, args.render_latency * 1e3))
+    for pipelined in [False, True]:
+        print('%-12s %8.1f steps / s' % ('pipelined' if pipelined else 'synchronous', run(pipelined, args.n_steps)))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''
+Throughput of BarcEnv with a preprocessed, frame-stacked camera observation (camera_preprocessing: crop, resize to
+84x84, grayscale, stack of 4), against the same preprocessing done on the returned images with fresh arrays, with the
+local fake CARLA client (fake_carla), synchronous and pipelined (the preprocessing then runs in the camera worker
+thread).
+Also checks the frame stacks: the fake camera writes the frame id in the red channel, so with color images the stack
+of step k must hold the frames of steps k-3..k (the reset frame repeated at the start of the episode).
+
+Usage: python benchmarks/bench_camera_preprocessing.py [--tick_latency 0.005] [--render_latency 0.005] [--n_steps 100]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from gym_carla.envs.barc.cameras import fake_carla
+from gym_carla.envs.barc.cameras.preprocessing import CameraPreprocessor
+
+PREPROCESSING = dict(crop=(64, 0, 0, 0), resize=(84, 84), grayscale=True, frame_stack=4)
+
+
+def make_env(pipelined, preprocessing):
+    return BarcEnv('L_track_barc', do_render=False, enable_camera=True, camera_pipelined=pipelined,
+                   camera_preprocessing=preprocessing, camera_kwargs=dict(carla_module=fake_carla),
+                   integrator='rk4', substeps=2)
+
+
+def check(pipelined, n_steps=20):
+    preprocessing = dict(PREPROCESSING, grayscale=False)
+    env = make_env(pipelined, preprocessing)
+    assert env.observation_space['camera'].shape == (4, 84, 84, 3)
+    ac = np.array([0.5, 0.0])
+    for episode in range(2):
+        ob, info = env.reset(seed=episode)
+        reset_frame = env.camera_bridge.world.n_ticks
+        for k in range(n_steps):
+            if k > 0:
+                ob, rew, terminated, truncated, info = env.step(ac)
+            last = reset_frame + max(k - (1 if pipelined else 0), 0)
+            expected = [max(last - j, reset_frame) % 256 for j in (3, 2, 1, 0)]
+            assert ob['camera'].shape == (4, 84, 84, 3)
+            assert list(ob['camera'][:, 0, 0, 0]) == expected, 'step %i: frames %s instead of %s' \
+                % (k, ob['camera'][:, 0, 0, 0], expected)
+    env.close()
+
+
+def run(pipelined, in_env, n_steps):
+    env = make_env(pipelined, PREPROCESSING if in_env else None)
+    frames = []
+
+    def naive(image):
+        # Fresh arrays at every step
+        x = image[64:].astype(np.float32)
+        x = x[rows][:, cols]
+        frames.append((x @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8))
+        del frames[:-4]
+        return np.stack([frames[0]] * (4 - len(frames)) + frames)
+
+    rows, cols = CameraPreprocessor(**PREPROCESSING)._rows, CameraPreprocessor(**PREPROCESSING)._cols
+    ob, info = env.reset(seed=0)
+    ac = np.array([0.5, 0.0])
+    t = time.perf_counter()
+    for k in range(n_steps):
+        ob, rew, terminated, truncated, info = env.step(ac)
+        camera = ob['camera'] if in_env else naive(ob['camera'])
+        assert camera.shape == (4, 84, 84)
+    t = n_steps / (time.perf_counter() - t)
+    env.close()
+    return t
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tick_latency', type=float, default=0.005, help='Server time of a world tick (s)')
+    parser.add_argument('--render_latency', type=float, default=0.005, help='Delay of the image after the tick (s)')
+    parser.add_argument('--n_steps', type=int, default=100)
+    args = parser.parse_args()
+
+    for pipelined in [False, True]:
+        check(pipelined)
+    print('Frame stacks OK')
+
+    fake_carla.TICK_LATENCY, fake_carla.RENDER_LATENCY = args.tick_latency, args.render_latency
+    for pipelined in [False, True]:
+        for in_env in [False, True]:
+            print('%-11s %-28s %.1f steps / s' % ('pipelined' if pipelined else 'synchronous',
+                                                 'camera_preprocessing' if in_env else 'preprocessing after step',
+                                                 run(pipelined, in_env, args.n_steps)))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''
+Query rate and fault recovery of CarlaConnector against the local fake CARLA client (fake_carla), without a server:
+- queries per second of the headless connector with an instantaneous server (no frame rate limit),
+- the camera sensor is destroyed, then stops listening: the connector respawns it in the loaded world,
+- the world is replaced on the server: the connector generates the track world again at the next health check.
+Every image is checked to be the one of the tick of its query (the fake camera writes the frame id in the red channel).
+
+Usage: python benchmarks/bench_camera_recovery.py [--n_queries 2000]
+'''
+
+import argparse
+import time
+
+from mpclab_common.pytypes import VehicleState
+
+from gym_carla.envs.barc.cameras import fake_carla
+from gym_carla.envs.barc.cameras.carla_bridge import CarlaConnector
+
+
+def query(connector, n):
+    state = VehicleState()
+    for _ in range(n):
+        state.x.x += 0.01
+        img = connector.query_rgb(state)
+        assert img[0, 0, 0] == connector.world._frame % 256, 'image of another frame'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    connector = CarlaConnector('L_track_barc', carla_module=fake_carla, timeout=0.5, health_check_interval=100)
+    t = time.perf_counter()
+    query(connector, args.n_queries)
+    print('Headless queries / s with an instantaneous server: %.0f' % (args.n_queries / (time.perf_counter() - t)))
+
+    for fault in ['destroyed', 'stopped']:
+        if fault == 'destroyed':
+            connector.camera_sensor.destroy()
+        else:
+            connector.camera_sensor.stop()
+        t = time.perf_counter()
+        query(connector, 10)
+        print('Camera %s: recovered in %.2f s, %i respawns, %i world generations' % (
+            fault, time.perf_counter() - t, connector.n_respawns, connector.client.n_worlds_generated))
+
+    connector.client.generate_opendrive_world('')
+    query(connector, connector.health_check_interval)
+    print('World replaced: %i reloads, %i world generations' % (connector.n_world_reloads,
+                                                                connector.client.n_worlds_generated))
+    assert connector.n_respawns == 2 and connector.n_world_reloads == 1 and connector.client.n_worlds_generated == 3
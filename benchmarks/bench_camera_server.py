@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+'''
+Camera envs sharing one CARLA world (CarlaCameraServer) against one connection and world per env (CarlaConnector),
+with the local fake CARLA client (fake_carla) and a given server tick and rendering latency, so it runs without a
+CARLA server. The envs of the shared server are stepped in threads (each SharedCamera.query_rgb waits for the other
+envs, and the last one ticks the world for all of them), the separate envs one after the other.
+Also checks that the server ticks once per batched step and that every env receives the image of its own camera:
+the fake camera writes the frame id in the red channel and its location in cm in the green and blue channels.
+
+Usage: python benchmarks/bench_camera_server.py [--n_envs 2 8] [--tick_latency 0.005] [--render_latency 0.005]
+'''
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from gym_carla.envs.barc.cameras import fake_carla
+from gym_carla.envs.barc.cameras.camera_server import CarlaCameraServer
+
+
+def make_env(**kwargs):
+    return BarcEnv('L_track_barc', do_render=False, enable_camera=True, integrator='rk4', substeps=2, **kwargs)
+
+
+def check_image(env, ob):
+    state = env.sim_state
+    expected = [round(state.x.x * 100) % 256, round(-state.x.y * 100) % 256]
+    assert np.allclose(ob['camera'][0, 0, 1:], expected, atol=1), 'image of another camera'
+
+
+def run_shared(N, n_steps):
+    server = CarlaCameraServer('L_track_barc', carla_module=fake_carla)
+    envs = [make_env(camera_server=server) for _ in range(N)]
+    ac = np.array([0.5, 0.0])
+    with ThreadPoolExecutor(max_workers=N) as pool:
+        list(pool.map(lambda k: envs[k].reset(seed=k), range(N)))
+        n_ticks = server.n_ticks
+        t = time.perf_counter()
+        for _ in range(n_steps):
+            for env, (ob, *_) in zip(envs, pool.map(lambda env: env.step(ac), envs)):
+                check_image(env, ob)
+        t = time.perf_counter() - t
+    assert server.n_ticks - n_ticks == n_steps, '%i ticks for %i steps' % (server.n_ticks - n_ticks, n_steps)
+    for env in envs:
+        env.close()
+    return N * n_steps / t
+
+
+def run_separate(N, n_steps):
+    envs = [make_env(camera_kwargs=dict(carla_module=fake_carla)) for _ in range(N)]
+    for k, env in enumerate(envs):
+        env.reset(seed=k)
+    ac = np.array([0.5, 0.0])
+    t = time.perf_counter()
+    for _ in range(n_steps):
+        for env in envs:
+            ob, *_ = env.step(ac)
+            check_image(env, ob)
+    return N * n_steps / (time.perf_counter() - t)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_envs', type=int, nargs='+', default=[2, 8])
+    parser.add_argument('--tick_latency', type=float, default=0.005, help='Server time of a world tick (s)')
+    parser.add_argument('--render_latency', type=float, default=0.005, help='Delay of the images after the tick (s)')
+    parser.add_argument('--n_steps', type=int, default=50)
+    args = parser.parse_args()
+
+    fake_carla.TICK_LATENCY, fake_carla.RENDER_LATENCY = args.tick_latency, args.render_latency
+    print('Fake CARLA: tick %.1f ms, rendering %.1f ms' % (args.tick_latency * 1e3, args.render_latency * 1e3))
+    print('%-6s %22s %22s' % ('envs', 'shared world (st / s)', 'world per env (st / s)'))
+    for N in args.n_envs:
+        print('%-6i %22.1f %22.1f' % (N, run_shared(N, args.n_steps), run_separate(N, args.n_steps)))
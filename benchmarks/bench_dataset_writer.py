@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+'''
+Throughput of a camera data collection loop of BarcEnv (synthetic camera), without writing, saving every step
+synchronously as .npy files, and with DatasetWriter (PNG encoding and writing in background threads), with the disk
+footprint and the backpressure metrics of the writer.
+Also checks that the dataset reads back exactly: frames, data and VehicleState ground truth.
+
+Usage: python benchmarks/bench_dataset_writer.py [--n_steps 300] [--n_workers 1] [--max_queue 64]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from gym_carla.envs.utils.dataset_writer import DatasetWriter, DatasetReader
+
+
+def disk_usage(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def collect(env, n_steps, save=None):
+    ob, info = env.reset(seed=0)
+    action = np.array([1., 0.1])
+    frames, states = [], []
+    t = time.perf_counter()
+    for k in range(n_steps):
+        if save is not None:
+            save(k, ob, action)
+        frames.append(ob['camera'][::37, ::37].copy())
+        states.append((env.sim_state.p.s, env.sim_state.x.x))
+        ob, rew, terminated, truncated, info = env.step(action)
+        if terminated or truncated:
+            ob, info = env.reset()
+    return n_steps / (time.perf_counter() - t), frames, states
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_steps', type=int, default=300)
+    parser.add_argument('--n_workers', type=int, default=1)
+    parser.add_argument('--max_queue', type=int, default=64)
+    args = parser.parse_args()
+
+    env = BarcEnv('L_track_barc', do_render=False, enable_camera=True, camera_backend='synthetic',
+                  integrator='rk4', substeps=2)
+    print('%-22s %.1f steps / s' % ('no writing', collect(env, args.n_steps)[0]))
+
+    with tempfile.TemporaryDirectory() as path:
+        def save(k, ob, action):
+            np.save(os.path.join(path, 'camera_%06d.npy' % k), ob['camera'])
+            np.save(os.path.join(path, 'data_%06d.npy' % k), np.concatenate([ob['state'], action]))
+        steps = collect(env, args.n_steps, save)[0]
+        print('%-22s %.1f steps / s, %.1f MB' % ('synchronous .npy', steps, disk_usage(path) / 1e6))
+
+    with tempfile.TemporaryDirectory() as path:
+        writer = DatasetWriter(path, shard_size=100, n_workers=args.n_workers, max_queue=args.max_queue)
+
+        def save(k, ob, action):
+            writer.add(ob['camera'], env.sim_state, state=ob['state'], action=action, step=k)
+        steps, frames, states = collect(env, args.n_steps, save)
+        writer.close()
+        print('%-22s %.1f steps / s, %.1f MB' % ('DatasetWriter', steps, disk_usage(path) / 1e6))
+        metrics = writer.metrics
+        print('  ' + ', '.join('%s %s' % (k, ('%.3g' % v) if isinstance(v, float) else v) for k, v in metrics.items()))
+
+        reader = DatasetReader(path)
+        assert len(reader) == args.n_steps
+        for k in range(0, args.n_steps, 7):
+            item = reader[k]
+            assert item['step'] == k
+            assert (item['camera'][::37, ::37] == frames[k]).all()
+            state = reader.vehicle_state(k)
+            assert (state.p.s, state.x.x) == states[k]
+        print('Dataset OK')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+Cold start benchmark for code generated models and the index of compiled models (FunctionCache).
+Starts a pool of worker processes that each construct the dynamic bicycle model used by BarcEnv with code generation
+(O3 compiled shared object) and evaluate fd, fAd and fBd:
+- compile: empty cache, the first worker compiles the model, the others may compile it concurrently,
+- no index: the shared object is found by the hash of the generated code, after deriving and generating every function
+  (every worker removes the index first),
+- index: the shared object is found by the key of the model, its functions are loaded without being derived,
+and, as a reference, the symbolic model (no code generation).
+With --env, the workers are the envs of an env pool instead: each constructs BarcEnv(model_cache_dir=...) (the RK4
+dynamics simulator, M=10 substeps) and runs a reset and --n_steps steps, the symbolic model being BarcEnv without
+model_cache_dir.
+
+Usage: python benchmarks/bench_function_cache.py [--n_workers 16] [--env] [--n_steps 1]
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from mpclab_common.models.dynamics_models import CasadiDynamicBicycle
+from mpclab_common.models.model_types import DynamicBicycleConfig
+
+
+def build_model(args):
+    cache_dir, drop_index = args
+    if drop_index:
+        shutil.rmtree(os.path.join(cache_dir, 'index'), ignore_errors=True)
+    q, u = np.array([1.0, 0.0, 0.0, 0.0, 0.0, 0.0]), np.array([0.5, 0.1])
+    t = time.perf_counter()
+    config = DynamicBicycleConfig(dt=0.1, model_name='dynamic_bicycle', discretization_method='rk4', M=10,
+                                  code_gen=cache_dir is not None, jit=False, opt_flag='O3', install_dir=cache_dir)
+    model = CasadiDynamicBicycle(0.0, config)
+    model.fd(q, u), model.fAd(q, u), model.fBd(q, u)
+    return time.perf_counter() - t
+
+
+def build_env(args):
+    cache_dir, drop_index, n_steps = args
+    from gym_carla.envs.barc.barc_env import BarcEnv
+    if drop_index:
+        shutil.rmtree(os.path.join(cache_dir, 'index'), ignore_errors=True)
+    t = time.perf_counter()
+    env = BarcEnv('L_track_barc', do_render=False, integrator='rk4', substeps=10, model_cache_dir=cache_dir)
+    env.reset(seed=0)
+    for _ in range(n_steps):
+        env.step(np.array([0.5, 0.1]))
+    return time.perf_counter() - t
+
+
+def run_pool(n_workers, n_procs, cache_dir, drop_index=False, env_steps=None):
+    t = time.perf_counter()
+    with mp.Pool(n_procs) as pool:
+        if env_steps is None:
+            times = pool.map(build_model, [(cache_dir, drop_index)] * n_workers, chunksize=1)
+        else:
+            times = pool.map(build_env, [(cache_dir, drop_index, env_steps)] * n_workers, chunksize=1)
+    return time.perf_counter() - t, np.median(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_workers', type=int, default=16)
+    parser.add_argument('--n_procs', type=int, default=None, help='Number of processes, defaults to the number of cores')
+    parser.add_argument('--env', action='store_true', help='Construct and step BarcEnv in the workers')
+    parser.add_argument('--n_steps', type=int, default=1, help='Steps of each env with --env')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='model_cache_')
+    try:
+        print('%-10s %16s %22s' % ('cache', 'wall time (s)', 'median / worker (ms)'))
+        for label in ['symbolic', 'compile', 'no index', 'index']:
+            wall, median = run_pool(args.n_workers, args.n_procs, None if label == 'symbolic' else cache_dir,
+                                    drop_index=label == 'no index', env_steps=args.n_steps if args.env else None)
+            print('%-10s %16.2f %22.1f' % (label, wall, median * 1e3))
+    finally:
+        shutil.rmtree(cache_dir)
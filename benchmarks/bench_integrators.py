@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''
+Accuracy / speed benchmark of the integrators of BarcEnv (see the integrator and substeps arguments).
+Runs the same closed-loop PID lap on L_track_barc with each integrator setting and reports the env steps per second
+and the drift of the trajectory (position and velocity, max over the lap) with respect to a high-accuracy reference
+(solve_ivp with tight tolerances). The PID controller closes the loop, so the drift includes its reaction to the
+integration error, as it would in training.
+
+Run from the repository root (the PID controller is in the controllers package):
+Usage: PYTHONPATH=. python benchmarks/bench_integrators.py [--dt_sim 0.01] [--max_steps 400]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from controllers.barc_pid import PIDWrapper
+
+
+def run_lap(env, max_steps):
+    '''
+    returns the (x, y) positions (N, 2), the (v_long, v_tran, w_psi) velocities (N, 3) and the env steps per second
+    '''
+    expert = PIDWrapper(dt=env.dt, t0=env.t0, track_obj=env.get_track())
+    ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+    expert.reset(seed=0, options=info)
+    pos, vel = [], []
+    t = time.perf_counter()
+    for _ in range(max_steps):
+        ac, _ = expert.step(**ob, **info)
+        ob, rew, terminated, truncated, info = env.step(ac)
+        state = info['vehicle_state']
+        pos.append([state.x.x, state.x.y])
+        vel.append([state.v.v_long, state.v.v_tran, state.w.w_psi])
+        if terminated or truncated:
+            break
+    steps_per_sec = len(pos) / (time.perf_counter() - t)
+    return np.array(pos), np.array(vel), steps_per_sec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dt_sim', type=float, default=0.01)
+    parser.add_argument('--max_steps', type=int, default=400, help='Env steps (dt = 0.1 s) per lap at most')
+    args = parser.parse_args()
+
+    # euler ignores the number of substeps
+    settings = [('adaptive', None), ('euler', 1)] + [(m, M) for m in ['rk2', 'rk3', 'rk4'] for M in [1, 2, 10]]
+
+    env = BarcEnv('L_track_barc', dt_sim=args.dt_sim, do_render=False,
+                  integrator='adaptive', integrator_tol=(1e-10, 1e-12))
+    ref_pos, ref_vel, _ = run_lap(env, args.max_steps)
+
+    print('dt_sim %g s, reference lap of %i steps' % (args.dt_sim, len(ref_pos)))
+    print('%-10s %9s %12s %16s %16s' % ('integrator', 'substeps', 'steps / s', 'max pos err (m)', 'max vel err'))
+    for integrator, substeps in settings:
+        env = BarcEnv('L_track_barc', dt_sim=args.dt_sim, do_render=False,
+                      integrator=integrator, substeps=substeps)
+        pos, vel, steps_per_sec = run_lap(env, args.max_steps)
+        n = min(len(pos), len(ref_pos))
+        pos_err = np.linalg.norm(pos[:n] - ref_pos[:n], axis=1).max()
+        vel_err = np.abs(vel[:n] - ref_vel[:n]).max()
+        note = '' if len(pos) == len(ref_pos) else '  (lap of %i steps)' % len(pos)
+        print('%-10s %9s %12.1f %16.2e %16.2e%s' % (integrator, '-' if substeps is None else substeps,
+                                                    steps_per_sec, pos_err, vel_err, note))
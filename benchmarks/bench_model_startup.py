@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+'''
+Startup benchmark for CasadiDynamicsModel: time to construct CasadiDynamicBicycle (RK4, M=10)
+with the derivative functions built eagerly (lazy_derivatives=False, the previous behaviour)
+and on first access (lazy_derivatives=True), and the cost of the first access to fAd/fBd.
+
+Usage: python benchmarks/bench_model_startup.py [--n_rep 5] [--compute_hessians]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from mpclab_common.models.dynamics_models import CasadiDynamicBicycle
+from mpclab_common.models.model_types import DynamicBicycleConfig
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_rep', type=int, default=5)
+    parser.add_argument('--compute_hessians', action='store_true')
+    args = parser.parse_args()
+
+    q = np.array([1.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    u = np.array([0.5, 0.1])
+
+    print('%-8s %18s %22s %18s' % ('mode', 'construct (ms)', 'first fAd+fBd (ms)', 'fd(q, u) (us)'))
+    for lazy in [False, True]:
+        t_construct, t_first, t_fd = [], [], []
+        for _ in range(args.n_rep):
+            config = DynamicBicycleConfig(dt=0.1, model_name='dynamic_bicycle', discretization_method='rk4', M=10,
+                                          compute_hessians=args.compute_hessians, lazy_derivatives=lazy)
+            t = time.perf_counter()
+            model = CasadiDynamicBicycle(0.0, config)
+            t_construct.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            model.fAd(q, u), model.fBd(q, u)
+            t_first.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            for _ in range(1000):
+                model.fd(q, u)
+            t_fd.append((time.perf_counter() - t) / 1000)
+        print('%-8s %18.1f %22.1f %18.1f' % ('lazy' if lazy else 'eager', np.median(t_construct) * 1e3,
+                                             np.median(t_first) * 1e3, np.median(t_fd) * 1e6))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+'''
+Throughput benchmark of the multi-agent racing environment (barc-multi-v0) for K = 2, 8 and 32 agents.
+Every agent is driven by its own PID controller. Reports the env steps per second and agent steps per second
+with and without the controllers, and for comparison K separate BarcEnv instances with the same integrator
+stepped one after the other.
+
+Run from the repository root (the PID controller is in the controllers package):
+Usage: PYTHONPATH=. python benchmarks/bench_multi_env.py [--n_agents 2 8 32] [--n_steps 100]
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+from gym_carla.envs.barc.barc_multi_env import BarcMultiEnv
+from controllers.barc_pid import PIDWrapper
+
+
+def run_multi(K, n_steps):
+    env = BarcMultiEnv('L_track_barc', n_agents=K)
+    experts = [PIDWrapper(dt=env.dt, t0=env.t0, track_obj=env.get_track()) for _ in range(K)]
+    ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+    for expert in experts:
+        expert.reset(seed=0, options=info)
+
+    t_env = t_ctrl = 0
+    for _ in range(n_steps):
+        t = time.perf_counter()
+        ac = np.stack([expert.step(**ob_i, **info_i)[0]
+                       for expert, (ob_i, info_i) in zip(experts, [env.agent_obs_info(ob, info, i) for i in range(K)])])
+        t_ctrl += time.perf_counter() - t
+        t = time.perf_counter()
+        ob, rew, terminated, truncated, info = env.step(ac)
+        t_env += time.perf_counter() - t
+        if truncated.any():
+            ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+            for expert in experts:
+                expert.reset(seed=0, options=info)
+    return t_env / n_steps, (t_env + t_ctrl) / n_steps
+
+
+def run_single(K, n_steps):
+    envs = [BarcEnv('L_track_barc', do_render=False, integrator='rk4', substeps=2) for _ in range(K)]
+    obs_info = [env.reset(seed=k) for k, env in enumerate(envs)]
+    ac = np.array([0.5, 0.0])
+    t = time.perf_counter()
+    for _ in range(n_steps):
+        for k, env in enumerate(envs):
+            ob, rew, terminated, truncated, info = env.step(ac)
+            if truncated:
+                env.reset(seed=k)
+    return (time.perf_counter() - t) / n_steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_agents', type=int, nargs='+', default=[2, 8, 32])
+    parser.add_argument('--n_steps', type=int, default=100)
+    args = parser.parse_args()
+
+    print('Agent steps / s of barc-multi-v0 without and with the PID controllers, and of K separate BarcEnv')
+    print('%-4s %14s %14s %14s %14s' % ('K', 'env steps / s', 'multi', 'multi + PID', 'K x BarcEnv'))
+    for K in args.n_agents:
+        t_env, t_total = run_multi(K, args.n_steps)
+        t_single = run_single(K, max(args.n_steps // K, 5))
+        print('%-4i %14.1f %14.1f %14.1f %14.1f' % (K, 1 / t_env, K / t_env, K / t_total, K / t_single))
@@ -6,3 +6,9 @@ register(
     # max_episode_steps=100000,
 )
 from gym_carla.envs.barc.barc_env import BarcEnv
+
+register(
+    id='barc-multi-v0',
+    entry_point='gym_carla.envs.barc.barc_multi_env:BarcMultiEnv',
+)
+from gym_carla.envs.barc.barc_multi_env import BarcMultiEnv
@@ -24,14 +24,89 @@ from loguru import logger
 from gym_carla.envs.utils.renderer import LMPCVisualizer
 from gym_carla.envs.utils.lazy_renderer import LazyLMPCVisualizer
 from mpclab_simulation.dynamics_simulator import DynamicsSimulator
+from mpclab_simulation.range_sensor import RangeSensor
+from mpclab_simulation.bev_renderer import BEVRenderer
+from gym_carla.envs.barc.cameras.preprocessing import CameraPreprocessor
+
+
+def barc_dynamics_config(dt_sim: float, model_name: str = 'dynamic_bicycle', model_cache_dir: Optional[str] = None,
+                         **kwargs) -> DynamicBicycleConfig:
+    """
+    Config of the simulated BARC vehicle, kwargs set the other DynamicBicycleConfig fields (e.g. params, backend).
+    With model_cache_dir, the model is code generated and compiled (O3) in this directory, where the models built later
+    with the same config load the shared object without being derived again (see FunctionCache).
+    """
+    config = dict(dt=dt_sim,
+                  model_name=model_name,
+                  noise=False,
+                  discretization_method='rk4',
+                  simple_slip=False,
+                  tire_model='pacejka',
+                  # mass=2.91,
+                  # gravity=9.81,
+                  # yaw_inertia=0.03323,
+                  # wheel_dist_front=0.13,
+                  # wheel_dist_rear=0.13,
+                  # wheel_dist_center_front=0.1,
+                  # wheel_dist_center_rear=0.1,
+                  # bump_dist_front=0.15,
+                  # bump_dist_rear=0.15,
+                  # bump_dist_center=0.1,
+                  mass=2.258,
+                  yaw_inertia= 0.02771, #0.02723
+                  wheel_friction=0.9,
+                  pacejka_b_front=5.0,
+                  pacejka_b_rear=5.575055782097995, #5.0
+                  pacejka_c_front=2.28,
+                  pacejka_c_rear=2.0524659447890445) #2.28)
+    if model_cache_dir is not None:
+        config.update(code_gen=True, jit=False, opt_flag='O3', install=True, install_dir=str(model_cache_dir))
+    config.update(kwargs)
+    return DynamicBicycleConfig(**config)
 
 
 class BarcEnv(gym.Env):
     metadata = {'render.modes': ['human']}
+    # Reconnections to CARLA after a failure of the camera, and the pause before each
+    camera_retries = 3
+    camera_retry_wait = 10.
 
     def __init__(self, track_name, t0=0., dt=0.1, dt_sim=0.01, max_n_laps=100,
                  do_render=True, enable_camera=False, host='localhost', port=2000,
-                 in_colab=False):
+                 in_colab=False, dynamics_params=None, dynamics_backend='casadi', frenet=False,
+                 blended_dynamics=False, integrator=None, substeps=None, integrator_tol=None,
+                 enable_lidar=False, lidar_rays=32, lidar_fov=2 * np.pi, lidar_range=4.,
+                 enable_bev=False, bev_size=(64, 64), bev_resolution=0.05, camera_backend='carla',
+                 camera_pipelined=False, camera_kwargs=None, camera_server=None, camera_preprocessing=None,
+                 model_cache_dir=None):
+        # dynamics_params: names of DynamicBicycleConfig fields (e.g. ['mass', 'wheel_friction']) that can be changed
+        # at every reset with options={'dynamics_params': ...} without rebuilding the dynamics model
+        # dynamics_backend: 'casadi' or 'numpy' (fixed-step simulation without CasADi, see DynamicsConfig.backend)
+        # frenet: simulate the curvilinear model directly in (s, x_tran, e_psi) instead of projecting the global pose
+        # on the track after every substep, the global pose is only reconstructed when an observation or the renderer needs it
+        # blended_dynamics: blend the kinematic bicycle in at low speed (see _blend_kinematic_bicycle), which stays accurate
+        # with a larger dt_sim and lets the vehicle start from standstill, so episodes are only truncated when it reverses
+        # integrator: 'euler', 'rk2', 'rk3', 'rk4' (fixed step) or 'adaptive' (solve_ivp) integration of every dt_sim step,
+        # None keeps the default of the dynamics backend (adaptive with casadi, rk4 with numpy)
+        # substeps: number of fixed integration steps per dt_sim for the RK methods (defaults to 10), euler always takes one step
+        # integrator_tol: (rtol, atol) of the adaptive integrator (defaults to scipy's (1e-3, 1e-6))
+        # enable_lidar: add the distances to the track boundaries along lidar_rays rays spread over lidar_fov (centered
+        # on the heading) to the observation ('lidar'), capped at lidar_range (see RangeSensor)
+        # enable_bev: add a bev_size uint8 top-down view of the drivable area around the vehicle, rotated with it, with
+        # bev_resolution meters per pixel to the observation ('bev', see BEVRenderer)
+        # camera_backend: source of the camera images with enable_camera, 'carla' (CarlaConnector, needs a running CARLA
+        # server at host:port) or 'synthetic' (SyntheticCamera, offline software rendering of the same scene)
+        # camera_pipelined: with the carla backend, tick CARLA for the camera of step k while step k+1 is simulated, the
+        # camera observation then lags one step (except at reset)
+        # camera_kwargs: additional arguments of the camera backend (e.g. carla_module=fake_carla)
+        # camera_server: CarlaCameraServer shared with other envs, the camera is registered on its world (ticked once
+        # for all the cameras) instead of connecting to CARLA
+        # camera_preprocessing: arguments of a CameraPreprocessor (crop, resize, grayscale, frame_stack) applied to the
+        # camera images in preallocated buffers, the camera observation is then its (view of the) frame stack, only
+        # valid until the next step. With the carla backend, the images are preprocessed in the sensor thread as they
+        # are received (overlapped with the simulation with camera_pipelined)
+        # model_cache_dir: compile the dynamics model (O3 shared object) in this directory, the envs created later with
+        # the same model (e.g. the workers of an env pool) load it from there without deriving it (see FunctionCache)
         self.track_obj = get_track(track_name)
         # self.track_obj.slack = 1
         self.t0 = t0  # Constant
@@ -40,44 +115,54 @@ class BarcEnv(gym.Env):
         self.max_n_laps = max_n_laps
         self.do_render = do_render
         self.enable_camera = enable_camera
+        if camera_backend not in ('carla', 'synthetic'):
+            raise ValueError(f'Unknown camera backend {camera_backend}')
+        self.camera_backend = camera_backend
+        self.camera_pipelined = camera_pipelined
+        self.camera_kwargs = camera_kwargs or {}
+        if camera_server is not None and camera_pipelined:
+            raise ValueError('camera_pipelined is not supported with a shared camera_server')
+        self.camera_server = camera_server
+        self.camera_bridge = None
+        self.camera_preprocessing = camera_preprocessing
+        self.camera_preprocessor = None
+        self.enable_lidar = enable_lidar
+        self.enable_bev = enable_bev
         self.track_name = track_name
         self.host = host
         self.port = port
+        self.frenet = frenet
+        self._global_pose_stale = False
+        self._lap_wrapped = False
+        self._min_v_long = 0. if blended_dynamics else 0.25
 
         L = self.track_obj.track_length
         H = self.track_obj.half_width
-        VL = 0.37
-        VW = 0.195
-        sim_dynamics_config = DynamicBicycleConfig(dt=dt_sim,
-                                                   model_name='dynamic_bicycle',
-                                                   noise=False,
-                                                   discretization_method='rk4',
-                                                   simple_slip=False,
-                                                   tire_model='pacejka',
-                                                   # mass=2.91,
-                                                   # gravity=9.81,
-                                                   # yaw_inertia=0.03323,
-                                                   # wheel_dist_front=0.13,
-                                                   # wheel_dist_rear=0.13,
-                                                   # wheel_dist_center_front=0.1,
-                                                   # wheel_dist_center_rear=0.1,
-                                                   # bump_dist_front=0.15,
-                                                   # bump_dist_rear=0.15,
-                                                   # bump_dist_center=0.1,
-                                                   mass=2.258,
-                                                   yaw_inertia= 0.02771, #0.02723
-                                                   wheel_friction=0.9,
-                                                   pacejka_b_front=5.0,
-                                                   pacejka_b_rear=5.575055782097995, #5.0
-                                                   pacejka_c_front=2.28,
-                                                   pacejka_c_rear=2.0524659447890445) #2.28)
+        VL = self.VL = 0.37
+        VW = self.VW = 0.195
+        sim_dynamics_config = barc_dynamics_config(dt_sim,
+                                                   model_name='dynamic_bicycle' + ('_blended' if blended_dynamics else '') + ('_cl' if frenet else ''),
+                                                   params=dynamics_params, backend=dynamics_backend,
+                                                   model_cache_dir=model_cache_dir)
         # dynamics_simulator = DynamicsSimulator(t, sim_dynamics_config, delay=None, track=track_obj)
-        self.dynamics_simulator = DynamicsSimulator(t0, sim_dynamics_config, delay=[0.1, 0.1], track=self.track_obj)
+        self.dynamics_simulator = DynamicsSimulator(t0, sim_dynamics_config, delay=[0.1, 0.1], track=self.track_obj,
+                                                    integrator=integrator, substeps=substeps,
+                                                    rtol=integrator_tol[0] if integrator_tol else None,
+                                                    atol=integrator_tol[1] if integrator_tol else None)
         if enable_camera:
-            from gym_carla.envs.barc.cameras.carla_bridge import CarlaConnector
-            self.camera_bridge = CarlaConnector(self.track_name, host=self.host, port=self.port)
+            self.camera_bridge = self._make_camera_bridge()
+            if camera_preprocessing is not None:
+                self.camera_preprocessor = CameraPreprocessor((self.camera_bridge.height, self.camera_bridge.width, 3),
+                                                              **camera_preprocessing)
+                if hasattr(self.camera_bridge, 'preprocessor'):
+                    self.camera_bridge.preprocessor = self.camera_preprocessor
         else:
             self.camera_bridge = None
+        if enable_lidar:
+            self.range_sensor = RangeSensor(self.track_obj, n_rays=lidar_rays, fov=lidar_fov, max_range=lidar_range)
+        else:
+            self.range_sensor = None
+        self.bev_renderer = BEVRenderer(self.track_obj, size=bev_size, resolution=bev_resolution) if enable_bev else None
 
         if in_colab:
             self.visualizer = LazyLMPCVisualizer(track_obj=self.track_obj, VL=VL, VW=VW)
@@ -99,12 +184,14 @@ class BarcEnv(gym.Env):
             velocity=spaces.Box(low=-np.inf, high=np.inf, shape=(3,), dtype=np.float32),
             state=spaces.Box(low=-np.inf, high=np.inf, shape=(6,), dtype=np.float32),
         )
+        if self.enable_lidar:
+            observation_space['lidar'] = spaces.Box(low=0, high=lidar_range, shape=(lidar_rays,), dtype=np.float32)
+        if self.enable_bev:
+            observation_space['bev'] = spaces.Box(low=0, high=255, shape=tuple(bev_size), dtype=np.uint8)
         if self.enable_camera:
-            from gym_carla.envs.barc.cameras.carla_bridge import CarlaConnector
             # All images are channel-first.
             observation_space.update(dict(
-                camera=spaces.Box(low=0, high=255, shape=(self.camera_bridge.height, self.camera_bridge.width, 3),
-                                  dtype=np.uint8),
+                camera=spaces.Box(low=0, high=255, shape=self._camera_shape(), dtype=np.uint8),
                 # depth=spaces.Box(low=0, high=255, shape=(3, H, W), dtype=np.uint8),
                 # imu=spaces.Box(low=-np.inf, high=np.inf, shape=(6,), dtype=np.float64),
             ))
@@ -118,6 +205,26 @@ class BarcEnv(gym.Env):
         self.t = None
         self.max_lap_speed = self.min_lap_speed = self._sum_lap_speed = self.eps_len = 0
 
+    def _make_camera_bridge(self):
+        if self.camera_server is not None:
+            return self.camera_server.register()
+        if self.camera_backend == 'synthetic':
+            from gym_carla.envs.barc.cameras.synthetic_camera import SyntheticCamera
+            return SyntheticCamera(self.track_name, **self.camera_kwargs)
+        from gym_carla.envs.barc.cameras.carla_bridge import CarlaConnector
+        return CarlaConnector(self.track_name, host=self.host, port=self.port, pipelined=self.camera_pipelined,
+                              preprocessor=self.camera_preprocessor, **self.camera_kwargs)
+
+    def _camera_shape(self):
+        if self.camera_preprocessor is not None:
+            return self.camera_preprocessor.shape
+        return self.camera_bridge.height, self.camera_bridge.width, 3
+
+    def close(self):
+        if self.camera_server is not None and self.camera_bridge is not None:
+            self.camera_bridge.close()
+            self.camera_bridge = None
+
     def get_track(self):
         return self.track_obj
 
@@ -128,6 +235,9 @@ class BarcEnv(gym.Env):
         return np.clip(action, -self._action_bounds, self._action_bounds)
 
     def _is_new_lap(self):
+        if self.frenet:
+            return self._lap_wrapped
+
         def orientation(p, q, r):
             val = (q[1] - p[1]) * (r[0] - q[0]) - (q[0] - p[0]) * (r[1] - q[1])
             if val == 0:
@@ -177,6 +287,11 @@ class BarcEnv(gym.Env):
             self.visualizer.reset()
         elif self.visualizer is not None:
             self.visualizer.close()
+        if options is None:
+            options = {}
+        if options.get('dynamics_params') is not None:
+            # Per-episode vehicle parameters (dict or array ordered as dynamics_params), the others keep their values
+            self.dynamics_simulator.set_params(options['dynamics_params'])
         if options.get('spawning') == 'fixed':
             logger.debug("Respawning at fixed location.")
             self.sim_state = VehicleState(t=0.0,
@@ -195,6 +310,8 @@ class BarcEnv(gym.Env):
                                           v=BodyLinearVelocity(v_long=np.random.uniform(0.5, 2), v_tran=0),
                                           w=BodyAngularVelocity(w_psi=0))
         self.track_obj.local_to_global_typed(self.sim_state)
+        self._global_pose_stale = False
+        self._lap_wrapped = False
         self.last_state = copy.deepcopy(self.sim_state)
 
         self.t = self.t0
@@ -206,6 +323,12 @@ class BarcEnv(gym.Env):
         self._reset_speed_stats()
         self.eps_len = 1
 
+        if self.camera_pipelined and self.camera_bridge is not None:
+            # The first camera observation of the episode is of the reset state
+            self.camera_bridge.flush()
+        if self.camera_preprocessor is not None:
+            # The first frame of the episode fills the frame stack
+            self.camera_preprocessor.reset()
         obs, info = self._get_obs(), self._get_info()
         self.traj = [obs['gps'].copy()]
         self.v_buffer = [obs['velocity'].copy()]
@@ -225,46 +348,173 @@ class BarcEnv(gym.Env):
         self.max_lap_speed = self.min_lap_speed = self._sum_lap_speed = v
 
     def step(self, action: ActType) -> Tuple[ObsType, float, bool, bool, dict]:
+        action, rew, terminated, truncated = self._advance(action, render=True)
+
+        obs = self._get_obs()
+        info = self._get_info()
+
+        self.traj.append(obs['gps'].copy())
+        self.v_buffer.append(obs['velocity'].copy())
+        self.u_buffer.append(action.copy())
+
+        if terminated:
+            logger.info(
+                f"Lap {self.lap_no} finished in {info['lap_time']:.1f} s. "
+                f"avg_v = {info['avg_lap_speed']:.4f}, max_v = {info['max_lap_speed']:.4f}, "
+                f"min_v = {info['min_lap_speed']:.4f}")
+            self._start_new_lap()
+
+        return obs, rew, terminated, truncated, info
+
+    def _advance(self, action, render=False):
+        """
+        Apply the action and integrate the dynamics over one env step, without building observations.
+        Shared by `step` and `evaluate_action_sequences`.
+        """
         action = np.clip(action, -self._action_bounds, self._action_bounds)
         self.sim_state.u.u_a, self.sim_state.u.u_steer = action
         self.last_state = copy.deepcopy(self.sim_state)
         # self.sim_state.copy_control(action)
-        self.render()
+        if render:
+            self.render()
 
         truncated = False
-        try:
-            self.dynamics_simulator.step(self.sim_state, T=self.dt)
-            # _slack, self.track_obj.slack = self.track_obj.slack, 0.5
-            self.track_obj.global_to_local_typed(self.sim_state)
-            # self.track_obj.slack = _slack
-            # TODO: Future - replace the dynamics_simulator with other dynamics functions. (e.g. data-driven models)
-        except ValueError as e:
-            truncated = True  # The control action may drive the vehicle out of the track during the internal steps. Process the exception here immediately.
+        if self.frenet:
+            self.dynamics_simulator.step(self.sim_state, T=self.dt, update_frame=False)
+            self._global_pose_stale = True
+            # Lap wrap-around on s, leaving the track is detected from x_tran in _get_truncated
+            L = self.track_obj.track_length
+            self._lap_wrapped = self.sim_state.p.s >= L
+            if self.sim_state.p.s >= L:
+                self.sim_state.p.s -= L
+            elif self.sim_state.p.s < 0:
+                self.sim_state.p.s += L
+        else:
+            try:
+                self.dynamics_simulator.step(self.sim_state, T=self.dt)
+                # _slack, self.track_obj.slack = self.track_obj.slack, 0.5
+                self.track_obj.global_to_local_typed(self.sim_state)
+                # self.track_obj.slack = _slack
+                # TODO: Future - replace the dynamics_simulator with other dynamics functions. (e.g. data-driven models)
+            except ValueError as e:
+                truncated = True  # The control action may drive the vehicle out of the track during the internal steps. Process the exception here immediately.
 
         self.t += self.dt
         self._update_speed_stats()
 
-        obs = self._get_obs()
         rew = self._get_reward()
         terminated = self._get_terminal()
         truncated = truncated or self._get_truncated()
-        info = self._get_info()
+        return action, rew, terminated, truncated
 
-        self.traj.append(obs['gps'].copy())
-        self.v_buffer.append(obs['velocity'].copy())
-        self.u_buffer.append(action.copy())
+    def _start_new_lap(self):
+        self.lap_no += 1
+        self.lap_start = self.t
+        self._reset_speed_stats()
+        self.eps_len = 1
 
-        if terminated:
-            logger.info(
-                f"Lap {self.lap_no} finished in {info['lap_time']:.1f} s. "
-                f"avg_v = {info['avg_lap_speed']:.4f}, max_v = {info['max_lap_speed']:.4f}, "
-                f"min_v = {info['min_lap_speed']:.4f}")
-            self.lap_no += 1
-            self.lap_start = self.t
-            self._reset_speed_stats()
-            self.eps_len = 1
+    @staticmethod
+    def _vehicle_state_to_array(state: VehicleState) -> np.ndarray:
+        return np.array([state.t, state.x.x, state.x.y, state.e.psi,
+                         state.v.v_long, state.v.v_tran, state.w.w_psi,
+                         state.p.s, state.p.x_tran, state.p.e_psi,
+                         state.u.u_a, state.u.u_steer,
+                         state.a.a_long, state.a.a_tran, state.aa.a_psi], dtype=np.float64)
+
+    @staticmethod
+    def _array_to_vehicle_state(state: VehicleState, z: np.ndarray):
+        state.t, state.x.x, state.x.y, state.e.psi, \
+            state.v.v_long, state.v.v_tran, state.w.w_psi, \
+            state.p.s, state.p.x_tran, state.p.e_psi, \
+            state.u.u_a, state.u.u_steer, \
+            state.a.a_long, state.a.a_tran, state.aa.a_psi = z.tolist()
+
+    _N_VEHICLE_STATE = 15
+    _N_ENV_STATE = 8
+
+    def get_sim_state(self) -> np.ndarray:
+        """
+        Snapshot of all the dynamic state of the simulation as a flat float64 array:
+        [sim_state (15), last_state (15), t, lap_start, lap_no, eps_len, max/min/sum lap speed, lap wrapped (frenet
+        mode), input delay buffers].
+        The debug logs (traj, v_buffer, u_buffer) are not part of the snapshot.
+        """
+        if self.sim_state is None:
+            raise RuntimeError('The environment must be reset before taking a snapshot')
+        self._sync_global_pose()
+        return np.concatenate([
+            self._vehicle_state_to_array(self.sim_state),
+            self._vehicle_state_to_array(self.last_state),
+            [self.t, self.lap_start, self.lap_no, self.eps_len,
+             self.max_lap_speed, self.min_lap_speed, self._sum_lap_speed, self._lap_wrapped],
+            self.dynamics_simulator.get_delay_state(),
+        ])
+
+    def set_sim_state(self, sim_state: np.ndarray):
+        """
+        Restore a snapshot produced by `get_sim_state`. The vehicle states are updated in place.
+        """
+        if self.sim_state is None:
+            raise RuntimeError('The environment must be reset before restoring a snapshot')
+        sim_state = np.asarray(sim_state, dtype=np.float64)
+        n = self._N_VEHICLE_STATE
+        self._array_to_vehicle_state(self.sim_state, sim_state[:n])
+        self._array_to_vehicle_state(self.last_state, sim_state[n:2 * n])
+        env_state = sim_state[2 * n:2 * n + self._N_ENV_STATE]
+        self.t, self.lap_start = float(env_state[0]), float(env_state[1])
+        self.lap_no, self.eps_len = int(env_state[2]), int(env_state[3])
+        self.max_lap_speed, self.min_lap_speed, self._sum_lap_speed = env_state[4:7].tolist()
+        self._lap_wrapped = bool(env_state[7])
+        self.dynamics_simulator.set_delay_state(sim_state[2 * n + self._N_ENV_STATE:])
+        self._global_pose_stale = False
+
+    def evaluate_action_sequences(self, actions: np.ndarray, sim_state: Optional[np.ndarray] = None,
+                                  dynamics_params: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Roll out K open-loop action sequences of shape (K, H, 2) from the same snapshot
+        (the current state if `sim_state` is None). The environment is restored to the snapshot afterwards.
+        `dynamics_params` optionally gives the runtime vehicle parameters of each sequence, shape (K, n_p)
+        ordered as the `dynamics_params` of the constructor; the current parameters are restored afterwards.
+        A sequence stops at the first truncation; the remaining rewards are 0 and the remaining states NaN.
+        Returns rewards (K, H), terminated (K, H), truncated (K, H), returns (K,)
+        and states (K, H, 6) in the layout of the `state` observation.
+        """
+        actions = np.asarray(actions, dtype=np.float64)
+        if actions.ndim == 2:
+            actions = actions[None]
+        K, H = actions.shape[:2]
+        if sim_state is None:
+            sim_state = self.get_sim_state()
+
+        rewards = np.zeros((K, H))
+        terminated = np.zeros((K, H), dtype=bool)
+        truncated = np.zeros((K, H), dtype=bool)
+        states = np.full((K, H, 6), np.nan)
+        params = self.dynamics_simulator.model.p
+        if dynamics_params is not None:
+            dynamics_params = np.asarray(dynamics_params, dtype=np.float64).reshape((K, -1))
+        for k in range(K):
+            self.set_sim_state(sim_state)
+            if dynamics_params is not None:
+                self.dynamics_simulator.set_params(dynamics_params[k])
+            for h in range(H):
+                _, rewards[k, h], terminated[k, h], truncated[k, h] = self._advance(actions[k, h])
+                states[k, h] = [self.sim_state.v.v_long, self.sim_state.v.v_tran, self.sim_state.w.w_psi,
+                                self.sim_state.p.s, self.sim_state.p.x_tran, self.sim_state.p.e_psi]
+                if terminated[k, h]:
+                    self._start_new_lap()
+                if truncated[k, h]:
+                    break
+        self.set_sim_state(sim_state)
+        self.dynamics_simulator.set_params(params)
 
-        return obs, rew, terminated, truncated, info
+        return {
+            'rewards': rewards,
+            'terminated': terminated,
+            'truncated': truncated,
+            'returns': rewards.sum(axis=1),
+            'states': states,
+        }
 
     def show_debug_plot(self, axes=None):
         from matplotlib import pyplot as plt
@@ -304,9 +554,19 @@ class BarcEnv(gym.Env):
     def render(self):
         if not self.do_render:
             return
+        self._sync_global_pose()
         self.visualizer.step(self.sim_state)
 
+    def _sync_global_pose(self):
+        """
+        In the Frenet mode, reconstruct the global pose of the vehicle from (s, x_tran, e_psi) if it is out of date.
+        """
+        if self._global_pose_stale:
+            self.track_obj.local_to_global_typed(self.sim_state)
+            self._global_pose_stale = False
+
     def _get_obs(self) -> Dict[str, np.ndarray]:
+        self._sync_global_pose()
         ob = {
             'gps': np.array([self.sim_state.x.x, self.sim_state.x.y, self.sim_state.e.psi], dtype=np.float32),
             'velocity': np.array([self.sim_state.v.v_long, self.sim_state.v.v_tran, self.sim_state.w.w_psi],
@@ -316,21 +576,14 @@ class BarcEnv(gym.Env):
             # self.sim_state.x.x, self.sim_state.x.y, self.sim_state.e.psi], dtype=np.float32),
             # For backward compatibility.
         }
+        if self.enable_lidar:
+            ob['lidar'] = self.range_sensor.cast([self.sim_state.x.x, self.sim_state.x.y, self.sim_state.e.psi])[0].astype(np.float32)
+        if self.enable_bev:
+            ob['bev'] = self.bev_renderer.render([self.sim_state.x.x, self.sim_state.x.y, self.sim_state.e.psi])[0]
         if self.enable_camera:
-            while True:
-                try:
-                    camera = self.camera_bridge.query_rgb(self.sim_state)
-                    break
-                except RuntimeError as e:
-                    logger.error(e)
-                from gym_carla.envs.barc.cameras.carla_bridge import CarlaConnector
-                while True:
-                    time.sleep(10)
-                    try:
-                        self.camera_bridge = CarlaConnector(self.track_name, self.host, self.port)
-                        break
-                    except RuntimeError as e:
-                        logger.error(e)
+            camera = self._query_camera()
+            if self.camera_preprocessor is not None and getattr(self.camera_bridge, 'preprocessor', None) is None:
+                camera = self.camera_preprocessor(camera)
             ob.update({
                 'camera': camera,
                 # 'depth': None,
@@ -338,6 +591,30 @@ class BarcEnv(gym.Env):
             })
         return ob
 
+    def _query_camera(self) -> np.ndarray:
+        """
+        Camera image at the current state. The connection of the env to CARLA is rebuilt after a failure, at most
+        camera_retries times. The errors of a shared camera_server are raised, the env does not rebuild the server.
+        """
+        error = None
+        for attempt in range(self.camera_retries + 1):
+            if attempt > 0:
+                time.sleep(self.camera_retry_wait)
+                try:
+                    self.camera_bridge = self._make_camera_bridge()
+                except RuntimeError as e:
+                    logger.error(e)
+                    error = e
+                    continue
+            try:
+                return self.camera_bridge.query_rgb(self.sim_state)
+            except RuntimeError as e:
+                if self.camera_server is not None:
+                    raise
+                logger.error(e)
+                error = e
+        raise RuntimeError(f'The camera failed {self.camera_retries + 1} times') from error
+
     def _get_reward(self) -> float:
         ds = self.sim_state.p.s - self.last_state.p.s
         if self._is_new_lap() and self.sim_state.p.s < self.last_state.p.s:
@@ -359,14 +636,16 @@ class BarcEnv(gym.Env):
         This should be used for truncating the rollout (resetting the simulation).
         """
         conditions = [
-            np.abs(self.sim_state.p.x_tran) > self.track_obj.half_width,  # Out of track.
+            self.track_obj.footprint_off_track((self.sim_state.p.s, self.sim_state.p.x_tran, self.sim_state.p.e_psi),
+                                               self.VL, self.VW),  # Part of the car out of track.
             self.lap_no >= self.max_n_laps,  # Maximum lap number reached.
-            self.sim_state.v.v_long < 0.25,
+            self.sim_state.v.v_long < self._min_v_long,
             np.abs(self.sim_state.p.e_psi) > np.pi / 2,
         ]
         return any(conditions)
 
     def _get_info(self) -> Dict[str, Union[VehicleState, int, float]]:
+        self._sync_global_pose()
         return {
             'vehicle_state': copy.deepcopy(self.sim_state),  # Ground truth vehicle state.
             'lap_no': self.lap_no,  # Lap number
@@ -375,4 +654,5 @@ class BarcEnv(gym.Env):
             'max_lap_speed': self.max_lap_speed,  # Max velocity of the current lap.
             'min_lap_speed': self.min_lap_speed,  # Min velocity of the current lap.
             'lap_time': self.eps_len * self.dt,  # Time elapsed so far in the current lap.
+            'dynamics_params': self.dynamics_simulator.get_params(),  # Current values of the runtime vehicle parameters.
         }
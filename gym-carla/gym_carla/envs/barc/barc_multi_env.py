@@ -0,0 +1,363 @@
+import copy
+from typing import Tuple, Optional, Dict, List
+
+import gymnasium as gym
+from gymnasium import spaces
+import numpy as np
+
+from mpclab_common.pytypes import VehicleState, ParametricPose, BodyLinearVelocity, BodyAngularVelocity
+from mpclab_common.track import get_track
+from mpclab_common.models.dynamics_models import get_dynamics_model, CasadiDecoupledMultiAgentDynamicsModel
+from mpclab_common.models.model_types import MultiAgentModelConfig
+
+from mpclab_simulation.collision import CollisionChecker
+from mpclab_simulation.range_sensor import RangeSensor
+from mpclab_simulation.bev_renderer import BEVRenderer
+
+from loguru import logger
+
+from gym_carla.envs.barc.barc_env import barc_dynamics_config
+
+
+class BarcMultiEnv(gym.Env):
+    """
+    K BARC vehicles racing on the same track, stepped in lockstep.
+
+    All agents share one dynamics model (same vehicle config), so CasadiDecoupledMultiAgentDynamicsModel advances
+    them with a single mapped call of its discrete time dynamics, and the track frame poses are updated with one
+    batched projection per env step. The vehicle parameters listed in dynamics_params are runtime parameters of the
+    model, which every agent sets to its own values (e.g. a heavier car, or one with less grip).
+    Actions are (K, 2) arrays, observations are dicts of stacked (K, ...) arrays, rewards, terminated and truncated
+    are (K,) arrays. `agent_obs_info` splits them into the observation and info of a single agent, in the format of
+    BarcEnv, to drive per-agent controllers.
+    Vehicle-to-vehicle collisions are checked at every simulation substep and reported in info['contacts'] (the pairs
+    of agents in contact during the env step, with the largest penetration depth and its normal) and
+    info['in_collision'], the cars are not pushed apart. The broad phase runs once per env step on the track progress
+    (on the global x when a car is off the track), widened by the distance the cars can travel in dt, and only the
+    narrow phase runs at the substeps.
+    """
+    metadata = {'render.modes': []}
+
+    def __init__(self, track_name, n_agents=2, t0=0., dt=0.1, dt_sim=0.01, max_n_laps=100,
+                 integrator='rk4', substeps=2, delay=0.1, check_collisions=True, VL=0.37, VW=0.195,
+                 enable_lidar=False, lidar_rays=32, lidar_fov=2 * np.pi, lidar_range=4.,
+                 enable_bev=False, bev_size=(64, 64), bev_resolution=0.05, dynamics_params=None):
+        # integrator, substeps: fixed step integration of every dt_sim step (see benchmarks/bench_integrators.py)
+        # delay: input delay in seconds, as the DynamicsSimulator of BarcEnv
+        # check_collisions: detect contacts between the VL x VW footprints of the cars
+        # enable_lidar: add the (K, lidar_rays) distances to the track boundaries to the observation ('lidar'), cast
+        # for all the agents at once (see BarcEnv, the other cars are not detected)
+        # enable_bev: add the (K, *bev_size) top-down views of the drivable area to the observation ('bev', see BarcEnv)
+        # dynamics_params: names of DynamicBicycleConfig fields (e.g. ['mass', 'wheel_friction']) that are set per agent,
+        # at every reset with options={'dynamics_params': ...} (see reset), or one dict of the values of these fields
+        # per agent (e.g. [{'mass': 2.0}, {'mass': 3.0}]), the fields an agent does not give keep the BARC values
+        self.track_obj = get_track(track_name)
+        self.track_name = track_name
+        self.n_agents = n_agents
+        self.t0 = t0
+        self.dt = dt
+        self.dt_sim = dt_sim
+        self.max_n_laps = max_n_laps
+        self.VL, self.VW = VL, VW
+        self._n_sim_steps = int(round(dt / dt_sim))
+
+        agent_params = None
+        if dynamics_params is not None and any(isinstance(p, dict) for p in dynamics_params):
+            if len(dynamics_params) != n_agents:
+                raise ValueError('Expected the dynamics parameters of %i agents, got %i' % (n_agents, len(dynamics_params)))
+            agent_params = dynamics_params
+            dynamics_params = list(dict.fromkeys(n for p in agent_params for n in p))
+        sim_dynamics_config = barc_dynamics_config(dt_sim, discretization_method=integrator, M=substeps,
+                                                   params=dynamics_params)
+        model = get_dynamics_model(t0, sim_dynamics_config, track=self.track_obj)
+        self.dynamics_model = CasadiDecoupledMultiAgentDynamicsModel(t0, [model] * n_agents,
+                                                                     MultiAgentModelConfig(dt=dt_sim, batch_parallelization='serial'))
+        if agent_params is not None:
+            self.set_dynamics_params(agent_params)
+
+        self.collision_checker = CollisionChecker(VL=VL, VW=VW, track=self.track_obj) if check_collisions else None
+        self._contacts = CollisionChecker.no_contacts()
+        self.range_sensor = RangeSensor(self.track_obj, n_rays=lidar_rays, fov=lidar_fov,
+                                        max_range=lidar_range) if enable_lidar else None
+        self.bev_renderer = BEVRenderer(self.track_obj, size=bev_size, resolution=bev_resolution) if enable_bev else None
+
+        # Input delay line shared by both channels, read at _delay_idx and overwritten with the new input
+        self._delay_steps = int(delay / dt_sim)
+        self._delay_buffer = np.zeros((n_agents, self._delay_steps, 2))
+        self._delay_idx = 0
+
+        K = n_agents
+        observation_space = dict(
+            gps=spaces.Box(low=-np.inf, high=np.inf, shape=(K, 3), dtype=np.float32),
+            velocity=spaces.Box(low=-np.inf, high=np.inf, shape=(K, 3), dtype=np.float32),
+            state=spaces.Box(low=-np.inf, high=np.inf, shape=(K, 6), dtype=np.float32),
+            # relative_progress[i, j]: progress (laps * track length + s) of agent j minus that of agent i
+            relative_progress=spaces.Box(low=-np.inf, high=np.inf, shape=(K, K), dtype=np.float32),
+            # gaps[i]: distance along the track, x_tran and v_long difference to the next agent ahead, then the same behind
+            gaps=spaces.Box(low=-np.inf, high=np.inf, shape=(K, 6), dtype=np.float32),
+        )
+        if enable_lidar:
+            observation_space['lidar'] = spaces.Box(low=0, high=lidar_range, shape=(K, lidar_rays), dtype=np.float32)
+        if enable_bev:
+            observation_space['bev'] = spaces.Box(low=0, high=255, shape=(K, *bev_size), dtype=np.uint8)
+        self.observation_space = spaces.Dict(observation_space)
+        self._action_bounds = np.array([2, 0.45])
+        self.action_space = spaces.Box(low=np.tile(-self._action_bounds, (K, 1)),
+                                       high=np.tile(self._action_bounds, (K, 1)), dtype=np.float64)
+
+        self.sim_states: List[VehicleState] = None
+        self.t = None
+        self.lap_no = np.zeros(K, dtype=int)
+        self.off_track = np.zeros(K, dtype=bool)
+
+    def get_track(self):
+        return self.track_obj
+
+    def set_dynamics_params(self, params):
+        """
+        Sets the runtime vehicle parameters of the agents: one dict or array (ordered as dynamics_params) per agent, or
+        a (K, n_p) array, the fields a dict does not give keep their values
+        """
+        if isinstance(params, dict):
+            raise ValueError('Expected one set of dynamics parameters per agent, got a dict')
+        if len(params) != self.n_agents:
+            raise ValueError('Expected the dynamics parameters of %i agents, got %i' % (self.n_agents, len(params)))
+        for i, p in enumerate(params):
+            self.dynamics_model.set_agent_params(i, p)
+
+    def get_dynamics_params(self) -> List[dict]:
+        return [self.dynamics_model.get_agent_params(i) for i in range(self.n_agents)]
+
+    def reset(
+            self,
+            *,
+            seed: Optional[int] = None,
+            options: Optional[dict] = None,
+    ) -> Tuple[Dict[str, np.ndarray], dict]:
+        if seed is not None:
+            np.random.seed(seed)
+        if options is None:
+            options = {}
+        if options.get('dynamics_params') is not None:
+            # Per-episode vehicle parameters of every agent (see set_dynamics_params)
+            self.set_dynamics_params(options['dynamics_params'])
+        K, L = self.n_agents, self.track_obj.track_length
+        if options.get('spawning') == 'fixed':
+            logger.debug("Respawning at fixed locations.")
+            spacing = min(1.0, L / K)
+            self.sim_states = [VehicleState(t=0.0,
+                                            p=ParametricPose(s=np.mod(0.1 + i * spacing, L), x_tran=0),
+                                            v=BodyLinearVelocity(v_long=0.5, v_tran=0),
+                                            w=BodyAngularVelocity(w_psi=0)) for i in range(K)]
+        else:
+            w = self.track_obj.half_width + self.track_obj.slack
+            self.sim_states = [VehicleState(t=0.0,
+                                            p=ParametricPose(s=np.random.uniform(0.1, L - 2),
+                                                             x_tran=np.random.uniform(-w, w),
+                                                             e_psi=np.random.uniform(-np.pi / 6, np.pi / 6)),
+                                            v=BodyLinearVelocity(v_long=np.random.uniform(0.5, 2), v_tran=0),
+                                            w=BodyAngularVelocity(w_psi=0)) for _ in range(K)]
+        xy = self.track_obj.local_to_global_batch([[st.p.s, st.p.x_tran, st.p.e_psi] for st in self.sim_states])
+        for st, (x, y, psi) in zip(self.sim_states, xy.tolist()):
+            st.x.x, st.x.y, st.e.psi = x, y, psi
+
+        self._delay_buffer[:] = 0
+        self._delay_idx = 0
+        self.t = self.t0
+        self.lap_no = np.zeros(K, dtype=int)
+        self.off_track = np.zeros(K, dtype=bool)
+        self._terminated = np.zeros(K, dtype=bool)
+        self._contacts = CollisionChecker.no_contacts()
+        return self._get_obs(), self._get_info()
+
+    def step(self, action: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, np.ndarray, dict]:
+        action = np.clip(np.asarray(action, dtype=np.float64).reshape((self.n_agents, 2)),
+                         -self._action_bounds, self._action_bounds)
+        s_last = np.array([st.p.s for st in self.sim_states])
+
+        contacts, candidates = dict(), None
+        if self.collision_checker is not None:
+            # Bound on the distance travelled by any car in dt, with the largest acceleration
+            v = np.array([np.hypot(st.v.v_long, st.v.v_tran) for st in self.sim_states])
+            margin = (v.max() + self._action_bounds[0] * self.dt) * self.dt
+            # Sweep on the track progress, which only bounds the distance between the cars that are on the track
+            x_tran = np.array([st.p.x_tran for st in self.sim_states])
+            on_track = not self.off_track.any() and \
+                (np.abs(x_tran) <= self.track_obj.half_width + getattr(self.track_obj, 'slack', 0)).all()
+            candidates = self.collision_checker.broad_phase(self._poses(), s=s_last if on_track else None, margin=margin)
+        for _ in range(self._n_sim_steps):
+            u = self._apply_delay(action)
+            for st, (u_a, u_steer) in zip(self.sim_states, u.tolist()):
+                st.u.u_a, st.u.u_steer = u_a, u_steer
+            # The track frame pose is not needed by the global model, it is only updated once per env step
+            self.dynamics_model.step(self.sim_states, update_frame=False)
+            if candidates is not None and candidates.shape[0] > 0:
+                self._check_collisions(candidates, contacts)
+        self._contacts = self._merge_contacts(contacts)
+        self.t += self.dt
+        self.off_track = self._update_track_frame()
+
+        L = self.track_obj.track_length
+        s = np.array([st.p.s for st in self.sim_states])
+        ds = s - s_last
+        new_lap = ds < -L / 2
+        ds[new_lap] += L
+        ds[ds > L / 2] -= L  # Crossed the start line backwards
+        self.lap_no += new_lap
+        self._terminated = new_lap
+
+        rew = ds
+        terminated = new_lap
+        truncated = self._get_truncated()
+        return self._get_obs(), rew, terminated, truncated, self._get_info()
+
+    def _poses(self) -> np.ndarray:
+        return np.array([[st.x.x, st.x.y, st.e.psi] for st in self.sim_states])
+
+    def _check_collisions(self, candidates: np.ndarray, contacts: dict):
+        """
+        Adds the contacts among the candidate pairs at the current substep to contacts (pair -> (depth, normal)),
+        keeping the deepest one of each pair
+        """
+        pairs, depth, normal = self.collision_checker.narrow_phase(self._poses(), candidates)
+        for pair, d, n in zip(map(tuple, pairs.tolist()), depth.tolist(), normal):
+            if pair not in contacts or contacts[pair][0] < d:
+                contacts[pair] = (d, n)
+
+    @staticmethod
+    def _merge_contacts(contacts: dict) -> dict:
+        if not contacts:
+            return CollisionChecker.no_contacts()
+        pairs = sorted(contacts.keys())
+        return {'pairs': np.array(pairs, dtype=int),
+                'depth': np.array([contacts[p][0] for p in pairs]),
+                'normal': np.array([contacts[p][1] for p in pairs])}
+
+    def _apply_delay(self, u_new: np.ndarray) -> np.ndarray:
+        if self._delay_steps == 0:
+            return u_new
+        u = self._delay_buffer[:, self._delay_idx].copy()
+        self._delay_buffer[:, self._delay_idx] = u_new
+        self._delay_idx = (self._delay_idx + 1) % self._delay_steps
+        return u
+
+    def _update_track_frame(self) -> np.ndarray:
+        """
+        Projects all the agents on the track in one batched call, returns the mask of the agents that left the track
+        (their track frame pose keeps its last value).
+        """
+        xy = np.array([[st.x.x, st.x.y, st.e.psi] for st in self.sim_states])
+        off_track = np.zeros(self.n_agents, dtype=bool)
+        try:
+            cl = self.track_obj.global_to_local_batch(xy)
+        except ValueError:
+            cl = np.array([[st.p.s, st.p.x_tran, st.p.e_psi] for st in self.sim_states])
+            for i in range(self.n_agents):
+                try:
+                    cl[i] = self.track_obj.global_to_local(xy[i])
+                except ValueError:
+                    off_track[i] = True
+        for st, (s, x_tran, e_psi) in zip(self.sim_states, cl.tolist()):
+            st.p.s, st.p.x_tran, st.p.e_psi = s, x_tran, e_psi
+        return off_track
+
+    def _get_truncated(self) -> np.ndarray:
+        """
+        Per-agent constraint violation or maximum lap reached, as BarcEnv._get_truncated.
+        """
+        s, x_tran, e_psi, v_long = np.array([[st.p.s, st.p.x_tran, st.p.e_psi, st.v.v_long] for st in self.sim_states]).T
+        return self.off_track \
+            | self.track_obj.footprint_off_track_batch(np.column_stack([s, x_tran, e_psi]), self.VL, self.VW) \
+            | (self.lap_no >= self.max_n_laps) \
+            | (v_long < 0.25) \
+            | (np.abs(e_psi) > np.pi / 2)
+
+    def _relative_features(self, state: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Relative progress (K, K) and gaps to the agents directly ahead and behind (K, 6) from the stacked states.
+        """
+        K, L = self.n_agents, self.track_obj.track_length
+        v_long, s, x_tran = state[:, 0], state[:, 3], state[:, 4]
+        progress = self.lap_no * L + s
+        relative_progress = progress[None, :] - progress[:, None]
+
+        gaps = np.zeros((K, 6))
+        if K > 1:
+            # d[i, j]: distance along the track from agent i forward to agent j
+            d = np.mod(s[None, :] - s[:, None], L)
+            np.fill_diagonal(d, np.inf)
+            d_behind = d.T.copy()
+            ahead, behind = np.argmin(d, axis=1), np.argmin(d_behind, axis=1)
+            idx = np.arange(K)
+            gaps[:, 0], gaps[:, 1], gaps[:, 2] = d[idx, ahead], x_tran[ahead] - x_tran, v_long[ahead] - v_long
+            gaps[:, 3], gaps[:, 4], gaps[:, 5] = d_behind[idx, behind], x_tran[behind] - x_tran, v_long[behind] - v_long
+        else:
+            gaps[:, 0] = gaps[:, 3] = L
+        return relative_progress, gaps
+
+    def _get_obs(self) -> Dict[str, np.ndarray]:
+        z = np.array([[st.x.x, st.x.y, st.e.psi,
+                       st.v.v_long, st.v.v_tran, st.w.w_psi,
+                       st.p.s, st.p.x_tran, st.p.e_psi] for st in self.sim_states])
+        state = z[:, 3:]
+        relative_progress, gaps = self._relative_features(state)
+        ob = {
+            'gps': z[:, :3].astype(np.float32),
+            'velocity': z[:, 3:6].astype(np.float32),
+            'state': state.astype(np.float32),
+            'relative_progress': relative_progress.astype(np.float32),
+            'gaps': gaps.astype(np.float32),
+        }
+        if self.range_sensor is not None:
+            ob['lidar'] = self.range_sensor.cast(z[:, :3]).astype(np.float32)
+        if self.bev_renderer is not None:
+            ob['bev'] = self.bev_renderer.render(z[:, :3])
+        return ob
+
+    def _get_info(self) -> dict:
+        progress = self.lap_no * self.track_obj.track_length + np.array([st.p.s for st in self.sim_states])
+        rank = np.empty(self.n_agents, dtype=int)
+        rank[np.argsort(-progress, kind='stable')] = np.arange(self.n_agents)
+        return {
+            'vehicle_states': copy.deepcopy(self.sim_states),  # Ground truth vehicle states.
+            'lap_no': self.lap_no.copy(),
+            'terminated': self._terminated.copy(),
+            'off_track': self.off_track.copy(),
+            'contacts': self._contacts,
+            'in_collision': CollisionChecker.in_collision(self._contacts, self.n_agents),
+            'rank': rank,  # Race position, 0 is the leader.
+            'dynamics_params': self.get_dynamics_params(),  # Current values of the runtime vehicle parameters.
+        }
+
+    @staticmethod
+    def agent_obs_info(obs: Dict[str, np.ndarray], info: dict, i: int) -> Tuple[Dict[str, np.ndarray], dict]:
+        """
+        Observation and info of agent i, with the keys of BarcEnv (so single agent controllers can be stepped with
+        `controller.step(**ob, **info)`) and the relative features of the agent.
+        """
+        ob = {k: v[i] for k, v in obs.items()}
+        agent_info = {
+            'vehicle_state': info['vehicle_states'][i],
+            'lap_no': int(info['lap_no'][i]),
+            'terminated': bool(info['terminated'][i]),
+            'rank': int(info['rank'][i]),
+            'dynamics_params': info['dynamics_params'][i],
+        }
+        return ob, agent_info
+
+
+if __name__ == '__main__':
+    from controllers.barc_pid import PIDWrapper
+
+    env = gym.make('barc-multi-v0', track_name='L_track_barc', n_agents=4)
+    experts = [PIDWrapper(dt=0.1, t0=0., track_obj=env.unwrapped.get_track()) for _ in range(4)]
+    ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+    for expert in experts:
+        expert.reset(seed=0, options=info)
+    for _ in range(200):
+        ac = np.stack([expert.step(**ob_i, **info_i)[0] for expert, (ob_i, info_i) in
+                       zip(experts, [env.unwrapped.agent_obs_info(ob, info, i) for i in range(4)])])
+        ob, rew, terminated, truncated, info = env.step(ac)
+        if truncated.any():
+            break
+    print('rank', info['rank'], 'laps', info['lap_no'], 'gaps', ob['gaps'][:, 0])
@@ -0,0 +1,156 @@
+import threading
+
+import numpy as np
+
+from gym_carla.envs.barc.cameras.carla_bridge import carla, generate_track_world, camera_blueprint, camera_transform, \
+    FrameBuffer
+
+
+class SharedCamera:
+    """
+    Camera of one vehicle on a CarlaCameraServer, with the query_rgb / height / width interface of CarlaConnector.
+    """
+    def __init__(self, server, sensor, frames: FrameBuffer):
+        self.server = server
+        self.sensor = sensor
+        self.frames = frames
+
+    @property
+    def height(self):
+        return self.server.obs_size
+
+    @property
+    def width(self):
+        return self.server.obs_size
+
+    def query_rgb(self, state):
+        return self.server.query_rgb(self, state)
+
+    def close(self):
+        self.server.deregister(self)
+
+
+class CarlaCameraServer:
+    """
+    One CARLA world (generated once from the OpenDRIVE map of the track) shared by the cameras of many vehicles, e.g.
+    the envs of a vectorized env: register() spawns an RGB sensor and returns its SharedCamera, which BarcEnv uses as
+    its camera (BarcEnv(enable_camera=True, camera_server=server)).
+
+    The world is ticked once per batched step:
+    - query_rgb_batch(cameras, states) moves the given cameras, ticks and returns their images, for envs stepped in
+      one loop,
+    - SharedCamera.query_rgb(state) (the envs stepped in their own threads) records the pose of the camera and waits
+      until the other cameras expected at this tick have a pose, the last one moves all of them and ticks.
+      The cameras that have not come within gather_timeout (e.g. the envs not stepped, as in a plain reset() of one
+      env) are ticked without, and are no longer expected until their next query. While the last tick was requested
+      from a single thread (envs stepped one after the other), the cameras last queried from the calling thread are
+      not waited for. After a tick requested from several threads all the expected cameras are, as the envs of a
+      thread pool may be stepped by another thread at each step.
+    Each sensor streams its images to the ring buffer of its camera, and the images are matched to the tick by frame id.
+    """
+    def __init__(self, track_name, host='localhost', port=2000, n_buffers=4, timeout=10., gather_timeout=1.,
+                 carla_module=None):
+        self.carla = carla_module if carla_module is not None else carla
+        if self.carla is None:
+            raise ImportError('The carla package is not installed (see fake_carla to run without a CARLA server)')
+        self.client = self.carla.Client(host, port)
+        self.client.set_timeout(timeout)
+        self.timeout = timeout
+        self.gather_timeout = gather_timeout
+        self.track_name = track_name
+        self.obs_size = 224
+        self.dt = 0.1
+        self.n_buffers = n_buffers
+        self.world = generate_track_world(self.client, self.carla, track_name, self.dt)
+        self.camera_bp = camera_blueprint(self.world, self.obs_size)
+
+        self.cameras = []
+        # Pose of the cameras waiting for the next tick, cameras expected at the next tick, thread of the last query
+        # of each camera and whether the last tick was requested from a single thread
+        self._requests = {}
+        self._expected = set()
+        self._threads = {}
+        self._single_thread = True
+        self._ticked = threading.Condition()
+        self._batch = 0
+        self._frame = None
+        self.n_ticks = 0
+
+    def register(self) -> SharedCamera:
+        sensor = self.world.spawn_actor(self.camera_bp, camera_transform(self.carla, 0., 0., 0.))
+        frames = FrameBuffer(self.n_buffers, self.obs_size, self.obs_size)
+        sensor.listen(frames.on_image)
+        camera = SharedCamera(self, sensor, frames)
+        with self._ticked:
+            self.cameras.append(camera)
+            self._expected.add(camera)
+        return camera
+
+    def deregister(self, camera: SharedCamera):
+        with self._ticked:
+            if camera not in self.cameras:
+                return
+            self.cameras.remove(camera)
+            self._requests.pop(camera, None)
+            self._expected.discard(camera)
+            self._threads.pop(camera, None)
+            # The cameras waiting may have been waiting for this one only
+            if self._requests and self._all_requested():
+                self._tick()
+        camera.sensor.destroy()
+
+    def _tick(self):
+        # Called with the lock held: move the requesting cameras and tick once for all of them
+        try:
+            for camera, (x, y, psi) in self._requests.items():
+                camera.sensor.set_transform(camera_transform(self.carla, x, y, psi))
+            self._single_thread = len({self._threads[camera] for camera in self._requests}) <= 1
+            self._frame = self.world.tick()
+            self.n_ticks += 1
+        except RuntimeError as e:
+            self._frame = e
+        self._requests.clear()
+        self._batch += 1
+        self._ticked.notify_all()
+
+    def _all_requested(self) -> bool:
+        # Whether every expected camera has a pose, except, for envs stepped one after the other, those of the calling
+        # thread, which cannot come while it waits
+        thread = threading.get_ident()
+        return all(camera in self._requests or (self._single_thread and self._threads.get(camera) == thread)
+                   for camera in self._expected)
+
+    def _tick_frame(self) -> int:
+        if isinstance(self._frame, Exception):
+            raise RuntimeError(f'CARLA tick failed: {self._frame}')
+        return self._frame
+
+    def query_rgb(self, camera: SharedCamera, state) -> np.ndarray:
+        """
+        image of the camera at the state, waits for the poses of the other cameras expected at this tick (see the class)
+        """
+        with self._ticked:
+            self._requests[camera] = (state.x.x, state.x.y, state.e.psi)
+            self._threads[camera] = threading.get_ident()
+            self._expected.add(camera)
+            batch = self._batch
+            if not self._all_requested() and \
+                    not self._ticked.wait_for(lambda: self._batch != batch, timeout=self.gather_timeout):
+                # The cameras that did not come are ticked without, and not waited for until they come again
+                self._expected = set(self._requests)
+            if self._batch == batch:
+                self._tick()
+            frame = self._tick_frame()
+        return camera.frames.wait(frame, self.timeout)
+
+    def query_rgb_batch(self, cameras, states) -> np.ndarray:
+        """
+        images (N, H, W, 3) of the cameras at the states, with a single tick
+        """
+        with self._ticked:
+            for camera, state in zip(cameras, states):
+                self._requests[camera] = (state.x.x, state.x.y, state.e.psi)
+                self._threads[camera] = threading.get_ident()
+            self._tick()
+            frame = self._tick_frame()
+        return np.stack([camera.frames.wait(frame, self.timeout) for camera in cameras])
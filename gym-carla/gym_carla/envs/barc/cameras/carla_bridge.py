@@ -1,5 +1,8 @@
 import os
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
 
 import numpy as np
 from loguru import logger
@@ -9,15 +12,14 @@ from matplotlib import pyplot as plt
 from mpclab_common.track import get_track
 from mpclab_common.pytypes import VehicleState
 
-import carla
+try:
+    import carla
+except ImportError:
+    carla = None  # Only usable with carla_module=fake_carla.
 from pathlib import Path
 import time
 
-import pygame
-import skimage
-
-
-DEBUG = True
+# pygame and skimage are only needed to display the camera (headless=False)
 
 
 def rgb_to_display_surface(rgb, display_size):
@@ -27,6 +29,8 @@ def rgb_to_display_surface(rgb, display_size):
     :param display_size: display size
     :return: pygame surface
     """
+    import pygame
+    import skimage
     surface = pygame.Surface((display_size, display_size)).convert()
     display = skimage.transform.resize(rgb, (display_size, display_size))
     display = np.flip(display, axis=1)
@@ -35,18 +39,151 @@ def rgb_to_display_surface(rgb, display_size):
     return surface
 
 
+def generate_track_world(client, carla_module, track_name, dt):
+    """
+    Generate the CARLA world of the OpenDRIVE map of the track (see generate_xodr_arc_length.py), in synchronous mode
+    with a fixed time step dt.
+    """
+    xodr_path = Path(__file__).resolve().parents[1] / 'OpenDrive' / f"{track_name}.xodr"
+    if not os.path.exists(xodr_path):
+        raise ValueError(f"The file {xodr_path} does not exist.")
+
+    with open(xodr_path, encoding='utf-8') as od_file:
+        try:
+            data = od_file.read()
+        except OSError:
+            print('file could not be read.')
+            sys.exit()
+    print('load opendrive map %r.' % os.path.basename(xodr_path))
+    vertex_distance = 2.0  # in meters
+    max_road_length = 0.1  # in meters
+    wall_height = 0.2      # in meters
+    extra_width = 0.1       # in meters
+    world = client.generate_opendrive_world(
+                    data, carla_module.OpendriveGenerationParameters(
+                        vertex_distance=vertex_distance,
+                        max_road_length=max_road_length,
+                        wall_height=wall_height,
+                        additional_width=extra_width,
+                        smooth_junctions=True,
+                        enable_mesh_visibility=True))
+    spectator = world.get_spectator()
+    spectator.set_transform(carla_module.Transform(carla_module.Location(x=5, y=-5, z=10),
+                                                   carla_module.Rotation(pitch=-45, yaw=-45)))
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = dt
+    world.apply_settings(settings)
+    return world
+
+
+def camera_blueprint(world, obs_size):
+    camera_bp = world.get_blueprint_library().find('sensor.camera.rgb')
+    camera_bp.set_attribute('image_size_x', str(obs_size))
+    camera_bp.set_attribute('image_size_y', str(obs_size))
+    camera_bp.set_attribute('fov', '110')
+    # Set the time in seconds between sensor captures
+    camera_bp.set_attribute('sensor_tick', '0.02')
+    return camera_bp
+
+
+def camera_transform(carla_module, x, y, psi):
+    """
+    Camera pose at the vehicle pose (x, y, psi), CARLA uses a left-handed frame (y and the yaw are flipped)
+    """
+    return carla_module.Transform(carla_module.Location(x=x, y=-y, z=0.2), carla_module.Rotation(yaw=-np.rad2deg(psi)))
+
+
+class FrameBuffer:
+    """
+    Ring of n_buffers preallocated RGB images written by a sensor callback (on_image), tagged with their CARLA frame
+    id, wait(frame) blocks until the image of the frame is received.
+    With a preprocessor (set_preprocessor), the callback also preprocesses every image into a second ring, so the
+    preprocessing runs in the sensor thread as the images arrive.
+    """
+    def __init__(self, n_buffers, height, width):
+        self.buffers = np.zeros((n_buffers, height, width, 3), dtype=np.uint8)
+        # frame_ids[i] is the frame of buffers[i] (-1 while written)
+        self.frame_ids = np.full(n_buffers, -1)
+        self._frame_ready = threading.Condition()
+        self.preprocessor = None
+        self.processed = None
+
+    def set_preprocessor(self, preprocessor):
+        with self._frame_ready:
+            self.preprocessor = preprocessor
+            self.processed = None if preprocessor is None else \
+                np.zeros((len(self.buffers), *preprocessor.frame_shape), dtype=np.uint8)
+            self.frame_ids[:] = -1
+
+    def on_image(self, data):
+        # Sensor thread: BGRA to RGB in the buffer of the frame
+        i = data.frame % len(self.frame_ids)
+        with self._frame_ready:
+            self.frame_ids[i] = -1
+        array = np.frombuffer(data.raw_data, dtype=np.uint8).reshape((data.height, data.width, 4))
+        np.copyto(self.buffers[i], array[:, :, 2::-1])
+        if self.preprocessor is not None:
+            self.preprocessor.apply(self.buffers[i], out=self.processed[i])
+        with self._frame_ready:
+            self.frame_ids[i] = data.frame
+            self._frame_ready.notify_all()
+
+    def wait(self, frame: int, timeout: float) -> np.ndarray:
+        """
+        copy of the image of the frame, with a preprocessor its processed buffer (no copy, only valid until
+        n_buffers - 1 more frames are received)
+        """
+        i = frame % len(self.frame_ids)
+        with self._frame_ready:
+            if not self._frame_ready.wait_for(lambda: self.frame_ids[i] == frame, timeout=timeout):
+                raise RuntimeError(f'No camera image received for frame {frame}')
+            return self.buffers[i].copy() if self.preprocessor is None else self.processed[i]
+
+
 class CarlaConnector:
-    def __init__(self, track_name, host='localhost', port=2000):
+    """
+    RGB camera following the vehicle in a CARLA world generated from the OpenDRIVE map of the track, in synchronous
+    mode: every query moves the camera, ticks the world and waits for the image of that tick.
+
+    The sensor thread writes the images in a ring of n_buffers preallocated frames, tagged with their frame id, and a
+    query waits for the frame id returned by its tick (instead of reading whatever image came last).
+    pipelined: the move and tick run in a worker thread, and query_rgb returns the image of the previous query, so
+    the CARLA tick and rendering of step k overlap the simulation of step k+1 in BarcEnv (the images lag one step).
+    flush() waits for the pending query, the next query_rgb then returns its own image (e.g. after a reset).
+    headless: no display of the camera images (otherwise shown in a pygame window, without frame rate limit).
+    health_check_interval: every that many queries, and whenever a query fails, check_health() respawns the camera
+    if it stopped streaming, in the loaded world (the world is only generated again if it is gone).
+    carla_module: module providing the carla API, the carla package by default, fake_carla to run without a server.
+    preprocessor: CameraPreprocessor applied to the images in the sensor thread as they are received (overlapped with
+    the simulation in pipelined mode), query_rgb then returns its observations.
+    """
+    def __init__(self, track_name, host='localhost', port=2000, pipelined=False, n_buffers=4, timeout=10.,
+                 headless=True, health_check_interval=1000, carla_module=None, preprocessor=None):
+        self.carla = carla_module if carla_module is not None else carla
+        if self.carla is None:
+            raise ImportError('The carla package is not installed (see fake_carla to run without a CARLA server)')
         # self.client = carla.Client('localhost', 2000)
-        self.client = carla.Client(host, port)
-        self.client.set_timeout(10.0)
+        self.client = self.carla.Client(host, port)
+        self.client.set_timeout(timeout)
+        self.timeout = timeout
 
         self.obs_size = 224
         self.dt = 0.1
 
         self.camera_img = np.empty((self.obs_size, self.obs_size, 3), dtype=np.uint8)
+        self._frames = FrameBuffer(n_buffers, self.obs_size, self.obs_size)
+        self.pipelined = pipelined
+        self._frames.set_preprocessor(preprocessor)
+        self._executor = ThreadPoolExecutor(max_workers=1) if pipelined else None
+        self._pending = deque()
+        self._has_image = False
         self.world = None
         self.camera_bp = None
+        self.camera_sensor = None
+        self.headless = headless
+        self.health_check_interval = health_check_interval
+        self.n_respawns = self.n_world_reloads = 0
         self.track_name = track_name
         self.track_obj = get_track(track_name)
 
@@ -56,55 +193,34 @@ class CarlaConnector:
         # self.check_freq = 10.
         self.env_steps = 0
         
-        # Temporary: built-in rendering
-        if DEBUG:
+        # Built-in rendering
+        if not headless:
+            import pygame
             pygame.init()
             self.display = pygame.display.set_mode((224, 224), pygame.HWSURFACE | pygame.DOUBLEBUF)
             self.surface = pygame.Surface((self.obs_size, self.obs_size))
-            self.clock = pygame.time.Clock()
             # self.fig, self.ax = plt.subplots()
             # self.im = self.ax.imshow(self.camera_img)
     
+    @property
+    def preprocessor(self):
+        return self._frames.preprocessor
+
+    @preprocessor.setter
+    def preprocessor(self, preprocessor):
+        self.flush()
+        self._frames.set_preprocessor(preprocessor)
+
     @property
     def height(self):
-        return self.camera_img.shape[0]
+        return self.obs_size
     
     @property
     def width(self):
-        return self.camera_img.shape[1]
+        return self.obs_size
 
     def load_opendrive_map(self):
-        xodr_path = Path(__file__).resolve().parents[1] / 'OpenDrive' / f"{self.track_name}.xodr"
-        if not os.path.exists(xodr_path):
-            raise ValueError(f"The file {xodr_path} does not exist.")
-            return
-    
-        with open(xodr_path, encoding='utf-8') as od_file:
-            try:
-                data = od_file.read()
-            except OSError:
-                print('file could not be read.')
-                sys.exit()
-        print('load opendrive map %r.' % os.path.basename(xodr_path))
-        vertex_distance = 2.0  # in meters
-        max_road_length = 0.1  # in meters
-        wall_height = 0.2      # in meters
-        extra_width = 0.1       # in meters
-        self.world = self.client.generate_opendrive_world(
-                        data, carla.OpendriveGenerationParameters(
-                            vertex_distance=vertex_distance,
-                            max_road_length=max_road_length,
-                            wall_height=wall_height,
-                            additional_width=extra_width,
-                            smooth_junctions=True,
-                            enable_mesh_visibility=True))
-        spectator = self.world.get_spectator()
-        spectator.set_transform(carla.Transform(carla.Location(x=5, y=-5, z=10),
-                                                carla.Rotation(pitch=-45, yaw=-45)))
-        self.settings = self.world.get_settings()
-        self.settings.synchronous_mode = True
-        self.settings.fixed_delta_seconds = self.dt
-        self.world.apply_settings(self.settings)
+        self.world = generate_track_world(self.client, self.carla, self.track_name, self.dt)
 
     def destroy_camera(self):
         for actor in self.world.get_actors().filter('sensor.camera.rgb'):
@@ -114,69 +230,101 @@ class CarlaConnector:
         # Remove any previous cameras.
         self.destroy_camera()
         # Next, try to spawn a camera at the origin.
-        self.camera_bp = self.world.get_blueprint_library().find('sensor.camera.rgb')
-        self.camera_bp.set_attribute('image_size_x', str(self.obs_size))
-        self.camera_bp.set_attribute('image_size_y', str(self.obs_size))
-        self.camera_bp.set_attribute('fov', '110')
-        # Set the time in seconds between sensor captures
-        self.camera_bp.set_attribute('sensor_tick', '0.02')
-
-        def get_camera_img(data):
-            array = np.frombuffer(data.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (data.height, data.width, 4))
-            array = array[:, :, :3]
-            array = array[:, :, ::-1]
-            self.camera_img = array
-
-        self.camera_trans = carla.Transform(carla.Location(x=x, y=y, z=0.2),
-                                            carla.Rotation(yaw=-np.rad2deg(psi)))
+        self.camera_bp = camera_blueprint(self.world, self.obs_size)
+        self.camera_trans = self.carla.Transform(self.carla.Location(x=x, y=y, z=0.2),
+                                                 self.carla.Rotation(yaw=-np.rad2deg(psi)))
         self.camera_sensor = self.world.spawn_actor(self.camera_bp, self.camera_trans)
-        self.camera_sensor.listen(get_camera_img)
-    
-    def query_rgb(self, state):
-        self.env_steps += 1
-        if self.env_steps % 102_400 == 0:
-            self.destroy_camera()
+        self.camera_sensor.listen(self._frames.on_image)
+
+    def _move_and_tick(self, x: float, y: float, psi: float) -> int:
+        self.camera_sensor.set_transform(camera_transform(self.carla, x, y, psi))
+        return self.world.tick()
+
+    def _set_image(self, frame: int):
+        image = self._frames.wait(frame, self.timeout)
+        self.camera_img = image if self.preprocessor is None else self.preprocessor.push(image)
+
+    def submit(self, state):
+        """
+        Pipelined mode: start moving the camera to the state and ticking the world in the worker thread.
+        """
+        self._pending.append(self._executor.submit(self._move_and_tick, state.x.x, state.x.y, state.e.psi))
+
+    def collect(self) -> np.ndarray:
+        """
+        Pipelined mode: image of the oldest pending submit, waits for its tick and frame.
+        """
+        try:
+            frame = self._pending.popleft().result(timeout=self.timeout)
+        except FutureTimeoutError as e:
+            # Reported as the lost frames, so that query_rgb retries
+            raise RuntimeError('Timed out waiting for the CARLA tick') from e
+        self._set_image(frame)
+        self._has_image = True
+        return self.camera_img
+
+    def flush(self):
+        while self._pending:
+            self.collect()
+        self._has_image = False
+
+    def _drop_pending(self):
+        # Cancel the queued ticks and wait for the one running in the worker thread, so that it does not use the
+        # camera or the world while they are replaced
+        for future in self._pending:
+            future.cancel()
+        _, not_done = wait(self._pending, timeout=self.timeout)
+        self._pending.clear()
+        self._has_image = False
+        if not_done:
+            raise RuntimeError('Timed out waiting for the camera worker')
+
+    def check_health(self, respawn=False):
+        """
+        Generate the world again if the server lost it (e.g. it was restarted or another map was loaded), otherwise
+        respawn the camera in the loaded world if it is destroyed or stopped listening (or if respawn).
+        Raises RuntimeError if the server does not answer.
+        """
+        if self.client.get_world().id != self.world.id:
+            logger.warning('The CARLA world was replaced, generating the track world again')
+            self._drop_pending()
             self.load_opendrive_map()
             self.spawn_camera()
-        # if time.time() - self.last_check > self.check_freq:
-        #     self.last_check = time.time()
-        #     if self.client.get_world().get_map().name != 'Carla/Maps/OpenDriveMap':
-        #         self.load_opendrive_map()
-        #         self.spawn_camera()
-        self.camera_sensor.set_transform(carla.Transform(carla.Location(x=state.x.x, y=-state.x.y, z=0.2), 
-                                                         carla.Rotation(yaw=-np.rad2deg(state.e.psi))))
-        # attempt = 0
-        # while True:
-        #     try:
-        self.world.tick()
-        if DEBUG:
-            # surface = rgb_to_display_surface(self.camera_img, 256)
+            self.n_world_reloads += 1
+        elif respawn or not (self.camera_sensor.is_alive and self.camera_sensor.is_listening):
+            logger.warning('Respawning the camera sensor')
+            self._drop_pending()
+            self.spawn_camera()
+            self.n_respawns += 1
+
+    def query_rgb(self, state):
+        self.env_steps += 1
+        if self.env_steps % self.health_check_interval == 0:
+            self.check_health()
+        try:
+            self._query_rgb(state)
+        except RuntimeError as e:
+            # Lost frame or camera: retry once with a new camera, the error propagates if the server is down
+            logger.warning(f'Camera query failed: {e}')
+            self._drop_pending()
+            self.check_health(respawn=True)
+            self._query_rgb(state)
+        if not self.headless and self.preprocessor is None:
+            import pygame
             pygame.surfarray.blit_array(self.surface, self.camera_img.swapaxes(0, 1))
             self.display.blit(self.surface, (0, 0))
             pygame.display.flip()
-            self.clock.tick(60)
-            # self.im.set_array(self.camera_img)
-            # plt.pause(0.01)
-            # self.fig.canvas.draw()
-            # self.fig.canvas.flush_events()
         return self.camera_img
-        # except RuntimeError as e:
-        #     logger.error(e)
-        #     logger.error("Waiting for CARLA to restart...")
-        #     time.sleep(20)
-        #     self.load_opendrive_map()
-        #     self.spawn_camera(x=state.x.x, y=state.y.y, psi=state.e.psi)
-        #     attempt += 1
-        #     if attempt > 5:
-        #         raise RuntimeError(e)
 
-        # Built-in rendering
-        # cv2.imshow('RGB Camera', self.camera_img[:, :, ::-1])
-        # if cv2.waitKey(1) == ord('q'):
-        #     exit(0)
+    def _query_rgb(self, state):
+        if self.pipelined:
+            self.submit(state)
+            # Image of the previous query, or of this one if there is none (first query or after a flush)
+            if len(self._pending) > 1 or not self._has_image:
+                self.collect()
+        else:
+            self._set_image(self._move_and_tick(state.x.x, state.x.y, state.e.psi))
 
-    
     def test(self):
         # fig, ax = plt.subplots()
         # im = ax.imshow(self.camera_img)
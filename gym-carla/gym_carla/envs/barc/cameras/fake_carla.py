@@ -0,0 +1,242 @@
+"""
+Local stand-in for the subset of the carla Python API used by CarlaConnector, to run and test it without a CARLA
+server: pass carla_module=fake_carla to CarlaConnector.
+
+As with CARLA in synchronous mode, World.tick() advances the world by one frame and returns its id, and the images of
+the cameras listening at that frame are delivered later by a separate thread, tagged with the frame id, after
+render_latency seconds. tick_latency is the time the server takes to step the world. By default the images are
+filled with the frame id in the red channel and the x and y location of the camera in cm in the green and blue
+channels (all modulo 256), render_fn(transform, width, height) -> (H, W, 3) uint8 can render something else. The
+clients created by CarlaConnector take the module defaults TICK_LATENCY, RENDER_LATENCY and RENDER_FN.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+TICK_LATENCY = 0.
+RENDER_LATENCY = 0.
+RENDER_FN = None
+
+
+@dataclass
+class Location:
+    x: float = field(default=0.)
+    y: float = field(default=0.)
+    z: float = field(default=0.)
+
+
+@dataclass
+class Rotation:
+    pitch: float = field(default=0.)
+    yaw: float = field(default=0.)
+    roll: float = field(default=0.)
+
+
+@dataclass
+class Transform:
+    location: Location = field(default_factory=Location)
+    rotation: Rotation = field(default_factory=Rotation)
+
+
+class OpendriveGenerationParameters:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+@dataclass
+class WorldSettings:
+    synchronous_mode: bool = field(default=False)
+    no_rendering_mode: bool = field(default=False)
+    fixed_delta_seconds: float = field(default=None)
+
+
+@dataclass
+class Image:
+    frame: int
+    width: int
+    height: int
+    transform: Transform
+    raw_data: bytes
+
+
+class ActorBlueprint:
+    def __init__(self, id):
+        self.id = id
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def get_attribute(self, key):
+        return self.attributes[key]
+
+
+class BlueprintLibrary:
+    def find(self, id):
+        return ActorBlueprint(id)
+
+
+class Actor:
+    def __init__(self, world, id, type_id, transform):
+        self.world = world
+        self.id = id
+        self.type_id = type_id
+        self._transform = transform
+        self.is_alive = True
+
+    def set_transform(self, transform):
+        self._transform = transform
+
+    def get_transform(self):
+        return self._transform
+
+    def destroy(self):
+        self.is_alive = False
+        self.world._actors.pop(self.id, None)
+        return True
+
+
+class Sensor(Actor):
+    def __init__(self, world, id, blueprint, transform):
+        super().__init__(world, id, blueprint.id, transform)
+        self.attributes = dict(blueprint.attributes)
+        self._callback = None
+
+    @property
+    def is_listening(self):
+        return self._callback is not None
+
+    def listen(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+    def destroy(self):
+        self.stop()
+        return super().destroy()
+
+
+class ActorList(list):
+    def filter(self, pattern):
+        prefix = pattern.rstrip('*')
+        return ActorList(a for a in self if a.type_id.startswith(prefix))
+
+
+class Map:
+    def __init__(self, name):
+        self.name = name
+
+
+class World:
+    def __init__(self, client, opendrive, id=0):
+        self.client = client
+        self.id = id
+        self.opendrive = opendrive
+        self._settings = WorldSettings()
+        self._actors = {}
+        self._next_id = 1
+        self._frame = 0
+        self._lock = threading.Lock()
+        self.n_ticks = 0
+        self.spectator = Actor(self, 0, 'spectator', Transform())
+
+    def get_settings(self):
+        return WorldSettings(**vars(self._settings))
+
+    def apply_settings(self, settings):
+        self._settings = WorldSettings(**vars(settings))
+        return self._frame
+
+    def get_spectator(self):
+        return self.spectator
+
+    def get_map(self):
+        return Map('Carla/Maps/OpenDriveMap')
+
+    def get_blueprint_library(self):
+        return BlueprintLibrary()
+
+    def get_actors(self):
+        with self._lock:
+            return ActorList(self._actors.values())
+
+    def spawn_actor(self, blueprint, transform, attach_to=None):
+        self.client._check_alive()
+        with self._lock:
+            actor = Sensor(self, self._next_id, blueprint, transform)
+            self._actors[actor.id] = actor
+            self._next_id += 1
+        return actor
+
+    def tick(self, seconds=10.0):
+        self.client._check_alive()
+        time.sleep(self.client.tick_latency)
+        with self._lock:
+            self._frame += 1
+            self.n_ticks += 1
+            frame = self._frame
+            cameras = [a for a in self._actors.values() if isinstance(a, Sensor) and a.is_listening]
+        for camera in cameras:
+            self.client._deliver(camera, frame, camera.get_transform())
+        return frame
+
+
+class Client:
+    def __init__(self, host='localhost', port=2000, tick_latency=None, render_latency=None, render_fn=None):
+        self.host = host
+        self.port = port
+        self.tick_latency = TICK_LATENCY if tick_latency is None else tick_latency
+        self.render_latency = RENDER_LATENCY if render_latency is None else render_latency
+        self.render_fn = RENDER_FN if render_fn is None else render_fn
+        self.timeout = None
+        self.world = None
+        self.n_worlds_generated = 0
+        self.alive = True
+        # Sensor data is streamed to the callbacks by a separate thread, in the order of the ticks
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._stream, daemon=True)
+        self._thread.start()
+
+    def set_timeout(self, seconds):
+        self.timeout = seconds
+
+    def _check_alive(self):
+        if not self.alive:
+            raise RuntimeError('time-out of %ss while waiting for the simulator' % self.timeout)
+
+    def generate_opendrive_world(self, opendrive, parameters=None, reset_settings=True):
+        self._check_alive()
+        self.n_worlds_generated += 1
+        self.world = World(self, opendrive, self.n_worlds_generated)
+        return self.world
+
+    def get_world(self):
+        self._check_alive()
+        return self.world
+
+    def _deliver(self, sensor, frame, transform):
+        self._queue.put((time.perf_counter() + self.render_latency, sensor, frame, transform))
+
+    def _stream(self):
+        while True:
+            t, sensor, frame, transform = self._queue.get()
+            time.sleep(max(t - time.perf_counter(), 0))
+            callback = sensor._callback
+            if callback is None or not self.alive:
+                continue
+            width = int(sensor.attributes.get('image_size_x', 800))
+            height = int(sensor.attributes.get('image_size_y', 600))
+            bgra = np.zeros((height, width, 4), dtype=np.uint8)
+            if self.render_fn is None:
+                location = transform.location
+                bgra[:, :, 2] = frame % 256
+                bgra[:, :, 1] = int(round(location.x * 100)) % 256
+                bgra[:, :, 0] = int(round(location.y * 100)) % 256
+            else:
+                bgra[:, :, 2::-1] = self.render_fn(transform, width, height)
+            bgra[:, :, 3] = 255
+            callback(Image(frame, width, height, transform, bgra.tobytes()))
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class CameraPreprocessor:
+    """
+    Preprocessing of the (H, W, 3) uint8 camera images for vision policies: crop, resize and grayscale, then stacking
+    of the last frame_stack frames, all in preallocated uint8 buffers.
+
+    crop: (top, bottom, left, right) pixels removed from the borders (a view of the image, no copy)
+    resize: (height, width) of the output, nearest pixel (two gathers into preallocated buffers)
+    grayscale: ITU-R 601 luma with integer weights, (h, w, 3) -> (h, w)
+    frame_stack: number of frames in the observation, which is then (frame_stack, h, w[, 3]) (oldest first),
+    otherwise (h, w[, 3])
+
+    apply(image, out) runs the ops and writes the processed frame in out (e.g. in the sensor thread of CarlaConnector,
+    as the images are received), push(frame) adds it to the stack and returns the observation. The stack is a ring of
+    2 * frame_stack frames where every frame is written twice, at i and i + frame_stack, so the last frame_stack frames
+    are always the contiguous view [i + 1, i + 1 + frame_stack): the observation is a view, only valid until the next
+    push (copy it to keep it). reset() makes the next frame fill the whole stack (start of an episode).
+    """
+    def __init__(self, in_shape=(224, 224, 3), crop=None, resize=None, grayscale=False, frame_stack=1):
+        H, W, C = in_shape
+        self.crop = tuple(crop) if crop is not None else (0, 0, 0, 0)
+        top, bottom, left, right = self.crop
+        self._crop = (slice(top, H - bottom), slice(left, W - right))
+        h, w = H - top - bottom, W - left - right
+        if h <= 0 or w <= 0:
+            raise ValueError(f'Crop {crop} is larger than the image {in_shape}')
+
+        self.resize = tuple(resize) if resize is not None else None
+        if self.resize is not None:
+            # Source row and column of the center of every output pixel
+            self._rows = np.minimum(((np.arange(self.resize[0]) + 0.5) * h / self.resize[0]).astype(np.intp), h - 1)
+            self._cols = np.minimum(((np.arange(self.resize[1]) + 0.5) * w / self.resize[1]).astype(np.intp), w - 1)
+            self._resized_rows = np.empty((self.resize[0], w, C), dtype=np.uint8)
+            self._resized = np.empty((*self.resize, C), dtype=np.uint8)
+            h, w = self.resize
+
+        self.grayscale = grayscale
+        if grayscale:
+            self._luma = np.empty((h, w), dtype=np.uint16)
+            self._channel = np.empty((h, w), dtype=np.uint16)
+        self.frame_shape = (h, w) if grayscale else (h, w, C)
+
+        self._frame = np.empty(self.frame_shape, dtype=np.uint8)
+        self.frame_stack = frame_stack
+        self._stack = np.zeros((2 * frame_stack, *self.frame_shape), dtype=np.uint8)
+        self._pos = 0
+        self._fill = True
+
+    @property
+    def shape(self):
+        return (self.frame_stack, *self.frame_shape) if self.frame_stack > 1 else self.frame_shape
+
+    def reset(self):
+        self._fill = True
+
+    def apply(self, image: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = self._frame
+        x = image[self._crop]
+        if self.resize is not None:
+            np.take(x, self._rows, axis=0, out=self._resized_rows)
+            x = self._resized if self.grayscale else out
+            np.take(self._resized_rows, self._cols, axis=1, out=x)
+        if self.grayscale:
+            # (77 R + 150 G + 29 B) / 256
+            np.multiply(x[..., 0], np.uint16(77), out=self._luma)
+            np.multiply(x[..., 1], np.uint16(150), out=self._channel)
+            self._luma += self._channel
+            np.multiply(x[..., 2], np.uint16(29), out=self._channel)
+            self._luma += self._channel
+            self._luma >>= 8
+            np.copyto(out, self._luma, casting='unsafe')
+        elif self.resize is None:
+            np.copyto(out, x)
+        return out
+
+    def push(self, frame: np.ndarray) -> np.ndarray:
+        k = self.frame_stack
+        if self._fill:
+            self._stack[:] = frame
+            self._fill = False
+        else:
+            self._pos = (self._pos + 1) % k
+            self._stack[self._pos] = frame
+            self._stack[self._pos + k] = frame
+        stack = self._stack[self._pos + 1:self._pos + 1 + k]
+        return stack if k > 1 else stack[0]
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return self.push(self.apply(image))
+
+
+if __name__ == '__main__':
+    import time
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (8, 224, 224, 3), dtype=np.uint8)
+    preprocessor = CameraPreprocessor(crop=(64, 0, 0, 0), resize=(84, 84), grayscale=True, frame_stack=4)
+
+    def naive(image, frames):
+        # Fresh arrays at every step, as in user code
+        x = image[64:].astype(np.float32)
+        x = x[preprocessor._rows][:, preprocessor._cols]
+        gray = (x @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8)
+        frames = frames[1:] + [gray]
+        return np.stack(frames), frames
+
+    n = 500
+    t = time.perf_counter()
+    for i in range(n):
+        ob = preprocessor(images[i % 8])
+    t_pre = (time.perf_counter() - t) / n
+    frames = [np.zeros((84, 84), dtype=np.uint8)] * 4
+    t = time.perf_counter()
+    for i in range(n):
+        ob_naive, frames = naive(images[i % 8], frames)
+    t_naive = (time.perf_counter() - t) / n
+    print('crop, resize to 84x84, grayscale, stack of 4: %.1f us per frame (%.1f us with fresh arrays)'
+          % (t_pre * 1e6, t_naive * 1e6))
+    print('observation %s, max luma difference %i' % (ob.shape, np.abs(ob.astype(int) - ob_naive).max()))
@@ -0,0 +1,144 @@
+import numpy as np
+
+from mpclab_common.track import get_track
+from mpclab_common.pytypes import VehicleState
+from mpclab_simulation.bev_renderer import rasterize_track
+from mpclab_simulation.range_sensor import RangeSensor
+
+from gym_carla.envs.barc.cameras.base_camera import BaseCamera
+
+
+class SyntheticCamera(BaseCamera):
+    """
+    Offline stand-in for CarlaConnector: software rendering of the track with a pinhole camera at the pose of the
+    vehicle, with the CARLA setup by default (obs_size x obs_size image, horizontal fov in degrees, height z, no pitch).
+    No simulator is needed, so camera-based training also runs on plain CPU machines and in CI.
+
+    The scene is the one of the OpenDRIVE map of generate_xodr_arc_length.py: a flat road extending road_margin beyond
+    the track limits, where white lane edges of line_width are painted, bordered by walls of wall_height, under the sky.
+    Each pixel is a ray of the camera:
+    - below the horizon, the ray-plane intersections with the ground are fixed in the camera frame, so the ground is an
+      affine resample of a pre-rasterized label map of the road (as BEVRenderer),
+    - the walls are vertical, each column of the image sees the wall at the horizontal distance found by a RangeSensor
+      cast along its azimuth, the pixels of the column whose ray reaches that distance between the ground and the top
+      of the wall see the wall (shaded with the distance),
+    - the other pixels see the sky.
+    """
+    SKY, GROUND, ROAD, LINE, WALL = 0, 1, 2, 3, 4
+    colors = {
+        SKY: (135, 180, 230),
+        GROUND: (90, 110, 70),
+        ROAD: (85, 85, 90),
+        LINE: (235, 235, 235),
+        WALL: (190, 80, 60),
+    }
+
+    def __init__(self, track_name, obs_size=224, fov=110., z=0.2, wall_height=0.2, road_margin=0.25, line_width=0.04,
+                 view_distance=20., map_resolution=0.01, n_shades=16):
+        self.track_name = track_name
+        self.track_obj = get_track(track_name)
+        self.obs_size = obs_size
+        self.z = z
+        self.wall_height = wall_height
+        self.map_resolution = map_resolution
+        H = W = obs_size
+
+        # Pixel rays (1, a, b) in the camera frame (x forward, y left, z up), through the pixel centers
+        f = W / 2 / np.tan(np.deg2rad(fov) / 2)
+        a = (W / 2 - 0.5 - np.arange(W)) / f
+        b = (H / 2 - 0.5 - np.arange(H)) / f
+        self._inv_norm = 1 / np.sqrt(1 + a**2)
+        self._azimuth = np.arctan(a)
+        self._horizon = int(np.searchsorted(-b, 0))  # First row below the horizon
+        self._b_up = b[:self._horizon, None]
+        # Ground point seen by the pixels below the horizon, forward distance (Hg, 1) and lateral (Hg, W), in mask pixels
+        self._u = (z / -b[self._horizon:])[:, None]
+        self._v = self._u * a
+        self._u_px, self._v_px = self._u / map_resolution, self._v / map_resolution
+
+        # Distance to the walls along the azimuth of every column
+        self._walls = RangeSensor(self.track_obj, n_rays=W, fov=2 * self._azimuth[0], max_range=view_distance,
+                                  offset=road_margin)
+        self._view_distance = view_distance
+
+        # Label map of the ground: road, lane edges, and the ground outside the road
+        road, origin = rasterize_track(self.track_obj, map_resolution, offset=road_margin)
+        extent = np.concatenate([origin + 2 * map_resolution, origin + (np.array(road.shape[::-1]) - 3) * map_resolution])
+        outer = rasterize_track(self.track_obj, map_resolution, offset=line_width / 2, extent=extent)[0]
+        inner = rasterize_track(self.track_obj, map_resolution, offset=-line_width / 2, extent=extent)[0]
+        self.labels = np.where(road > 0, self.ROAD, self.GROUND).astype(np.uint8)
+        self.labels[(outer > 0) & (inner == 0)] = self.LINE
+        # Empty border, read by the ground points out of the map
+        self.labels[[0, -1], :] = self.labels[:, [0, -1]] = self.GROUND
+        self.origin = origin
+
+        # Palette of the labels, then of the wall shades from near to far
+        self.n_shades = n_shades
+        shades = 1 / (1 + np.arange(n_shades) / n_shades * view_distance / 4)
+        self._palette = np.array([self.colors[k] for k in (self.SKY, self.GROUND, self.ROAD, self.LINE)]
+                                 + list(np.array(self.colors[self.WALL])[None] * shades[:, None]), dtype=np.uint8)
+        self.camera_img = np.zeros((H, W, 3), dtype=np.uint8)
+
+    @property
+    def height(self):
+        return self.camera_img.shape[0]
+
+    @property
+    def width(self):
+        return self.camera_img.shape[1]
+
+    def render(self, x: float, y: float, psi: float) -> np.ndarray:
+        """
+        (H, W, 3) uint8 image of the camera at (x, y, psi)
+        """
+        H, W = self.camera_img.shape[:2]
+        # Forward distance to the wall in every column, far away without a wall in range
+        d = np.interp(self._azimuth, self._walls.angles, self._walls.cast([x, y, psi])[0])
+        d[d >= self._view_distance] = 1e6
+        t_wall = d * self._inv_norm
+        shade = self.WALL + np.minimum(d * (self.n_shades / self._view_distance), self.n_shades - 1).astype(np.uint8)
+
+        # Ground label of the pixels below the horizon
+        n_rows, n_cols = self.labels.shape
+        c, s = np.cos(psi), np.sin(psi)
+        x_px, y_px = (x - self.origin[0]) / self.map_resolution + 0.5, (y - self.origin[1]) / self.map_resolution + 0.5
+        col = np.clip(x_px + c * self._u_px - s * self._v_px, 0, n_cols - 1).astype(np.intp)
+        row = np.clip(y_px + s * self._u_px + c * self._v_px, 0, n_rows - 1).astype(np.intp)
+        ground = self.labels.ravel()[row * n_cols + col]
+
+        idx = np.empty((H, W), dtype=np.uint8)
+        # Above the horizon the ray reaches the wall below its top, or passes over it
+        idx[:self._horizon] = np.where(self._b_up * t_wall <= self.wall_height - self.z, shade, self.SKY)
+        # Below the horizon the ray reaches the wall before the ground
+        idx[self._horizon:] = np.where(self._u >= t_wall, shade, ground)
+        np.take(self._palette, idx, axis=0, out=self.camera_img)
+        return self.camera_img.copy()
+
+    def query_rgb(self, state: VehicleState) -> np.ndarray:
+        return self.render(state.x.x, state.x.y, state.e.psi)
+
+
+if __name__ == '__main__':
+    import time
+    from matplotlib import pyplot as plt
+
+    camera = SyntheticCamera('L_track_barc')
+    track = camera.track_obj
+    state = VehicleState()
+    n = 200
+    t = time.perf_counter()
+    for i in range(n):
+        state.p.s = i * track.track_length / n
+        track.local_to_global_typed(state)
+        img = camera.query_rgb(state)
+    t = (time.perf_counter() - t) / n
+    print('%ix%i frames: %.2f ms per frame, %.0f fps' % (camera.height, camera.width, t * 1e3, 1 / t))
+
+    fig, axes = plt.subplots(1, 4, figsize=(16, 4))
+    for ax, s in zip(axes, np.linspace(0, track.track_length, 4, endpoint=False)):
+        state.p.s, state.p.x_tran = s, 0.
+        track.local_to_global_typed(state)
+        ax.imshow(camera.query_rgb(state))
+        ax.set_title('s = %.1f' % s)
+        ax.axis('off')
+    plt.show()
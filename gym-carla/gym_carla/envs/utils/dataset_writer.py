@@ -0,0 +1,348 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields, is_dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mpclab_common.pytypes import VehicleState
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG color types of 1, 2, 3 and 4 channels
+COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(tag)))
+
+
+def encode_png(image: np.ndarray, level: int = 1) -> bytes:
+    '''
+    lossless PNG of a (H, W) or (H, W, C) uint8 image (C = 1 to 4), every row with the Up filter (difference with the
+    row above), which compresses the smooth camera images well and is cheap to compute
+    '''
+    image = np.asarray(image, dtype=np.uint8)
+    h, w = image.shape[:2]
+    c = image.shape[2] if image.ndim == 3 else 1
+    if c not in COLOR_TYPES:
+        raise ValueError(f'Cannot encode an image of shape {image.shape} as PNG')
+    rows = image.reshape((h, w * c))
+    filtered = np.empty((h, w * c + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    header = struct.pack('>IIBBBBB', w, h, 8, COLOR_TYPES[c], 0, 0, 0)
+    return PNG_SIGNATURE + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', zlib.compress(filtered, level)) \
+        + _png_chunk(b'IEND', b'')
+
+
+def decode_png(data: bytes) -> np.ndarray:
+    '''
+    image of a PNG written by encode_png (8 bit, not interlaced, Up or no filter)
+    '''
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError('Not a PNG')
+    pos, idat = 8, []
+    while pos < len(data):
+        n, tag = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + n]
+        if tag == b'IHDR':
+            w, h, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif tag == b'IDAT':
+            idat.append(chunk)
+        pos += n + 12
+    channels = {v: k for k, v in COLOR_TYPES.items()}.get(color_type)
+    if depth != 8 or interlace != 0 or channels is None:
+        raise ValueError('Unsupported PNG format')
+    filtered = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape((h, w * channels + 1))
+    if not np.isin(filtered[:, 0], (0, 2)).all():
+        raise ValueError('Only the Up filter is supported')
+    # Up rows are the differences with the row above, the rows without filter restart the sum
+    rows = filtered[:, 1:].copy()
+    for start, end in _runs(filtered[:, 0] == 0):
+        rows[start:end] = np.cumsum(rows[start:end], axis=0, dtype=np.uint8)
+    return rows.reshape((h, w, channels)) if channels > 1 else rows
+
+
+def _runs(is_start: np.ndarray) -> List[Tuple[int, int]]:
+    # (start, end) of the runs of rows, a run starts at the first row and at every row without filter
+    starts = np.union1d([0], np.flatnonzero(is_start))
+    return list(zip(starts, np.append(starts[1:], len(is_start))))
+
+
+def _leaf_fields(msg, prefix=()) -> List[Tuple[str, ...]]:
+    # Attribute paths of the numeric fields of a (nested) PythonMsg
+    paths = []
+    for f in fields(msg):
+        value = getattr(msg, f.name)
+        if is_dataclass(value):
+            paths += _leaf_fields(value, prefix + (f.name,))
+        elif isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+            paths.append(prefix + (f.name,))
+    return paths
+
+
+def _get_path(msg, path):
+    for name in path:
+        msg = getattr(msg, name)
+    return msg
+
+
+class DatasetWriter:
+    '''
+    Writer of camera datasets collected from BarcEnv rollouts, which encodes the frames in the background.
+
+    add(camera, vehicle_state, **data) copies the frame and the low-dimensional data of one step (e.g. state=ob['state'],
+    action=action, reward=rew, episode=...), and the VehicleState ground truth flattened to its numeric fields, then
+    returns: the frames are PNG encoded by n_workers threads (zlib runs without the GIL) and written in order by a
+    writer thread. Only when max_queue frames are waiting does add() block, until one is written (backpressure,
+    counted in metrics).
+
+    The dataset in path is made of shards of shard_size frames:
+    - shard_XXXXX.frames: the PNG files of the frames, one after the other,
+    - shard_XXXXX.npz: offsets of the frames in the .frames file, the data (one row per frame) and 'vehicle_state'
+      (fields in the index),
+    - index.json: frame shape, data keys, vehicle state fields and the list of shards, rewritten (atomically) whenever
+      a shard is complete, so it only lists complete shards.
+    Stacks of frames (k, H, W[, C]) are stored as images of (k * H, W[, C]).
+    See DatasetReader.
+    '''
+    def __init__(self, path: str, shard_size: int = 1000, n_workers: int = 1, max_queue: int = 64,
+                 compression_level: int = 1):
+        self.path = path
+        self.shard_size = shard_size
+        self.compression_level = compression_level
+        os.makedirs(path, exist_ok=True)
+
+        self.frame_shape = None
+        self.data_keys = None
+        self.vehicle_state_fields = None
+        self.shards = []
+        self.n_frames = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+        self._encoded = queue.Queue()
+        self._slots = threading.Semaphore(max_queue)
+        self.max_queue = max_queue
+        self._error = None
+        self._closed = False
+
+        # Current shard
+        self._frames_file = None
+        self._offsets = [0]
+        self._data = None
+
+        # Backpressure metrics
+        self.n_added = 0
+        self.n_blocked = 0
+        self.blocked_time = 0.
+        self.encode_time = 0.
+        self.bytes_raw = 0
+        self.bytes_written = 0
+        self.max_pending = 0
+
+        # Started last, the writer thread uses the state above
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @property
+    def metrics(self) -> Dict[str, float]:
+        return dict(n_added=self.n_added, n_written=self.n_frames, pending=self.n_added - self.n_frames,
+                    max_pending=self.max_pending, max_queue=self.max_queue, n_blocked=self.n_blocked,
+                    blocked_time=self.blocked_time, encode_time=self.encode_time, bytes_raw=self.bytes_raw,
+                    bytes_written=self.bytes_written,
+                    compression_ratio=self.bytes_raw / self.bytes_written if self.bytes_written else 0.)
+
+    def add(self, camera: np.ndarray, vehicle_state: Optional[VehicleState] = None, **data):
+        '''
+        queues one frame with its data (arrays or scalars of fixed shapes, the same keys at every call)
+        '''
+        camera = np.asarray(camera)
+        if self._error is not None:
+            raise RuntimeError(f'The dataset writer failed: {self._error}') from self._error
+        if self._closed:
+            raise RuntimeError('The dataset writer is closed')
+        if self.frame_shape is None:
+            self._start(camera, vehicle_state, data)
+        if camera.shape != self.frame_shape or data.keys() != self.data_keys.keys():
+            raise ValueError(f'Frame {camera.shape} with data {sorted(data)} instead of {self.frame_shape} with '
+                             f'{sorted(self.data_keys)}')
+
+        row = {k: np.asarray(v) for k, v in data.items()}
+        if self.vehicle_state_fields:
+            row['vehicle_state'] = np.array([_get_path(vehicle_state, p) for p in self.vehicle_state_fields],
+                                            dtype=np.float64)
+        image = np.array(camera, dtype=np.uint8).reshape(self._image_shape)
+
+        if not self._slots.acquire(blocking=False):
+            t = time.perf_counter()
+            self._slots.acquire()
+            self.n_blocked += 1
+            self.blocked_time += time.perf_counter() - t
+        self.n_added += 1
+        self.max_pending = max(self.max_pending, self.n_added - self.n_frames)
+        self.bytes_raw += image.nbytes
+        self._encoded.put((self._executor.submit(self._encode, image), row))
+
+    def _start(self, camera, vehicle_state, data):
+        shape = self.frame_shape = camera.shape
+        if camera.ndim > 2 and shape[-1] not in COLOR_TYPES:
+            # Stack of gray frames
+            self._image_shape = (int(np.prod(shape[:-1])), shape[-1])
+        elif camera.ndim > 3:
+            self._image_shape = (int(np.prod(shape[:-2])), *shape[-2:])
+        else:
+            self._image_shape = shape
+        self.data_keys = {k: list(np.shape(v)) for k, v in data.items()}
+        self.vehicle_state_fields = _leaf_fields(vehicle_state) if vehicle_state is not None else []
+
+    def _encode(self, image: np.ndarray) -> Tuple[bytes, float]:
+        t = time.perf_counter()
+        return encode_png(image, self.compression_level), time.perf_counter() - t
+
+    def _write_loop(self):
+        while True:
+            item = self._encoded.get()
+            if item is None:
+                break
+            future, row = item
+            try:
+                if self._error is None:
+                    png, encode_time = future.result()
+                    self.encode_time += encode_time
+                    self._write(png, row)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._slots.release()
+
+    def _shard_name(self, i: int) -> str:
+        return 'shard_%05d' % i
+
+    def _write(self, png: bytes, row: dict):
+        if self._frames_file is None:
+            self._frames_file = open(os.path.join(self.path, self._shard_name(len(self.shards)) + '.frames'), 'wb')
+            self._offsets = [0]
+            self._data = {k: [] for k in row}
+        self._frames_file.write(png)
+        self._offsets.append(self._offsets[-1] + len(png))
+        for k, v in row.items():
+            self._data[k].append(v)
+        self.bytes_written += len(png)
+        self.n_frames += 1
+        if len(self._offsets) > self.shard_size:
+            self._finish_shard()
+
+    def _finish_shard(self):
+        name = self._shard_name(len(self.shards))
+        self._frames_file.close()
+        self._frames_file = None
+        np.savez(os.path.join(self.path, name + '.npz'), offsets=np.array(self._offsets, dtype=np.int64),
+                 **{k: np.stack(v) for k, v in self._data.items()})
+        self.shards.append(dict(name=name, n_frames=len(self._offsets) - 1))
+        self._write_index()
+
+    def _write_index(self):
+        index = dict(frame_shape=list(self.frame_shape), shard_size=self.shard_size, n_frames=self.n_frames,
+                     data_keys=self.data_keys, vehicle_state_fields=['.'.join(p) for p in self.vehicle_state_fields],
+                     shards=self.shards)
+        tmp_path = os.path.join(self.path, '.index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, 'index.json'))
+
+    def flush(self):
+        '''
+        waits until all the queued frames are written
+        '''
+        while self.n_frames < self.n_added and self._error is None:
+            time.sleep(0.001)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._encoded.put(None)
+        self._writer.join()
+        self._executor.shutdown()
+        if self._frames_file is not None:
+            self._finish_shard()
+        if self._error is not None:
+            raise RuntimeError(f'The dataset writer failed: {self._error}') from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DatasetReader:
+    '''
+    Random access to the frames of a dataset written by DatasetWriter: reader[i] is a dict of the camera frame and the
+    data of frame i ('vehicle_state' is the flat array of the fields in vehicle_state_fields, vehicle_state(i) the
+    VehicleState).
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.frame_shape = tuple(index['frame_shape'])
+        self.vehicle_state_fields = [tuple(p.split('.')) for p in index['vehicle_state_fields']]
+        self.shards = index['shards']
+        self._first = np.cumsum([0] + [s['n_frames'] for s in self.shards])
+        self._cache = {}
+
+    def __len__(self):
+        return int(self._first[-1])
+
+    def _shard(self, i):
+        if i not in self._cache:
+            name = self.shards[i]['name']
+            with open(os.path.join(self.path, name + '.frames'), 'rb') as f:
+                frames = f.read()
+            self._cache = {i: (frames, dict(np.load(os.path.join(self.path, name + '.npz'))))}
+        return self._cache[i]
+
+    def __getitem__(self, i: int) -> Dict[str, np.ndarray]:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = int(np.searchsorted(self._first, i, side='right')) - 1
+        frames, data = self._shard(shard)
+        j = i - self._first[shard]
+        item = {k: v[j] for k, v in data.items() if k != 'offsets'}
+        item['camera'] = decode_png(frames[data['offsets'][j]:data['offsets'][j + 1]]).reshape(self.frame_shape)
+        return item
+
+    def vehicle_state(self, i: int) -> VehicleState:
+        state = VehicleState()
+        for path, value in zip(self.vehicle_state_fields, self[i]['vehicle_state']):
+            setattr(_get_path(state, path[:-1]), path[-1], value.item())
+        return state
+
+
+if __name__ == '__main__':
+    import tempfile
+    import gymnasium as gym
+    import gym_carla
+
+    env = gym.make('barc-v0', track_name='L_track_barc', do_render=False, enable_camera=True,
+                   camera_backend='synthetic', integrator='rk4', substeps=2)
+    with tempfile.TemporaryDirectory() as path:
+        with DatasetWriter(path, shard_size=50) as writer:
+            ob, info = env.reset(seed=0)
+            for k in range(120):
+                action = np.array([1., 0.1])
+                writer.add(ob['camera'], env.unwrapped.sim_state, state=ob['state'], action=action, step=k)
+                ob, rew, terminated, truncated, info = env.step(action)
+        print(writer.metrics)
+        reader = DatasetReader(path)
+        print('%i frames in %i shards, frame 100: %s, s = %.2f' % (len(reader), len(reader.shards),
+                                                                  reader[100]['camera'].shape,
+                                                                  reader.vehicle_state(100).p.s))
@@ -0,0 +1,328 @@
+import os
+from typing import Dict, Optional, Union
+
+import numpy as np
+from gymnasium import spaces
+
+
+class SumTree:
+    '''
+    Array-backed binary sum tree for proportional prioritized sampling.
+    Leaves hold priorities, internal nodes hold the sum of their children.
+    Updates and samples are vectorized over batches of indices.
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.n_leaves = 1 << int(np.ceil(np.log2(max(capacity, 1))))
+        self.tree = np.zeros(2 * self.n_leaves, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1]
+
+    def get(self, idx: np.ndarray) -> np.ndarray:
+        return self.tree[np.asarray(idx) + self.n_leaves]
+
+    def set(self, idx: np.ndarray, priority: np.ndarray):
+        idx = np.asarray(idx, dtype=np.int64).reshape(-1)
+        nodes = idx + self.n_leaves
+        self.tree[nodes] = np.broadcast_to(np.asarray(priority, dtype=np.float64), idx.shape)
+        # Propagate the sums up one level at a time
+        nodes = np.unique(nodes // 2)
+        while nodes.size > 0:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+            nodes = nodes[nodes >= 1]
+
+    def find(self, mass: np.ndarray) -> np.ndarray:
+        '''
+        Returns the leaf index whose prefix sum interval contains each value of mass
+        '''
+        mass = np.array(mass, dtype=np.float64)
+        nodes = np.ones(mass.shape, dtype=np.int64)
+        while nodes[0] < self.n_leaves:
+            left = 2 * nodes
+            go_right = mass > self.tree[left]
+            mass = np.where(go_right, mass - self.tree[left], mass)
+            nodes = np.where(go_right, left + 1, left)
+        return np.minimum(nodes - self.n_leaves, self.capacity - 1)
+
+
+class ReplayBuffer:
+    '''
+    Replay buffer over transitions of `barc-v0` (or a lockstep batch of them).
+
+    Transitions are stored in preallocated arrays (optionally memory-mapped from `memmap_dir`)
+    whose shapes and dtypes follow the environment's observation and action spaces.
+    Observations are kept in a separate ring and each transition only stores indices into it,
+    so the next observation of a transition and the observation of the following transition
+    share one slot. This halves the footprint of large observations such as `camera` frames.
+
+    n-step returns are computed at sampling time by following each environment's chain of
+    transitions, so `n_step` and `gamma` can be changed without touching stored data.
+
+    Data is added as arrays with a leading dimension of `num_envs` (the leading dimension may be
+    omitted when `num_envs == 1`), which matches what `BarcEnv.step` and batched envs return.
+    '''
+    def __init__(self, observation_space: spaces.Dict, action_space: spaces.Box, capacity: int,
+                 num_envs: int = 1, n_step: int = 1, gamma: float = 0.99,
+                 prioritized: bool = False, alpha: float = 0.6, beta: float = 0.4, priority_eps: float = 1e-6,
+                 obs_capacity: Optional[int] = None, memmap_dir: Optional[str] = None, seed: Optional[int] = None):
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.capacity = int(capacity)
+        self.num_envs = int(num_envs)
+        self.n_step = int(n_step)
+        self.gamma = float(gamma)
+
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.priority_eps = priority_eps
+
+        # Each transition consumes one observation slot, plus one more at the start of an episode
+        if obs_capacity is None:
+            obs_capacity = self.capacity + max(self.capacity // 8, 2 * self.num_envs)
+        self.obs_capacity = int(obs_capacity)
+        if self.obs_capacity < self.capacity + 2 * self.num_envs:
+            raise ValueError('obs_capacity must be at least capacity + 2 * num_envs')
+
+        self.memmap_dir = memmap_dir
+        if memmap_dir is not None:
+            os.makedirs(memmap_dir, exist_ok=True)
+
+        self.rng = np.random.default_rng(seed)
+
+        self.obs = {k: self._alloc('obs_%s' % k, (self.obs_capacity,) + space.shape, space.dtype)
+                    for k, space in self.observation_space.spaces.items()}
+        self.actions = self._alloc('actions', (self.capacity,) + action_space.shape, action_space.dtype)
+        self.rewards = self._alloc('rewards', (self.capacity,), np.float32)
+        self.terminated = self._alloc('terminated', (self.capacity,), np.bool_)
+        self.truncated = self._alloc('truncated', (self.capacity,), np.bool_)
+        self.env_ids = self._alloc('env_ids', (self.capacity,), np.int32)
+        # Absolute (never wrapped) indices into the observation ring
+        self.obs_abs = self._alloc('obs_abs', (self.capacity,), np.int64)
+        self.next_obs_abs = self._alloc('next_obs_abs', (self.capacity,), np.int64)
+        # Slot of the following transition of the same environment, -1 if none (yet)
+        self.next_tr = self._alloc('next_tr', (self.capacity,), np.int64)
+        self.next_tr[:] = -1
+
+        self.priorities = SumTree(self.capacity) if prioritized else None
+        self.max_priority = 1.0
+
+        self.start = 0              # Slot of the oldest live transition
+        self.size = 0               # Number of live transitions
+        self.n_added = 0            # Total number of transitions ever added
+        self.obs_head = 0           # Absolute index of the next observation slot to be written
+
+        # Per environment: slot of the last transition and observation index of its next observation
+        self._last_tr = np.full(self.num_envs, -1, dtype=np.int64)
+        self._last_next_obs = np.full(self.num_envs, -1, dtype=np.int64)
+
+    def _alloc(self, name, shape, dtype):
+        if self.memmap_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        path = os.path.join(self.memmap_dir, '%s.npy' % name)
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def __len__(self):
+        return self.size
+
+    def _batch(self, x, dtype=None):
+        x = np.asarray(x, dtype=dtype)
+        if self.num_envs == 1 and (x.ndim == 0 or x.shape[0] != 1):
+            x = x[None]
+        return x
+
+    def _batch_obs(self, obs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        out = dict()
+        for k, space in self.observation_space.spaces.items():
+            v = np.asarray(obs[k])
+            if v.shape == space.shape:
+                v = v[None]
+            out[k] = v
+        return out
+
+    def _evict_oldest(self):
+        slot = self.start
+        if self.prioritized:
+            self.priorities.set([slot], 0.0)
+        self.start = (self.start + 1) % self.capacity
+        self.size -= 1
+
+    def _write_obs(self, obs: Dict[str, np.ndarray], rows: np.ndarray) -> np.ndarray:
+        n = rows.shape[0]
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        abs_idx = self.obs_head + np.arange(n)
+        # Drop transitions whose observations are about to be overwritten
+        oldest_allowed = abs_idx[-1] - self.obs_capacity + 1
+        while self.size > 0 and self.obs_abs[self.start] < oldest_allowed:
+            self._evict_oldest()
+        slots = abs_idx % self.obs_capacity
+        for k in self.obs:
+            self.obs[k][slots] = obs[k][rows]
+        self.obs_head += n
+        return abs_idx
+
+    def add(self, obs: Dict[str, np.ndarray], action: np.ndarray, reward: Union[float, np.ndarray],
+            next_obs: Dict[str, np.ndarray], terminated: Union[bool, np.ndarray], truncated: Union[bool, np.ndarray]):
+        '''
+        Adds one transition per environment.
+        `next_obs` must be the observation returned by the step (before any automatic reset),
+        and `obs` of the following call is assumed to be `next_obs` unless the episode ended.
+        '''
+        obs = self._batch_obs(obs)
+        next_obs = self._batch_obs(next_obs)
+        action = self._batch(action)
+        reward = self._batch(reward, np.float32)
+        terminated = self._batch(terminated, np.bool_)
+        truncated = self._batch(truncated, np.bool_)
+
+        # Observations only need to be written for environments that start a new episode
+        new_episode = self._last_next_obs < 0
+        obs_abs = self._last_next_obs.copy()
+        obs_abs[new_episode] = self._write_obs(obs, np.flatnonzero(new_episode))
+        next_obs_abs = self._write_obs(next_obs, np.arange(self.num_envs))
+
+        for _ in range(self.num_envs - (self.capacity - self.size)):
+            self._evict_oldest()
+        slots = (self.start + self.size + np.arange(self.num_envs)) % self.capacity
+
+        self.actions[slots] = action
+        self.rewards[slots] = reward
+        self.terminated[slots] = terminated
+        self.truncated[slots] = truncated
+        self.env_ids[slots] = np.arange(self.num_envs)
+        self.obs_abs[slots] = obs_abs
+        self.next_obs_abs[slots] = next_obs_abs
+        self.next_tr[slots] = -1
+
+        continuing = self._last_tr >= 0
+        self.next_tr[self._last_tr[continuing]] = slots[continuing]
+
+        done = np.logical_or(terminated, truncated)
+        self._last_tr = np.where(done, -1, slots)
+        self._last_next_obs = np.where(done, -1, next_obs_abs)
+
+        if self.prioritized:
+            self.priorities.set(slots, self.max_priority ** self.alpha)
+
+        self.size += self.num_envs
+        self.n_added += self.num_envs
+
+    def _live_mask(self, slots: np.ndarray) -> np.ndarray:
+        rel = (slots - self.start) % self.capacity
+        live = rel < self.size
+        live &= self.obs_abs[slots] > self.obs_head - self.obs_capacity - 1
+        return live
+
+    def _sample_slots(self, batch_size: int):
+        if self.size == 0:
+            raise ValueError('Cannot sample from an empty replay buffer')
+        slots = np.empty(batch_size, dtype=np.int64)
+        todo = np.arange(batch_size)
+        while todo.size > 0:
+            if self.prioritized:
+                total = self.priorities.total
+                # Stratified sampling over the priority mass
+                u = (todo + self.rng.random(todo.size)) * (total / batch_size)
+                _slots = self.priorities.find(u)
+            else:
+                _slots = (self.start + self.rng.integers(0, self.size, size=todo.size)) % self.capacity
+            slots[todo] = _slots
+            todo = todo[~self._live_mask(_slots)]
+        return slots
+
+    def _gather_obs(self, abs_idx: np.ndarray) -> Dict[str, np.ndarray]:
+        slots = abs_idx % self.obs_capacity
+        return {k: v[slots] for k, v in self.obs.items()}
+
+    def sample(self, batch_size: int, n_step: Optional[int] = None, gamma: Optional[float] = None) -> Dict[str, np.ndarray]:
+        '''
+        Samples a batch of n-step transitions.
+
+        Returns a dictionary with
+            obs, next_obs:  dictionaries of stacked observations
+            action:         actions taken at the sampled transitions
+            reward:         discounted sum of up to n rewards
+            discount:       factor to apply to the bootstrapped value of next_obs (0 after termination)
+            n:              number of steps actually summed
+            indices:        slots of the sampled transitions (for update_priorities)
+            weights:        importance sampling weights (ones for uniform sampling)
+        '''
+        n_step = self.n_step if n_step is None else n_step
+        gamma = self.gamma if gamma is None else gamma
+
+        slots = self._sample_slots(batch_size)
+
+        ret = np.zeros(batch_size, dtype=np.float64)
+        discount = np.ones(batch_size, dtype=np.float64)
+        n = np.zeros(batch_size, dtype=np.int64)
+        cur = slots.copy()
+        last = slots.copy()
+        active = np.ones(batch_size, dtype=bool)
+        for _ in range(n_step):
+            ret[active] += discount[active] * self.rewards[cur[active]]
+            discount[active] *= gamma
+            n[active] += 1
+            last[active] = cur[active]
+            stop = self.terminated[cur] | self.truncated[cur]
+            nxt = self.next_tr[cur]
+            active &= ~stop & (nxt >= 0)
+            if not active.any():
+                break
+            active &= self._live_mask(np.where(nxt >= 0, nxt, 0))
+            cur = np.where(active, nxt, cur)
+        discount[self.terminated[last]] = 0.0
+
+        if self.prioritized:
+            p = self.priorities.get(slots) / self.priorities.total
+            weights = (self.size * p) ** (-self.beta)
+            weights /= weights.max()
+        else:
+            weights = np.ones(batch_size)
+
+        return dict(obs=self._gather_obs(self.obs_abs[slots]),
+                    action=self.actions[slots],
+                    reward=ret.astype(np.float32),
+                    next_obs=self._gather_obs(self.next_obs_abs[last]),
+                    discount=discount.astype(np.float32),
+                    n=n,
+                    indices=slots,
+                    weights=weights.astype(np.float32))
+
+    def update_priorities(self, indices: np.ndarray, priorities: np.ndarray):
+        if not self.prioritized:
+            return
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64)) + self.priority_eps
+        live = self._live_mask(np.asarray(indices))
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.priorities.set(np.asarray(indices)[live], priorities[live] ** self.alpha)
+
+
+if __name__ == '__main__':
+    import time
+    import gymnasium as gym
+    import gym_carla
+    from controllers.barc_pid import PIDWrapper
+
+    env = gym.make('barc-v0', track_name='L_track_barc', do_render=False, max_n_laps=2)
+    expert = PIDWrapper(dt=0.1, t0=0., track_obj=env.unwrapped.get_track())
+    buffer = ReplayBuffer(env.observation_space, env.action_space, capacity=1000, n_step=3, prioritized=True)
+
+    ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+    expert.reset(seed=0, options=info)
+    for _ in range(500):
+        ac, _ = expert.step(**ob, **info)
+        next_ob, rew, terminated, truncated, info = env.step(ac)
+        buffer.add(ob, ac, rew, next_ob, terminated, truncated)
+        ob = next_ob
+        if terminated or truncated:
+            ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+            expert.reset(seed=0, options=info)
+
+    t = time.time()
+    for _ in range(1000):
+        batch = buffer.sample(256)
+    print('%d transitions, %.1f us per batch of 256' % (len(buffer), (time.time() - t) * 1e3))
@@ -4,6 +4,9 @@ from abc import ABC, abstractmethod
 import pathlib
 import shutil
 import os
+import hashlib
+import subprocess
+import tempfile
 
 import casadi as ca
 
@@ -29,58 +32,76 @@ class AbstractModel(ABC):
         if self.code_gen and not self.jit:
             self.c_file_name = self.model_config.model_name + '.c'
             self.so_file_name = self.model_config.model_name + '.so'
-            self.generator = ca.CodeGenerator(self.c_file_name)
             self.options = lambda fn_name: dict(jit=False, **jac_opts)
         elif self.code_gen and self.jit:
-            self.generator = None
             self.options = lambda fn_name: dict(jit=True,
                                                     jit_name=fn_name,
                                                     compiler='shell',
                                                     jit_options=dict(compiler='gcc', flags=['-%s' % self.model_config.opt_flag], verbose=self.model_config.verbose),
                                                     **jac_opts)
         else:
-            self.generator = None
             self.options = lambda fn_name: dict(jit=False, **jac_opts)
 
     @abstractmethod
     def step(self):
         pass
 
+    # Directory of the cached shared objects
+    def shared_object_dir(self) -> pathlib.Path:
+        if self.model_config.install and self.model_config.install_dir is not None:
+            return pathlib.Path(self.model_config.install_dir).expanduser()
+        return pathlib.Path.cwd().joinpath(self.model_config.model_name)
+
     # Method for generating C code and building a shared object from it
+    # The shared object is cached under a directory named after a hash of the generated code and the compiler flags,
+    # so unchanged models are not recompiled and models with different code never overwrite each other.
+    # Builds happen in a temporary directory that is atomically renamed into place, which makes it safe for many
+    # processes (or threads) to build the same model concurrently.
     def build_shared_object(self, fns) -> pathlib.Path:
+        generator = ca.CodeGenerator(self.c_file_name)
         for f in fns:
-            self.generator.add(f)
-
-        # Set up paths
-        cur_dir = pathlib.Path.cwd()
-        gen_path = cur_dir.joinpath(self.model_config.model_name)
-        c_path = gen_path.joinpath(self.c_file_name)
-        if gen_path.exists():
-            shutil.rmtree(gen_path)
-        gen_path.mkdir(parents=True)
-
-        # Switch directory to gen_path and generate C code
-        # (we do this because the CasADi CodeGenerator can't be initialized with a path)
-        os.chdir(gen_path)
-        if self.model_config.verbose:
-            print('- Generating C code for model %s at %s' % (self.model_config.model_name, str(gen_path)))
-        self.generator.generate()
-
-        # Compile into shared object
-        so_path = gen_path.joinpath(self.so_file_name)
-        if self.model_config.verbose:
-            print('- Compiling shared object %s from %s with optimization flag -%s' % (so_path, c_path, self.model_config.opt_flag))
-        os.system('gcc -fPIC -shared -%s %s -o %s' % (self.model_config.opt_flag, c_path, so_path))
-
-        # Swtich back to working directory
-        os.chdir(cur_dir)
-
-        # Install generated C code
-        if self.model_config.install:
-            install_path = self.install(verbose=self.model_config.verbose)
-            return install_path.joinpath(self.so_file_name)
-        else:
+            generator.add(f)
+
+        cache_path = self.shared_object_dir()
+        cache_path.mkdir(parents=True, exist_ok=True)
+
+        build_path = pathlib.Path(tempfile.mkdtemp(prefix='.build_%s_' % self.model_config.model_name, dir=cache_path))
+        try:
+            # Generate C code into the temporary build directory
+            generator.generate(str(build_path) + os.sep)
+            c_path = build_path.joinpath(self.c_file_name)
+            code = c_path.read_bytes()
+
+            compiler = os.environ.get('CC', 'gcc')
+            cmd = [compiler, '-fPIC', '-shared', '-%s' % self.model_config.opt_flag, self.c_file_name, '-o', self.so_file_name]
+            key = hashlib.sha256(code + ' '.join(cmd).encode() + ca.__version__.encode()).hexdigest()[:16]
+            gen_path = cache_path.joinpath('%s_%s' % (self.model_config.model_name, key))
+            so_path = gen_path.joinpath(self.so_file_name)
+            if so_path.exists():
+                if self.model_config.verbose:
+                    print('- Using cached shared object %s' % so_path)
+                return so_path
+
+            # Compile into shared object
+            if self.model_config.verbose:
+                print('- Compiling shared object %s from %s with optimization flag -%s' % (so_path, c_path, self.model_config.opt_flag))
+            try:
+                result = subprocess.run(cmd, cwd=build_path, capture_output=True, text=True)
+            except OSError as e:
+                raise RuntimeError('Could not run compiler %s: %s' % (compiler, e))
+            if result.returncode != 0 or not build_path.joinpath(self.so_file_name).exists():
+                raise RuntimeError('Compilation of model %s failed (%s):\n%s' % (self.model_config.model_name, ' '.join(cmd), result.stderr))
+
+            # Move the build into place, unless another process got there first
+            try:
+                os.rename(build_path, gen_path)
+            except OSError:
+                if not so_path.exists():
+                    raise
             return so_path
+        finally:
+            if build_path.exists():
+                shutil.rmtree(build_path, ignore_errors=True)
 
     # Method for installing generated files
     def install(self, dest_dir: str=None, src_dir: str=None, verbose=False):
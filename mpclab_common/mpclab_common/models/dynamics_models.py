@@ -11,17 +11,23 @@ from abc import abstractmethod
 import array
 from typing import Tuple, List
 from copy import deepcopy
+import os
+import threading
 
 import pdb
 
 from mpclab_common.pytypes import VehicleState, VehicleActuation, VehiclePrediction
 from mpclab_common.models.model_types import *
 from mpclab_common.models.abstract_model import AbstractModel
+from mpclab_common.models.function_cache import FunctionCache, model_cache_key
 from mpclab_common.track import get_track
 from mpclab_common.tracks.radius_arclength_track import RadiusArclengthTrack
 from mpclab_common.tracks.casadi_bspline_track import CasadiBSplineTrack
 
 
+# Guards the on-demand construction of derivative functions (reentrant since builders access each other)
+_lazy_fn_lock = threading.RLock()
+
 class CasadiDynamicsModel(AbstractModel):
     '''
     Base class for dynamics models that use casadi for their models.
@@ -47,6 +53,17 @@ class CasadiDynamicsModel(AbstractModel):
         self.M = model_config.M # RK4 integration steps
         self.h = self.dt/self.M # RK4 integration time intervals
 
+        # Runtime parameters exposed as an extra input p of the model functions (see _init_params)
+        self.sym_p = None
+        self.n_p = 0
+        self.p = np.zeros(0)
+        self.param_names = []
+
+        # Cache of open-loop rollout functions keyed by horizon length (and batch size)
+        self._rollout_fns = dict()
+        # Cache of mapped model functions keyed by function name, batch size and parallelization
+        self._batch_fns = dict()
+
     @abstractmethod
     def state2qu(self):
         pass
@@ -75,30 +92,18 @@ class CasadiDynamicsModel(AbstractModel):
         dyn_inputs = [self.sym_q, self.sym_u]
         if type(self.dt) is ca.SX or type(self.dt) is ca.MX:
             dyn_inputs += [self.dt]
+        dyn_inputs += self._param_inputs()
 
-        # Continuous time dynamics function
-        self.fc = ca.Function('fc', dyn_inputs, [self.sym_dq], self.options('fc'))
-
-        # First derivatives
-        self.sym_Ac = ca.jacobian(self.sym_dq, self.sym_q)
-        self.sym_Bc = ca.jacobian(self.sym_dq, self.sym_u)
-        self.sym_Cc = self.sym_dq
-
-        self.fA = ca.Function('fA', dyn_inputs, [self.sym_Ac], self.options('fA'))
-        self.fB = ca.Function('fB', dyn_inputs, [self.sym_Bc], self.options('fB'))
-        self.fC = ca.Function('fC', dyn_inputs, [self.sym_Cc], self.options('fC'))
+        # Continuous time dynamics function (fc is kept for the discretization, self.fc may be replaced by its compiled
+        # version)
+        fc = self.fc = ca.Function('fc', dyn_inputs, [self.sym_dq], self.options('fc'))
+        ct_inputs = list(dyn_inputs)
 
         # Discretization
         discretization_method = self.model_config.discretization_method
-        if discretization_method == 'euler':
-            sym_q_kp1 = self.sym_q + self.dt * self.fc(*dyn_inputs)
-        elif discretization_method == 'rk4':
-            sym_q_kp1 = self.rk4(*dyn_inputs, self.fc, self.M, self.h)
-        elif discretization_method == 'rk3':
-            sym_q_kp1 = self.rk3(*dyn_inputs, self.fc, self.M, self.h)
-        elif discretization_method == 'rk2':
-            sym_q_kp1 = self.rk2(*dyn_inputs, self.fc, self.M, self.h)
-        elif discretization_method == 'idas':
+        if discretization_method == 'idas':
+            if self.sym_p is not None:
+                raise ValueError('Runtime parameters are not supported with the idas discretization method')
             prob = {'x': self.sym_q, 'p': self.sym_u, 'ode': self.fc(self.sym_q, self.sym_u)}
             setup = {'t0': 0, 'tf': self.dt}
             self.integrator = ca.integrator('int', 'idas', prob, setup)
@@ -106,10 +111,10 @@ class CasadiDynamicsModel(AbstractModel):
                 self.sym_q = ca.MX.sym('q', self.n_q)
             if isinstance(self.sym_u, ca.SX):
                 self.sym_u = ca.MX.sym('u', self.n_u)
-            sym_q_kp1 = self.integrator.call([self.sym_q, self.sym_u, 0, 0, 0, 0])[0]
+            sym_q_int = self.integrator.call([self.sym_q, self.sym_u, 0, 0, 0, 0])[0]
             dyn_inputs[0] = self.sym_q
             dyn_inputs[1] = self.sym_u
-        else:
+        elif discretization_method not in ['euler', 'rk4', 'rk3', 'rk2']:
             raise ValueError('Discretization method of %s not recognized' % discretization_method)
 
         if self.model_config.noise:
@@ -121,49 +126,178 @@ class CasadiDynamicsModel(AbstractModel):
             # Symbolic variables for additive process noise components for each state
             self.n_m = self.n_q
             self.sym_m = ca.SX.sym('m', self.n_m)
-            sym_q_kp1 += ca.mtimes(la.sqrtm(self.noise_cov), self.sym_m)
             dyn_inputs += [self.sym_m]
 
-        # Discrete time dynamics function
-        self.fd = ca.Function('fd', dyn_inputs, [sym_q_kp1], self.options('fd'))
+        # The discretized expression is only built when needed, i.e. when fd or a derivative is not loaded compiled
+        def discretize():
+            f = lambda q, u: fc(q, u, *ct_inputs[2:])
+            if discretization_method == 'euler':
+                sym_q_kp1 = ct_inputs[0] + self.dt * fc(*ct_inputs)
+            elif discretization_method == 'rk4':
+                sym_q_kp1 = self.rk4(ct_inputs[0], ct_inputs[1], f, self.M, self.h)
+            elif discretization_method == 'rk3':
+                sym_q_kp1 = self.rk3(ct_inputs[0], ct_inputs[1], f, self.M, self.h)
+            elif discretization_method == 'rk2':
+                sym_q_kp1 = self.rk2(ct_inputs[0], ct_inputs[1], f, self.M, self.h)
+            elif discretization_method == 'idas':
+                sym_q_kp1 = sym_q_int
+            if self.model_config.noise:
+                sym_q_kp1 += ca.mtimes(la.sqrtm(self.noise_cov), self.sym_m)
+            return sym_q_kp1
+
+        # Derivative functions are only built on first access (see __getattr__)
+        for name in self.__dict__.get('_lazy_fns', dict()).keys():
+            self.__dict__.pop(name, None)
+        sym_dq = self.sym_dq
+        lazy_fns = dict()
+        lazy_fns['sym_q_kp1'] = discretize
 
         # First derivatives
-        self.sym_Ad = ca.jacobian(sym_q_kp1, self.sym_q)
-        self.sym_Bd = ca.jacobian(sym_q_kp1, self.sym_u)
-        self.sym_Cd = sym_q_kp1
+        lazy_fns['sym_Ac'] = lambda: ca.jacobian(sym_dq, ct_inputs[0])
+        lazy_fns['sym_Bc'] = lambda: ca.jacobian(sym_dq, ct_inputs[1])
+        lazy_fns['sym_Cc'] = lambda: sym_dq
+
+        lazy_fns['fA'] = lambda: ca.Function('fA', ct_inputs, [self.sym_Ac], self.options('fA'))
+        lazy_fns['fB'] = lambda: ca.Function('fB', ct_inputs, [self.sym_Bc], self.options('fB'))
+        lazy_fns['fC'] = lambda: ca.Function('fC', ct_inputs, [self.sym_Cc], self.options('fC'))
+
+        lazy_fns['sym_Ad'] = lambda: ca.jacobian(self.sym_q_kp1, dyn_inputs[0])
+        lazy_fns['sym_Bd'] = lambda: ca.jacobian(self.sym_q_kp1, dyn_inputs[1])
+        lazy_fns['sym_Cd'] = lambda: self.sym_q_kp1
 
-        self.fAd = ca.Function('fAd', dyn_inputs, [self.sym_Ad], self.options('fAd'))
-        self.fBd = ca.Function('fBd', dyn_inputs, [self.sym_Bd], self.options('fBd'))
-        self.fCd = ca.Function('fCd', dyn_inputs, [self.sym_Cd], self.options('fCd'))
+        lazy_fns['fAd'] = lambda: ca.Function('fAd', dyn_inputs, [self.sym_Ad], self.options('fAd'))
+        lazy_fns['fBd'] = lambda: ca.Function('fBd', dyn_inputs, [self.sym_Bd], self.options('fBd'))
+        lazy_fns['fCd'] = lambda: ca.Function('fCd', dyn_inputs, [self.sym_Cd], self.options('fCd'))
 
         # Second derivatives
         if self.model_config.compute_hessians:
-            self.sym_Ed = [ca.jacobian(ca.jacobian(sym_q_kp1[i], self.sym_q), self.sym_q) for i in range(self.n_q)]
-            self.sym_Fd = [ca.jacobian(ca.jacobian(sym_q_kp1[i], self.sym_u), self.sym_u) for i in range(self.n_q)]
-            self.sym_Gd = [ca.jacobian(ca.jacobian(sym_q_kp1[i], self.sym_u), self.sym_q) for i in range(self.n_q)]
+            lazy_fns['sym_Ed'] = lambda: [ca.jacobian(ca.jacobian(self.sym_q_kp1[i], dyn_inputs[0]), dyn_inputs[0]) for i in range(self.n_q)]
+            lazy_fns['sym_Fd'] = lambda: [ca.jacobian(ca.jacobian(self.sym_q_kp1[i], dyn_inputs[1]), dyn_inputs[1]) for i in range(self.n_q)]
+            lazy_fns['sym_Gd'] = lambda: [ca.jacobian(ca.jacobian(self.sym_q_kp1[i], dyn_inputs[1]), dyn_inputs[0]) for i in range(self.n_q)]
 
-            self.fEd = ca.Function('fEd', dyn_inputs, self.sym_Ed, self.options('fEd'))
-            self.fFd = ca.Function('fFd', dyn_inputs, self.sym_Fd, self.options('fFd'))
-            self.fGd = ca.Function('fGd', dyn_inputs, self.sym_Gd, self.options('fGd'))
-        
-        if self.model_config.noise:
-            self.sym_Md = ca.jacobian(sym_q_kp1, self.sym_m)
-            self.fMd = ca.Function('fMd', dyn_inputs, [self.sym_Md], self.options('fMd'))
+            lazy_fns['fEd'] = lambda: ca.Function('fEd', dyn_inputs, self.sym_Ed, self.options('fEd'))
+            lazy_fns['fFd'] = lambda: ca.Function('fFd', dyn_inputs, self.sym_Fd, self.options('fFd'))
+            lazy_fns['fGd'] = lambda: ca.Function('fGd', dyn_inputs, self.sym_Gd, self.options('fGd'))
 
-        # Build shared object if not doing just-in-time compilation
+        if self.model_config.noise:
+            lazy_fns['sym_Md'] = lambda: ca.jacobian(self.sym_q_kp1, self.sym_m)
+            lazy_fns['fMd'] = lambda: ca.Function('fMd', dyn_inputs, [self.sym_Md], self.options('fMd'))
+
+        # Discrete time dynamics function, built on first access as well (the compiled one is loaded instead for code
+        # generated models that were already built)
+        lazy_fns['fd'] = lambda: ca.Function('fd', dyn_inputs, [self.sym_q_kp1], self.options('fd'))
+
+        self._lazy_fns = lazy_fns
+        if not getattr(self.model_config, 'lazy_derivatives', True):
+            for name in lazy_fns.keys():
+                getattr(self, name)
+
+        # Symbolic inputs of the discrete time functions, used to build further functions on demand
+        self.dyn_inputs = dyn_inputs
+        # Stacked trajectory linearization functions, built on the first call to linearize_trajectory
+        self.f_lin = None
+        self.f_lin_hess = None
+
+        # Build shared object if not doing just-in-time compilation, unless the index of compiled models already has
+        # the shared object of this model
         if self.code_gen and not self.jit:
-            so_fns = [self.fc, self.fA, self.fB, self.fC, self.fd, self.fAd, self.fBd, self.fCd]
+            so_names = ['fc', 'fA', 'fB', 'fC', 'fd', 'fAd', 'fBd', 'fCd']
             if self.model_config.compute_hessians:
-                so_fns += [self.fEd, self.fFd, self.fGd]
+                so_names += ['fEd', 'fFd', 'fGd']
             if self.model_config.noise:
-                so_fns += [self.fMd]
-            self.install_dir = self.build_shared_object(so_fns)
+                so_names += ['fMd']
+            compiled = FunctionCache.for_model(self, self.shared_object_dir())
+            self.install_dir = compiled.load()
+            if self.install_dir is None:
+                self.install_dir = self.build_shared_object([getattr(self, n) for n in so_names])
+                compiled.store(self.install_dir)
+            # Replace the symbolic functions by the compiled ones
+            for n in so_names:
+                self.__dict__[n] = ca.external(n, str(self.install_dir))
 
         return
 
-    def step(self, vehicle_state: VehicleState, inplace=True) -> VehicleState:
+    def _init_params(self, sym, param_map: dict):
+        '''
+        replaces the model constants named in model_config.params by the entries of a symbolic parameter vector p
+        param_map maps config field names to the model attributes they are stored in (e.g. mass -> m)
+        must be called by the model before any expression is built from those attributes
+        '''
+        names = getattr(self.model_config, 'params', None)
+        if not names:
+            return
+        for n in names:
+            if n not in param_map:
+                raise ValueError('Parameter %s is not supported by %s, choose from %s' % (n, type(self).__name__, list(param_map.keys())))
+        self.param_names = list(names)
+        self.n_p = len(names)
+        self.p = np.array([getattr(self.model_config, n) for n in names], dtype=float)
+        self.sym_p = sym('p', self.n_p)
+        for i, n in enumerate(names):
+            setattr(self, param_map[n], self.sym_p[i])
+
+    def _param_inputs(self) -> list:
+        return [] if self.sym_p is None else [self.sym_p]
+
+    def _param_args(self) -> list:
+        return [] if self.sym_p is None else [self.p]
+
+    def get_params(self) -> dict:
+        return dict(zip(self.param_names, self.p.tolist()))
+
+    def set_params(self, params):
+        '''
+        sets the current values of the runtime parameters used by step, from an array ordered as model_config.params
+        or a dict with (a subset of) the parameter names, the other parameters keep their current values
+        '''
+        self.p = self._updated_params(self.p, self.param_names, params)
+
+    @staticmethod
+    def _updated_params(p: np.ndarray, param_names: list, params) -> np.ndarray:
+        if isinstance(params, dict):
+            p = p.copy()
+            for n, v in params.items():
+                if n not in param_names:
+                    raise ValueError('%s is not a runtime parameter of this model, runtime parameters: %s' % (n, param_names))
+                p[param_names.index(n)] = v
+        else:
+            params = np.asarray(params, dtype=float).reshape(-1)
+            if params.size != p.size:
+                raise ValueError('Expected %i parameter values, got %i' % (p.size, params.size))
+            p = params
+        return p
+
+    def _param_matrix(self, P, B: int = None):
+        '''
+        parameter input for a mapped function: the current values if P is None, one parameter vector (n_p,)
+        shared by the whole batch or one vector per sample (B, n_p)
+        '''
+        if P is None:
+            return self.p
+        P = np.asarray(P, dtype=float)
+        if P.ndim == 1:
+            return P
+        if B is not None and P.shape[0] != B:
+            raise ValueError('Expected %i parameter vectors, got %i' % (B, P.shape[0]))
+        return P.T
+
+    def __getattr__(self, name):
+        '''
+        builds the derivative functions registered by precompute_model on first access
+        '''
+        lazy_fns = self.__dict__.get('_lazy_fns')
+        if lazy_fns is None or name not in lazy_fns:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        with _lazy_fn_lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = lazy_fns[name]()
+        return self.__dict__[name]
+
+    def step(self, vehicle_state: VehicleState, inplace=True, update_frame=True) -> VehicleState:
         '''
         steps noise-free model forward one time step (self.dt) using numerical integration
+        if update_frame is False, only the frame of reference of the model is updated, the other one (global pose
+        for curvilinear models, track frame pose for global models) is left for the caller to reconstruct from the track
         '''
         if not inplace:
             vehicle_state = deepcopy(vehicle_state)
@@ -172,24 +306,176 @@ class CasadiDynamicsModel(AbstractModel):
         tf = t + self.dt
 
         # q_n = self.rk4(q, u, self.fc, self.M, self.h).toarray().squeeze()
-        sol = solve_ivp(lambda t, z: np.array(self.fc(z, u)).squeeze(), (0, self.dt), q, t_eval=[self.dt])
-        q_n = sol.y.squeeze()
+        p = self._param_args()
+        step_method = getattr(self.model_config, 'step_method', None) or 'adaptive'
+        if step_method == 'adaptive':
+            sol = solve_ivp(lambda t, z: np.array(self.fc(z, u, *p)).squeeze(), (0, self.dt), q, t_eval=[self.dt],
+                            rtol=getattr(self.model_config, 'step_rtol', 1e-3), atol=getattr(self.model_config, 'step_atol', 1e-6))
+            q_n = sol.y.squeeze()
+        elif step_method == 'discrete':
+            fd = self._nominal_fn(self.fd) if self.model_config.noise else self.fd
+            q_n = np.array(fd(q, u, *p)).squeeze()
+        else:
+            raise ValueError('Step method of %s not recognized' % step_method)
 
-        a_x, a_y, a_z = self.f_a(q_n, u)
-        a_phi, a_the, a_psi = self.f_ang_a(q_n, u)
+        a_x, a_y, a_z = self.f_a(q_n, u, *p)
+        a_phi, a_the, a_psi = self.f_ang_a(q_n, u, *p)
 
         self.qu2state(vehicle_state, q_n, u)
         vehicle_state.t = tf + self.t0
         vehicle_state.a.a_long, vehicle_state.a.a_tran, vehicle_state.a.a_n = float(a_x), float(a_y), float(a_z)
         vehicle_state.aa.a_phi, vehicle_state.aa.a_theta, vehicle_state.aa.a_psi = float(a_phi), float(a_the), float(a_psi)
 
-        if self.track is not None:
+        if self.track is not None and update_frame:
             if self.curvature_model:
                 self.track.local_to_global_typed(vehicle_state)
             else:
                 self.track.global_to_local_typed(vehicle_state)
         return vehicle_state
 
+    def _nominal_fn(self, f: ca.Function) -> ca.Function:
+        '''
+        wraps a model function f(q, u, [p], ...) as f(q, u, [p]) with any extra inputs (e.g. process noise) set to zero
+        '''
+        n_in = 3 if self.sym_p is not None else 2
+        if f.n_in() <= n_in:
+            return f
+        args = [ca.MX.sym('q', self.n_q), ca.MX.sym('u', self.n_u)] + [ca.MX.sym('p', self.n_p)]*(n_in - 2)
+        extra = [ca.DM.zeros(f.size_in(i)) for i in range(n_in, f.n_in())]
+        return ca.Function(f.name() + '_nominal', args, f.call(args + extra))
+
+    def _map(self, f: ca.Function, B: int, parallelization: str = None, n_threads: int = None) -> ca.Function:
+        if parallelization is None:
+            parallelization = getattr(self.model_config, 'batch_parallelization', 'serial')
+        if n_threads is None:
+            n_threads = getattr(self.model_config, 'batch_n_threads', None)
+        if parallelization == 'thread':
+            if n_threads is None:
+                n_threads = os.cpu_count() or 1
+            return f.map(B, 'thread', min(n_threads, B))
+        elif parallelization in ['serial', 'openmp']:
+            return f.map(B, parallelization)
+        else:
+            raise ValueError('Parallelization method of %s not recognized' % parallelization)
+
+    def get_batch_fn(self, fn_name: str, B: int, parallelization: str = None, n_threads: int = None) -> ca.Function:
+        '''
+        returns the cached version of the model function fn_name (e.g. 'fd', 'fAd', 'fBd', 'fCd') mapped over a batch of B (q, u) pairs
+        parallelization and n_threads default to the batch_parallelization and batch_n_threads fields of the model config
+        '''
+        key = (fn_name, B, parallelization, n_threads)
+        if key not in self._batch_fns:
+            f = self._nominal_fn(getattr(self, fn_name))
+            self._batch_fns[key] = self._map(f, B, parallelization, n_threads)
+        return self._batch_fns[key]
+
+    def evaluate_batch(self, fn_name: str, Q: np.ndarray, U: np.ndarray, P: np.ndarray = None, parallelization: str = None, n_threads: int = None):
+        '''
+        evaluates the model function fn_name at the B pairs of states Q: (B, n_q) and inputs U: (B, n_u) in a single call
+        for models with runtime parameters, P is either one parameter vector (n_p,) or one per sample (B, n_p) (defaults to the current values)
+        each output of size (r, c) is returned stacked as a contiguous array of shape (B, r, c), or (B, r) when c is 1
+        '''
+        Q = np.asarray(Q, dtype=float).reshape((-1, self.n_q))
+        U = np.asarray(U, dtype=float).reshape((-1, self.n_u))
+        B = Q.shape[0]
+        f = self.get_batch_fn(fn_name, B, parallelization, n_threads)
+        args = [Q.T, U.T]
+        if self.sym_p is not None:
+            args.append(self._param_matrix(P, B))
+        out = f(*args)
+        if not isinstance(out, (list, tuple)):
+            out = [out]
+        res = []
+        for i, o in enumerate(out):
+            r, c = f.size_out(i)[0], f.size_out(i)[1]//B
+            o = np.array(o).reshape((r, B, c)).transpose((1, 0, 2))
+            res.append(np.ascontiguousarray(o[:, :, 0] if c == 1 else o))
+        return res[0] if len(res) == 1 else res
+
+    def linearize_trajectory(self, Q: np.ndarray, U: np.ndarray, hessians: bool = False, p: np.ndarray = None):
+        '''
+        linearizes the discrete time dynamics about each stage (q_k, u_k) of a trajectory in a single call
+        Q: (N, n_q) or (N+1, n_q) (the last state is ignored), U: (N, n_u)
+        returns the stacked contiguous arrays A: (N, n_q, n_q), B: (N, n_q, n_u) and c: (N, n_q)
+        such that q_k+1 ~ A_k q_k + B_k u_k + c_k
+        if hessians is True (requires compute_hessians), also returns the second derivatives
+        E: (N, n_q, n_q, n_q), F: (N, n_q, n_u, n_u), G: (N, n_q, n_u, n_q) where E[k, i] is the Hessian of q_k+1[i]
+        p: runtime parameter values for models with runtime parameters, defaults to the current values
+        '''
+        if hessians and not self.model_config.compute_hessians:
+            raise ValueError('Hessians of the dynamics were requested but compute_hessians is not set in the model config')
+        fn_name = 'f_lin_hess' if hessians else 'f_lin'
+        if getattr(self, fn_name) is None:
+            def build():
+                sym_q, sym_u = self.dyn_inputs[0], self.dyn_inputs[1]
+                sym_c = self.sym_Cd - ca.mtimes(self.sym_Ad, sym_q) - ca.mtimes(self.sym_Bd, sym_u)
+                lin_out = [self.sym_Ad, self.sym_Bd, sym_c]
+                if hessians:
+                    lin_out += [ca.vertcat(*self.sym_Ed), ca.vertcat(*self.sym_Fd), ca.vertcat(*self.sym_Gd)]
+                return ca.Function(fn_name, self.dyn_inputs, lin_out, self.options(fn_name))
+            setattr(self, fn_name, build())
+
+        U = np.asarray(U, dtype=float).reshape((-1, self.n_u))
+        N = U.shape[0]
+        Q = np.asarray(Q, dtype=float).reshape((-1, self.n_q))[:N]
+        out = self.evaluate_batch(fn_name, Q, U, p)
+        A, B, c = out[0], out[1], out[2].reshape((N, self.n_q))
+        if not hessians:
+            return A, B, c
+        E = out[3].reshape((N, self.n_q, self.n_q, self.n_q))
+        F = out[4].reshape((N, self.n_q, self.n_u, self.n_u))
+        G = out[5].reshape((N, self.n_q, self.n_u, self.n_q))
+        return A, B, c, E, F, G
+
+    def get_rollout_fn(self, N: int, B: int = None) -> ca.Function:
+        '''
+        returns the cached open-loop rollout function for horizon length N, built from fd with mapaccum
+        rollout_N(q0: (n_q, 1), U: (n_u, N), [p: (n_p, 1)]) -> Q: (n_q, N+1)
+        if a batch size B is given, the function is mapped over B rollouts concatenated horizontally
+        any extra inputs of fd (e.g. process noise) are set to zero
+        '''
+        key = (N, B)
+        if key not in self._rollout_fns:
+            if (N, None) not in self._rollout_fns:
+                fd = self._nominal_fn(self.fd)
+                sym_q0 = ca.MX.sym('q0', self.n_q)
+                sym_U = ca.MX.sym('U', self.n_u, N)
+                sym_p = [ca.MX.sym('p', self.n_p)] if self.sym_p is not None else []
+                sym_Q = fd.mapaccum('fd_acc_%i' % N, N)(sym_q0, sym_U, *[ca.repmat(p, 1, N) for p in sym_p])
+                self._rollout_fns[(N, None)] = ca.Function('rollout_%i' % N, [sym_q0, sym_U] + sym_p, [ca.horzcat(sym_q0, sym_Q)])
+            if B is not None:
+                self._rollout_fns[key] = self._map(self._rollout_fns[(N, None)], B)
+        return self._rollout_fns[key]
+
+    def rollout(self, q0: np.ndarray, U: np.ndarray, p: np.ndarray = None) -> np.ndarray:
+        '''
+        simulates the input sequence U: (N, n_u) from the initial state q0: (n_q,) using fd
+        p: runtime parameter values for models with runtime parameters, defaults to the current values
+        returns the state trajectory Q: (N+1, n_q), including q0
+        '''
+        U = np.asarray(U, dtype=float).reshape((-1, self.n_u))
+        f = self.get_rollout_fn(U.shape[0])
+        args = [q0, U.T]
+        if self.sym_p is not None:
+            args.append(self._param_matrix(p))
+        return np.array(f(*args)).T
+
+    def rollout_batch(self, Q0: np.ndarray, U: np.ndarray, P: np.ndarray = None) -> np.ndarray:
+        '''
+        simulates B input sequences U: (B, N, n_u) from the initial states Q0: (B, n_q) in a single call
+        for models with runtime parameters, P is either one parameter vector (n_p,) or one per rollout (B, n_p) (defaults to the current values)
+        returns the state trajectories Q: (B, N+1, n_q)
+        '''
+        U = np.asarray(U, dtype=float)
+        B, N = U.shape[0], U.shape[1]
+        Q0 = np.asarray(Q0, dtype=float).reshape((B, self.n_q))
+        f = self.get_rollout_fn(N, B)
+        args = [Q0.T, U.reshape((B*N, self.n_u)).T]
+        if self.sym_p is not None:
+            args.append(self._param_matrix(P, B))
+        Q = np.array(f(*args))
+        return Q.T.reshape((B, N+1, self.n_q))
+
     def rk4(self, x, u, f, M, h):
         '''
         Discrete nonlinear dynamics (RK4 approx.)
@@ -1593,12 +1879,57 @@ class CasadiKinematicBicycleProgressAugmented(CasadiDynamicsModel):
         
         return prediction
 
+# Constants of the dynamic bicycle models that can be exposed as runtime parameters, with the attributes they are stored in
+_dynamic_bicycle_params = dict(mass='m', yaw_inertia='I_z',
+                               drag_coefficient='c_dr', damping_coefficient='c_da', rolling_resistance='c_r',
+                               wheel_friction='mu',
+                               pacejka_b_front='pacejka_Bf', pacejka_b_rear='pacejka_Br',
+                               pacejka_c_front='pacejka_Cf', pacejka_c_rear='pacejka_Cr',
+                               pacejka_d_front='pacejka_Df', pacejka_d_rear='pacejka_Dr',
+                               linear_bf='linear_Bf', linear_br='linear_Br')
+
+def _init_dynamic_bicycle_params(model, sym):
+    model._init_params(sym, _dynamic_bicycle_params)
+    if 'wheel_friction' in model.param_names:
+        # The friction only enters the dynamics through the peak tire forces, which are derived from it as in DynamicBicycleConfig
+        if 'pacejka_d_front' in model.param_names or 'pacejka_d_rear' in model.param_names:
+            raise ValueError('wheel_friction and pacejka_d_front/pacejka_d_rear cannot both be runtime parameters')
+        model.pacejka_Df = model.mu*model.m*model.g * model.L_r / (model.L_r + model.L_f)
+        model.pacejka_Dr = model.mu*model.m*model.g * model.L_f / (model.L_r + model.L_f)
+
+def _blend_kinematic_bicycle(model, F_ext):
+    '''
+    blends the body frame accelerations of a dynamic bicycle model with those of a kinematic bicycle at low speed
+    The kinematic model is written in the states of the dynamic model (vx, vy, psidot): vy and psidot follow the
+    kinematic values vx*tan(gamma)*L_r/L and vx*tan(gamma)/L as vx changes, and relax towards them with the time
+    constant blend_tau (e.g. after a change of the steering, or from the dynamic model state). The blending weight goes
+    smoothly from 0 at blend_v_min to 1 at blend_v_max, which removes the stiff slip angle dynamics as vx -> 0.
+    returns the blended ax, ay and yaw acceleration, defined such that dvx = ax + psidot*vy and dvy = ay - psidot*vx
+    '''
+    L = model.L_f + model.L_r
+    v_min, v_max = model.model_config.blend_v_min, model.model_config.blend_v_max
+    tau = model.model_config.blend_tau
+    t = ca.fmin(ca.fmax((model.sym_vx - v_min) / (v_max - v_min), 0), 1)
+    lam = t**2 * (3 - 2*t)
+
+    tan_gamma = ca.tan(model.sym_u_s)
+    dvx_kin = model.sym_u_a + F_ext / model.m
+    dvy_kin = dvx_kin * tan_gamma * model.L_r / L + (model.sym_vx * tan_gamma * model.L_r / L - model.sym_vy) / tau
+    dpsidot_kin = dvx_kin * tan_gamma / L + (model.sym_vx * tan_gamma / L - model.sym_psidot) / tau
+
+    ax = lam * model.sym_ax + (1 - lam) * (dvx_kin - model.sym_psidot * model.sym_vy)
+    ay = lam * model.sym_ay + (1 - lam) * (dvy_kin + model.sym_psidot * model.sym_vx)
+    alphaz = lam * model.sym_alphaz + (1 - lam) * dpsidot_kin
+    return ax, ay, alphaz
+
 class CasadiDynamicBicycle(CasadiDynamicsModel):
     '''
     Global frame of reference dynamic bicycle model - Pacejka model tire forces
 
     Body frame velocities and global frame positions
     '''
+    # blend with the kinematic bicycle at low speed (see _blend_kinematic_bicycle)
+    blend_kinematic = False
 
     def __init__(self, t0: float,
                     model_config: DynamicBicycleConfig = DynamicBicycleConfig(), track=None):
@@ -1646,6 +1977,9 @@ class CasadiDynamicBicycle(CasadiDynamicsModel):
         else:
             sym = ca.SX.sym
 
+        # Runtime parameters (see DynamicsConfig.params)
+        _init_dynamic_bicycle_params(self, sym)
+
         # symbolic variables
         self.sym_vx         = sym('vx')  # body fram vx, vy (vx>0 points in direction car points, vy>0 points to left hand side)
         self.sym_vy         = sym('vy')
@@ -1690,6 +2024,8 @@ class CasadiDynamicBicycle(CasadiDynamicsModel):
         self.sym_ax = _ar + _af*ca.cos(self.sym_u_s) + (F_ext - self.sym_fyf * ca.sin(self.sym_u_s)) / self.m
         self.sym_ay = _af*ca.sin(self.sym_u_s) + (self.sym_fyf * ca.cos(self.sym_u_s) + self.sym_fyr) / self.m
         self.sym_alphaz = (self.L_f * self.sym_fyf * ca.cos(self.sym_u_s) - self.L_r * self.sym_fyr) / self.I_z
+        if self.blend_kinematic:
+            self.sym_ax, self.sym_ay, self.sym_alphaz = _blend_kinematic_bicycle(self, F_ext)
 
         # time derivatives
         self.sym_dvx        = self.sym_ax + self.sym_psidot * self.sym_vy
@@ -1705,16 +2041,16 @@ class CasadiDynamicBicycle(CasadiDynamicsModel):
         self.sym_dq = ca.vertcat(self.sym_dvx, self.sym_dvy, self.sym_dpsidot, self.sym_dx, self.sym_dy, self.sym_dpsi)
         
         # Auxilliary functions
-        self.f_a = ca.Function('f_a', [self.sym_q, self.sym_u], [self.sym_ax, self.sym_ay, 0], self.options('f_a'))
-        self.f_alpha = ca.Function('f_alpha', [self.sym_q, self.sym_u], [self.sym_alpha_f, self.sym_alpha_r])
-        self.f_ang_a = ca.Function('f_ang_a', [self.sym_q, self.sym_u], [0, 0, self.sym_alphaz], self.options('f_ang_a'))
+        self.f_a = ca.Function('f_a', [self.sym_q, self.sym_u] + self._param_inputs(), [self.sym_ax, self.sym_ay, 0], self.options('f_a'))
+        self.f_alpha = ca.Function('f_alpha', [self.sym_q, self.sym_u] + self._param_inputs(), [self.sym_alpha_f, self.sym_alpha_r])
+        self.f_ang_a = ca.Function('f_ang_a', [self.sym_q, self.sym_u] + self._param_inputs(), [0, 0, self.sym_alphaz], self.options('f_ang_a'))
 
         self.precompute_model()
         return
 
     def get_slip_angles(self, state: VehicleState) -> np.ndarray:
         q, u = self.state2qu(state)
-        return np.array(self.f_alpha(q, u)).squeeze()
+        return np.array(self.f_alpha(q, u, *self._param_args())).squeeze()
 
     def state2qu(self, state: VehicleState) -> Tuple[np.ndarray, np.ndarray]:
         q = np.array([state.v.v_long, state.v.v_tran, state.w.w_psi, state.x.x, state.x.y, state.e.psi])
@@ -1863,6 +2199,8 @@ class CasadiDynamicCLBicycle(CasadiDynamicsModel):
 
     Body frame velocities and track frame positions
     '''
+    # blend with the kinematic bicycle at low speed (see _blend_kinematic_bicycle)
+    blend_kinematic = False
     def __init__(self, t0: float, model_config: DynamicBicycleConfig = DynamicBicycleConfig(), track=None):
         super().__init__(t0, model_config, track=track)
 
@@ -1909,6 +2247,9 @@ class CasadiDynamicCLBicycle(CasadiDynamicsModel):
         else:
             sym = ca.SX.sym
 
+        # Runtime parameters (see DynamicsConfig.params)
+        _init_dynamic_bicycle_params(self, sym)
+
         # symbolic variables
         self.sym_vx     = sym('vx')
         self.sym_vy     = sym('vy')
@@ -1956,6 +2297,8 @@ class CasadiDynamicCLBicycle(CasadiDynamicsModel):
         self.sym_ax = _ar + _af*ca.cos(self.sym_u_s) + (F_ext - self.sym_fyf * ca.sin(self.sym_u_s)) / self.m
         self.sym_ay = _af*ca.sin(self.sym_u_s) + (self.sym_fyf * ca.cos(self.sym_u_s) + self.sym_fyr) / self.m        
         self.sym_alphaz = (self.L_f * self.sym_fyf * ca.cos(self.sym_u_s) - self.L_r * self.sym_fyr) / self.I_z
+        if self.blend_kinematic:
+            self.sym_ax, self.sym_ay, self.sym_alphaz = _blend_kinematic_bicycle(self, F_ext)
 
         # time derivatives
         self.sym_dvx        = self.sym_ax + self.sym_psidot * self.sym_vy
@@ -1971,20 +2314,20 @@ class CasadiDynamicCLBicycle(CasadiDynamicsModel):
         self.sym_dq = ca.vertcat(self.sym_dvx, self.sym_dvy, self.sym_dpsidot, self.sym_depsi, self.sym_ds, self.sym_dxtran)
 
         # Auxilliary functions
-        self.f_a = ca.Function('f_a', [self.sym_q, self.sym_u], [self.sym_ax, self.sym_ay, 0], self.options('f_a'))
-        self.f_alpha = ca.Function('f_alpha', [self.sym_q, self.sym_u], [self.sym_alpha_f, self.sym_alpha_r])
-        self.f_ang_a = ca.Function('f_ang_a', [self.sym_q, self.sym_u], [0, 0, self.sym_alphaz], self.options('f_ang_a'))
+        self.f_a = ca.Function('f_a', [self.sym_q, self.sym_u] + self._param_inputs(), [self.sym_ax, self.sym_ay, 0], self.options('f_a'))
+        self.f_alpha = ca.Function('f_alpha', [self.sym_q, self.sym_u] + self._param_inputs(), [self.sym_alpha_f, self.sym_alpha_r])
+        self.f_ang_a = ca.Function('f_ang_a', [self.sym_q, self.sym_u] + self._param_inputs(), [0, 0, self.sym_alphaz], self.options('f_ang_a'))
 
         ayf = self.sym_fyf/(self.m*self.L_r/(self.L_f+self.L_r))
         ayr = self.sym_fyr/(self.m*self.L_f/(self.L_f+self.L_r))
-        self.f_tire_ay = ca.Function('f_tire_ay', [self.sym_q, self.sym_u], [ayf, ayr])
+        self.f_tire_ay = ca.Function('f_tire_ay', [self.sym_q, self.sym_u] + self._param_inputs(), [ayf, ayr])
 
         self.precompute_model()
         return
 
     def get_slip_angles(self, state: VehicleState) -> np.ndarray:
         q, u = self.state2qu(state)
-        return np.array(self.f_alpha(q, u)).squeeze()
+        return np.array(self.f_alpha(q, u, *self._param_args())).squeeze()
 
     def state2qu(self, state: VehicleState) -> Tuple[np.ndarray, np.ndarray]:
         q = np.array([state.v.v_long, state.v.v_tran, state.w.w_psi, state.p.e_psi, state.p.s, state.p.x_tran])
@@ -2128,6 +2471,22 @@ class CasadiDynamicCLBicycle(CasadiDynamicsModel):
         
         return interpolator
     
+class CasadiDynamicBlendedBicycle(CasadiDynamicBicycle):
+    '''
+    Global frame of reference dynamic bicycle model blended with the kinematic bicycle at low speed
+
+    Body frame velocities and global frame positions
+    '''
+    blend_kinematic = True
+
+class CasadiDynamicBlendedCLBicycle(CasadiDynamicCLBicycle):
+    '''
+    Frenet frame of reference dynamic bicycle model blended with the kinematic bicycle at low speed
+
+    Body frame velocities and track frame positions
+    '''
+    blend_kinematic = True
+
 class CasadiDynamicBicycleCombined(CasadiDynamicsModel):
     '''
     Frenet frame of reference dynamic bicycle model - Pacejka model tire forces
@@ -2891,31 +3250,47 @@ class CasadiDecoupledMultiAgentDynamicsModel(CasadiDynamicsModel):
             self.n_q += self.dynamics_models[i].n_q # Joint state dimension
             self.n_u += self.dynamics_models[i].n_u # Joint input dimension
 
+        # Runtime parameters of the agents (see DynamicsConfig.params), stacked in the joint parameter vector so that
+        # agents sharing a model instance can have different values (see set_agent_params)
+        self._p_slices = []
+        for m in self.dynamics_models:
+            self._p_slices.append(slice(self.n_p, self.n_p + m.n_p))
+            self.n_p += m.n_p
+            self.param_names += ['%s_%i' % (n, len(self._p_slices) - 1) for n in m.param_names]
+        if self.n_p > 0:
+            self.p = np.concatenate([m.p for m in self.dynamics_models])
+
         if self.use_mx:
             # Define symbolic variables for joint vectors
             self.sym_q = ca.MX.sym('q', self.n_q) # State
             self.sym_dq = ca.MX.sym('dq', self.n_q) # State derivative
             self.sym_u = ca.MX.sym('u', self.n_u) # Input
+            if self.n_p > 0:
+                self.sym_p = ca.MX.sym('p', self.n_p)
             # Split into agent vectors
-            sym_q, sym_u, = [], []
+            sym_q, sym_u, sym_p = [], [], []
             q_start, u_start = 0, 0
             for i in range(self.n_a):
                 sym_q.append(ca.vertcat(*ca.vertsplit(self.sym_q)[q_start:q_start+self.dynamics_models[i].n_q]))
                 sym_u.append(ca.vertcat(*ca.vertsplit(self.sym_u)[u_start:u_start+self.dynamics_models[i].n_u]))
+                sym_p.append(self.sym_p[self._p_slices[i]] if self.dynamics_models[i].n_p > 0 else None)
                 q_start += self.dynamics_models[i].n_q
                 u_start += self.dynamics_models[i].n_u
         else:
             # Define symbolic variables for each agent
             sym_q = [ca.SX.sym('q_%i' % i, self.dynamics_models[i].n_q) for i in range(self.n_a)]
             sym_u = [ca.SX.sym('u_%i' % i, self.dynamics_models[i].n_u) for i in range(self.n_a)]
+            sym_p = [ca.SX.sym('p_%i' % i, m.n_p) if m.n_p > 0 else None for i, m in enumerate(self.dynamics_models)]
             # Concatenate into joint vector (we do this because slicing is inefficient in CasADi)
             self.sym_q = ca.vertcat(*sym_q)
             self.sym_u = ca.vertcat(*sym_u)
+            if self.n_p > 0:
+                self.sym_p = ca.vertcat(*[p for p in sym_p if p is not None])
 
         sym_dq = []
         # Assemble vehicle dynamics input arguments for each agent
         for i, dyn_mdl in enumerate(self.dynamics_models):
-            sym_dq.append(dyn_mdl.fc(sym_q[i], sym_u[i]))
+            sym_dq.append(dyn_mdl.fc(sym_q[i], sym_u[i], *([] if sym_p[i] is None else [sym_p[i]])))
 
         self.sym_dq = ca.vertcat(*sym_dq)
 
@@ -2924,29 +3299,110 @@ class CasadiDecoupledMultiAgentDynamicsModel(CasadiDynamicsModel):
         return
 
     def step(self, vehicle_states: List[VehicleState],
-            method: str = 'RK45'):
+            method: str = None, update_frame: bool = True):
         '''
-        steps noise-free model forward one time step (self.dt) using numerical integration
-        '''
-        q, u = self.state2qu(vehicle_states)
-
-        f = lambda t, qs: (self.fc(qs, u)).toarray().squeeze()
+        steps noise-free model forward one time step (self.dt)
 
+        By default every agent is advanced with the discrete time dynamics fd of its own model (discretization method
+        and M of its config), which also sets its accelerations. Agents whose models have the same class, config and
+        track are stepped together by one mapped call, and the track projection of all agents on the same track is batched.
+        With method set to a solve_ivp method (e.g. 'RK45'), the joint state is integrated adaptively instead.
+        '''
         t = vehicle_states[0].t - self.t0
         tf = t + self.dt
-        q_n = solve_ivp(f, [t,tf], q, method = method).y[:,-1]
 
-        self.qu2state(vehicle_states, q_n, u)
+        if method is None:
+            for idx, f_step in self._get_step_groups():
+                models = [self.dynamics_models[i] for i in idx]
+                qu = [m.state2qu(vehicle_states[i]) for m, i in zip(models, idx)]
+                Q, U = np.column_stack([q for q, _ in qu]), np.column_stack([u for _, u in qu])
+                args = [Q, U] + ([np.column_stack([self.p[self._p_slices[i]] for i in idx])] if models[0].sym_p is not None else [])
+                Q_n, A, AA = [np.array(o) for o in f_step(*args)]
+                for k, (m, i) in enumerate(zip(models, idx)):
+                    m.qu2state(vehicle_states[i], Q_n[:, k], U[:, k])
+                    vehicle_states[i].a.a_long, vehicle_states[i].a.a_tran, vehicle_states[i].a.a_n = A[:, k].tolist()
+                    vehicle_states[i].aa.a_phi, vehicle_states[i].aa.a_theta, vehicle_states[i].aa.a_psi = AA[:, k].tolist()
+        else:
+            q, u = self.state2qu(vehicle_states)
+            f = lambda t, qs: (self.fc(qs, u, *self._param_args())).toarray().squeeze()
+            q_n = solve_ivp(f, [t,tf], q, method = method).y[:,-1]
+
+            self.qu2state(vehicle_states, q_n, u)
+            for i, m in enumerate(self.dynamics_models):
+                q_i, u_i = m.state2qu(vehicle_states[i])
+                p_i = [self.p[self._p_slices[i]]] if m.sym_p is not None else []
+                a = m.f_a(q_i, u_i, *p_i[:m.f_a.n_in()-2])
+                aa = m.f_ang_a(q_i, u_i, *p_i[:m.f_ang_a.n_in()-2])
+                vehicle_states[i].a.a_long, vehicle_states[i].a.a_tran, vehicle_states[i].a.a_n = [float(_a) for _a in a]
+                vehicle_states[i].aa.a_phi, vehicle_states[i].aa.a_theta, vehicle_states[i].aa.a_psi = [float(_a) for _a in aa]
+
         for i in range(self.n_a):
             vehicle_states[i].t = tf + self.t0
-            vehicle_states[i].a.a_long, vehicle_states[i].a.a_tran, vehicle_states[i].a.a_long, vehicle_states[i].a.a_n = self.dynamics_models[i].f_a(q_n, u)
-            vehicle_states[i].aa.a_phi, vehicle_states[i].aa.a_theta, vehicle_states[i].aa.a_psi = self.dynamics_models[i].f_ang_a(q_n, u)
+        if update_frame:
+            self._update_frames(vehicle_states)
+        return
 
-            if self.curvature_model:
-                self.track.local_to_global_typed(vehicle_states[i])
+    def get_agent_params(self, i: int) -> dict:
+        return dict(zip(self.dynamics_models[i].param_names, self.p[self._p_slices[i]].tolist()))
+
+    def set_agent_params(self, i: int, params):
+        '''
+        sets the runtime parameters of agent i only, from an array ordered as the params of its model config or a dict
+        with (a subset of) the parameter names, the other agents keep their values even if they share the model
+        '''
+        p = self.p.copy()
+        p[self._p_slices[i]] = self._updated_params(self.p[self._p_slices[i]], self.dynamics_models[i].param_names, params)
+        self.p = p
+
+    def _get_step_groups(self):
+        '''
+        groups of agents whose models are interchangeable (same class, config and track, see model_cache_key)
+        as a list of (agent indices, step function), the step function maps (q, u, [p]) -> (q_n, a, aa) over the group
+        '''
+        groups = self.__dict__.get('_step_groups')
+        if groups is not None:
+            return groups
+
+        keys = dict()
+        for i, m in enumerate(self.dynamics_models):
+            if m.dt != self.dt:
+                raise ValueError('Time step of agent %i (%g) differs from the time step of the joint model (%g)' % (i, m.dt, self.dt))
+            keys.setdefault(model_cache_key(m), []).append(i)
+
+        groups = []
+        for idx in keys.values():
+            m = self.dynamics_models[idx[0]]
+            args = [ca.MX.sym('q', m.n_q), ca.MX.sym('u', m.n_u)] + ([ca.MX.sym('p', m.n_p)] if m.sym_p is not None else [])
+            q_n = m._nominal_fn(m.fd).call(args)[0]
+            a = m.f_a.call([q_n] + args[1:m.f_a.n_in()])
+            aa = m.f_ang_a.call([q_n] + args[1:m.f_ang_a.n_in()])
+            f_step = ca.Function('f_step', args, [q_n, ca.vertcat(*a), ca.vertcat(*aa)])
+            if len(idx) > 1:
+                f_step = self._map(f_step, len(idx))
+            groups.append((idx, f_step))
+        self._step_groups = groups
+        return groups
+
+    def _update_frames(self, vehicle_states: List[VehicleState]):
+        '''
+        updates the pose of every agent in the frame of reference its model does not simulate, one batched
+        projection per track
+        '''
+        groups = dict()
+        for i, m in enumerate(self.dynamics_models):
+            if m.track is not None:
+                groups.setdefault((id(m.track), m.curvature_model), []).append(i)
+        for (_, curvature_model), idx in groups.items():
+            track = self.dynamics_models[idx[0]].track
+            states = [vehicle_states[i] for i in idx]
+            if curvature_model:
+                xy = track.local_to_global_batch([[s.p.s, s.p.x_tran, s.p.e_psi] for s in states])
+                for s, (x, y, psi) in zip(states, xy.tolist()):
+                    s.x.x, s.x.y, s.e.psi = x, y, psi
             else:
-                self.track.global_to_local_typed(vehicle_states[i])
-        return
+                cl = track.global_to_local_batch([[s.x.x, s.x.y, s.e.psi] for s in states])
+                for s, (s_, x_tran, e_psi) in zip(states, cl.tolist()):
+                    s.p.s, s.p.x_tran, s.p.e_psi = s_, x_tran, e_psi
 
     def state2qu(self, vehicle_states: List[VehicleState]) -> Tuple[np.ndarray, np.ndarray]:
         q_joint = []
@@ -3296,10 +3752,21 @@ def get_dynamics_model(t_start: float, model_config: DynamicsConfig, track=None)
     Helper function for getting a vehicle model class from a text string
     Should be used anywhere vehicle models may be changed by configuration
     '''
+    backend = getattr(model_config, 'backend', 'casadi')
+    if backend == 'numpy':
+        from mpclab_common.models.numpy_dynamics_models import get_numpy_dynamics_model
+        return get_numpy_dynamics_model(t_start, model_config, track=track)
+    elif backend != 'casadi':
+        raise ValueError('Unrecognized dynamics backend: %s' % backend)
+
     if model_config.model_name == 'dynamic_bicycle':
         return CasadiDynamicBicycle(t_start, model_config, track=track)
     elif model_config.model_name == 'dynamic_bicycle_cl':
         return CasadiDynamicCLBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'dynamic_bicycle_blended':
+        return CasadiDynamicBlendedBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'dynamic_bicycle_blended_cl':
+        return CasadiDynamicBlendedCLBicycle(t_start, model_config, track=track)
     elif model_config.model_name == 'dynamic_bicycle_3d':
         return CasadiDynamicBicycle3D(t_start, model_config, track=track)
     elif model_config.model_name == 'kinematic_bicycle':
@@ -0,0 +1,121 @@
+#!/usr/bin python3
+
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+import casadi as ca
+
+try:
+    from importlib.metadata import version as _package_version
+    MPCLAB_COMMON_VERSION = _package_version('mpclab_common')
+except Exception:
+    MPCLAB_COMMON_VERSION = 'unknown'
+
+# Bump to invalidate every existing cache entry after a change in how the entries are produced
+CACHE_FORMAT_VERSION = 2
+
+class FunctionCache():
+    '''
+    Index of the compiled shared objects of code generated models, keyed by the model
+
+    build_shared_object names a shared object after a hash of the generated C code, so finding it requires every
+    model function to be derived and generated first (~170 ms for the dynamic bicycle, against <1 ms to load the
+    compiled functions with ca.external). The index maps the key of a model (hash of the model class, the source of the
+    module defining it, the full model config and the track geometry, see model_cache_key) to its shared object, so a
+    model that was already compiled loads its functions without deriving them.
+
+    Entries are stored as <cache_dir>/index/<version tag>/<key>.json where the version tag changes with the CasADi and
+    mpclab_common versions, and record the compiler. Each entry is written to a temporary file and atomically renamed
+    into place, so many processes can populate the same index concurrently: readers see either no entry or a complete
+    one.
+    '''
+    def __init__(self, cache_dir: str, key: str):
+        self.version_tag = 'v%i_casadi-%s_mpclab_common-%s' % (CACHE_FORMAT_VERSION, ca.__version__, MPCLAB_COMMON_VERSION)
+        self.key = key
+        self.path = pathlib.Path(cache_dir).expanduser().joinpath('index', self.version_tag)
+        self.compiler = os.environ.get('CC', 'gcc')
+
+    @classmethod
+    def for_model(cls, model, cache_dir: str) -> 'FunctionCache':
+        return cls(cache_dir, model_cache_key(model))
+
+    def _entry(self) -> pathlib.Path:
+        return self.path.joinpath(self.key + '.json')
+
+    def load(self) -> pathlib.Path:
+        '''
+        returns the path of the shared object of the model, or None if there is no (valid) entry
+        '''
+        try:
+            entry = json.loads(self._entry().read_text())
+        except (OSError, ValueError):
+            return None
+        so_path = pathlib.Path(entry.get('shared_object', ''))
+        if entry.get('compiler') != self.compiler or not so_path.is_file():
+            return None
+        return so_path
+
+    def store(self, so_path: pathlib.Path):
+        self.path.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(dict(shared_object=str(pathlib.Path(so_path).resolve()), compiler=self.compiler))
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.%s.' % self.key, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self._entry())
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def _fingerprint(value):
+    '''
+    JSON-serializable representation of config and track values used for hashing
+    '''
+    if isinstance(value, np.ndarray):
+        return ['ndarray', str(value.dtype), list(value.shape), hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()]
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_fingerprint(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _fingerprint(v) for k, v in value.items()}
+    if dataclasses.is_dataclass(value):
+        return {f.name: _fingerprint(getattr(value, f.name)) for f in dataclasses.fields(value)}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return None
+
+def track_fingerprint(track):
+    '''
+    fingerprint of the numeric data defining a track (e.g. key_pts, waypoints and widths)
+    CasADi objects and other derived attributes are ignored
+    '''
+    if track is None:
+        return None
+    fp = {'class': type(track).__module__ + '.' + type(track).__qualname__}
+    for k in sorted(vars(track).keys()):
+        v = _fingerprint(vars(track)[k])
+        if v is not None:
+            fp[k] = v
+    return fp
+
+def model_cache_key(model) -> str:
+    model_cls = type(model)
+    try:
+        source_hash = hashlib.sha256(pathlib.Path(inspect.getfile(model_cls)).read_bytes()).hexdigest()
+    except (OSError, TypeError):
+        source_hash = None
+    config = _fingerprint(model.model_config)
+    desc = {
+        'class': model_cls.__module__ + '.' + model_cls.__qualname__,
+        'source': source_hash,
+        'config': config,
+        'track': track_fingerprint(getattr(model, 'track', None)),
+    }
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode()).hexdigest()[:32]
@@ -33,6 +33,24 @@ class DynamicsConfig(ModelConfig):
     dt: float                       = field(default = 0.01)   # interval of an entire simulation step
     discretization_method: str      = field(default = 'euler')
     M: int                          = field(default = 10) # RK4 integration steps
+    # Integrator used by step (and so by DynamicsSimulator): 'adaptive' integrates fc with scipy's solve_ivp (RK45, tolerances
+    # step_rtol and step_atol), 'discrete' applies fd (discretization_method with M substeps). None is the default of the
+    # backend, i.e. 'adaptive' for the CasADi models and 'discrete' for the NumPy models
+    step_method: str                = field(default = None)
+    step_rtol: float                = field(default = 1e-3)
+    step_atol: float                = field(default = 1e-6)
+    lazy_derivatives: bool          = field(default = True) # Build the derivative functions (fA, fAd, ...) on first use
+    # 'casadi' or 'numpy', the NumPy models (dynamic and kinematic bicycle) only support forward simulation without derivatives
+    backend: str                    = field(default = 'casadi')
+
+    # Parallelization of the batched (mapped) model functions: 'serial', 'thread' or 'openmp'. 'thread' only pays off with
+    # several cores and large batches, measure it with benchmarks/bench_batch_dynamics.py before enabling it
+    batch_parallelization: str      = field(default = 'serial')
+    batch_n_threads: int            = field(default = None) # Number of worker threads for 'thread', defaults to the number of cores
+
+    # Names of config fields (e.g. 'mass', 'wheel_friction') that are exposed as the runtime parameter vector p of the model
+    # functions instead of being baked in as constants, so they can be changed with set_params without rebuilding the model
+    params: list                    = field(default = None)
 
     # Flag indicating whether dynamics are affected by exogenous noise
     noise: bool                     = field(default = False)
@@ -92,6 +110,12 @@ class DynamicBicycleConfig(DynamicsConfig):  # configurations for simulated vehi
 
     simple_slip: bool               = field(default=False)
 
+    # Speeds between which the blended models (dynamic_bicycle_blended) go from kinematic to dynamic bicycle
+    blend_v_min: float              = field(default = 0.3)
+    blend_v_max: float              = field(default = 0.6)
+    # Time constant with which the kinematic part drives vy and psidot to their kinematic values
+    blend_tau: float                = field(default = 0.1)
+
     def __post_init__(self):
         if self.pacejka_d_front is None:
             self.pacejka_d_front = self.wheel_friction*self.mass*self.gravity * self.wheel_dist_rear / (self.wheel_dist_rear + self.wheel_dist_front)
@@ -0,0 +1,563 @@
+#!/usr/bin python3
+
+import numpy as np
+
+import bisect
+import math
+from typing import Tuple
+from copy import deepcopy
+from scipy.integrate import solve_ivp
+
+from mpclab_common.pytypes import VehicleState
+from mpclab_common.models.model_types import DynamicsConfig, DynamicBicycleConfig, KinematicBicycleConfig
+from mpclab_common.models.dynamics_models import CasadiDynamicsModel, CasadiDynamicBicycle, CasadiDynamicCLBicycle, \
+    CasadiKinematicBicycle, CasadiKinematicCLBicycle, _dynamic_bicycle_params
+from mpclab_common.track import get_track
+from mpclab_common.tracks.radius_arclength_track import RadiusArclengthTrack
+
+
+class _ArrayOps():
+    '''
+    elementwise functions used by the model equations for batched evaluation on arrays (..., n)
+    '''
+    sin, cos, tan, arctan, arctan2, sqrt = np.sin, np.cos, np.tan, np.arctan, np.arctan2, np.sqrt
+    fmin, fmax = np.minimum, np.maximum
+
+    @staticmethod
+    def split(x):
+        return [x[..., i] for i in range(x.shape[-1])]
+
+    @staticmethod
+    def stack(*x):
+        return np.stack(np.broadcast_arrays(*x), axis=-1)
+
+    @staticmethod
+    def map(f, *x):
+        return f(*x)
+
+    @staticmethod
+    def array(x):
+        return x
+
+class _ScalarOps():
+    '''
+    same functions on lists of Python floats, a single vehicle is evaluated much faster this way than with NumPy on scalars
+    '''
+    sin, cos, tan, arctan, arctan2, sqrt = math.sin, math.cos, math.tan, math.atan, math.atan2, math.sqrt
+    fmin, fmax = min, max
+
+    @staticmethod
+    def split(x):
+        return x if isinstance(x, list) else x.tolist()
+
+    @staticmethod
+    def stack(*x):
+        return list(x)
+
+    @staticmethod
+    def map(f, *x):
+        return [f(*e) for e in zip(*x)]
+
+    @staticmethod
+    def array(x):
+        return np.array(x)
+
+
+class NumpyDynamicsModel():
+    '''
+    Base class for dynamics models implemented directly in NumPy
+
+    Only forward evaluation is supported: fc, fixed-step discretization fd and step, without derivatives.
+    This avoids the per-call overhead of CasADi Functions, which dominates the cost of simulating small models.
+    All functions are vectorized: states q (..., n_q), inputs u (..., n_u) and parameters p (..., n_p) broadcast
+    against each other, e.g. a batch of B vehicles is evaluated with q: (B, n_q) and u: (B, n_u).
+    A single state (n_q,) is evaluated on Python floats to avoid the overhead of NumPy on scalars.
+    The state and input conversions (state2qu, qu2state, ...) are the ones of the corresponding CasADi model.
+    '''
+
+    curvature_model = False
+
+    # Config fields that can be exposed as runtime parameters, with the attributes they are stored in
+    param_map = dict()
+
+    def __init__(self, t0: float, model_config: DynamicsConfig, track=None):
+        self.model_config = model_config
+
+        self.t0 = t0
+        if model_config.track_name is not None:
+            self.track = get_track(model_config.track_name)
+        else:
+            self.track = track
+
+        self.dt = model_config.dt
+        self.M = model_config.M
+        self.h = self.dt/self.M
+
+        self.discretization_method = model_config.discretization_method
+        if self.discretization_method not in ['euler', 'rk4', 'rk3', 'rk2']:
+            raise ValueError('Discretization method of %s not supported by the NumPy backend' % self.discretization_method)
+        if model_config.noise:
+            raise ValueError('Process noise is not supported by the NumPy backend')
+        self.step_method = model_config.step_method or 'discrete'
+        if self.step_method not in ['discrete', 'adaptive']:
+            raise ValueError('Step method of %s not recognized' % self.step_method)
+
+        # Runtime parameters (see DynamicsConfig.params), stored as values instead of symbolic inputs
+        names = model_config.params if model_config.params else []
+        for n in names:
+            if n not in self.param_map:
+                raise ValueError('Parameter %s is not supported by %s, choose from %s' % (n, type(self).__name__, list(self.param_map.keys())))
+        self.param_names = list(names)
+        self.n_p = len(names)
+        self.p = np.array([getattr(model_config, n) for n in names], dtype=float)
+
+    def get_params(self) -> dict:
+        return dict(zip(self.param_names, self.p.tolist()))
+
+    def set_params(self, params):
+        '''
+        sets the current values of the runtime parameters, from an array ordered as model_config.params
+        or a dict with (a subset of) the parameter names
+        '''
+        self.p = CasadiDynamicsModel._updated_params(self.p, self.param_names, params)
+
+    def _prepare(self, q, u, p):
+        '''
+        returns the arrays q and u, the model constants by attribute name (with the runtime parameters taken from p,
+        defaulting to the current values) and the elementwise functions to evaluate the model with
+        '''
+        q = np.asarray(q, dtype=float)
+        u = np.asarray(u, dtype=float)
+        p = self.p if p is None else np.asarray(p, dtype=float)
+        scalar = q.ndim == 1 and u.ndim == 1 and p.ndim == 1
+        c = {a: getattr(self, a) for a in self.param_map.values() if hasattr(self, a)}
+        for i, n in enumerate(self.param_names):
+            c[self.param_map[n]] = float(p[i]) if scalar else p[..., i]
+        self._derived_constants(c)
+        return q, u, c, _ScalarOps if scalar else _ArrayOps
+
+    def _derived_constants(self, c: dict):
+        pass
+
+    def fc(self, q: np.ndarray, u: np.ndarray, p: np.ndarray = None) -> np.ndarray:
+        '''
+        continuous time dynamics dq/dt
+        '''
+        q, u, c, ops = self._prepare(q, u, p)
+        return ops.array(self._fc(q, ops.split(u), c, ops))
+
+    def fd(self, q: np.ndarray, u: np.ndarray, p: np.ndarray = None) -> np.ndarray:
+        '''
+        discrete time dynamics with the discretization method of the model config (M fixed steps of dt/M for RK methods)
+        '''
+        q, u, c, ops = self._prepare(q, u, p)
+        u = ops.split(u)
+        f = lambda x: self._fc(x, u, c, ops)
+        h, dt = self.h, self.dt
+        x_p = ops.split(q) if ops is _ScalarOps else q
+        # Same stages as CasadiDynamicsModel.rk4/rk3/rk2, written elementwise
+        if self.discretization_method == 'euler':
+            x_p = ops.map(lambda x, a: x + dt * a, x_p, f(x_p))
+        elif self.discretization_method == 'rk4':
+            half_step = lambda x, a: x + (h / 2) * a
+            full_step = lambda x, a: x + h * a
+            update = lambda x, a1, a2, a3, a4: x + h * (a1 + 2 * a2 + 2 * a3 + a4) / 6
+            for _ in range(self.M):
+                a1 = f(x_p)
+                a2 = f(ops.map(half_step, x_p, a1))
+                a3 = f(ops.map(half_step, x_p, a2))
+                a4 = f(ops.map(full_step, x_p, a3))
+                x_p = ops.map(update, x_p, a1, a2, a3, a4)
+        elif self.discretization_method == 'rk3':
+            for _ in range(self.M):
+                a1 = ops.map(lambda a: h * a, f(x_p))
+                a2 = ops.map(lambda a: h * a, f(ops.map(lambda x, a1: x + a1/2, x_p, a1)))
+                a3 = ops.map(lambda a: h * a, f(ops.map(lambda x, a1, a2: x - a1 + 2*a2, x_p, a1, a2)))
+                x_p = ops.map(lambda x, a1, a2, a3: x + (a1 + 4*a2 + a3) / 6, x_p, a1, a2, a3)
+        elif self.discretization_method == 'rk2':
+            for _ in range(self.M):
+                a1 = f(x_p)
+                a2 = f(ops.map(lambda x, a: x + h*a, x_p, a1))
+                x_p = ops.map(lambda x, a1, a2: x + h * (a1 + a2) / 2, x_p, a1, a2)
+        return ops.array(x_p)
+
+    def accelerations(self, q: np.ndarray, u: np.ndarray, p: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        linear (..., 3) and angular (..., 3) body frame accelerations, as f_a and f_ang_a of the CasADi models
+        '''
+        q, u, c, ops = self._prepare(q, u, p)
+        a, aa = self._accelerations(q, ops.split(u), c, ops)
+        return ops.array(a), ops.array(aa)
+
+    def evaluate_batch(self, fn_name: str, Q: np.ndarray, U: np.ndarray, P: np.ndarray = None) -> np.ndarray:
+        '''
+        evaluates fc or fd at the B pairs of states Q: (B, n_q) and inputs U: (B, n_u), same interface as the CasADi models
+        '''
+        if fn_name not in ['fc', 'fd']:
+            raise ValueError('Only fc and fd are available with the NumPy backend, got %s' % fn_name)
+        Q = np.asarray(Q, dtype=float).reshape((-1, self.n_q))
+        U = np.asarray(U, dtype=float).reshape((-1, self.n_u))
+        return getattr(self, fn_name)(Q, U, P)
+
+    def rollout(self, q0: np.ndarray, U: np.ndarray, p: np.ndarray = None) -> np.ndarray:
+        '''
+        simulates the input sequence U: (N, n_u) from q0: (n_q,), returns Q: (N+1, n_q)
+        '''
+        return self.rollout_batch(np.asarray(q0)[None], np.asarray(U)[None], p)[0]
+
+    def rollout_batch(self, Q0: np.ndarray, U: np.ndarray, P: np.ndarray = None) -> np.ndarray:
+        '''
+        simulates B input sequences U: (B, N, n_u) from Q0: (B, n_q), returns Q: (B, N+1, n_q)
+        '''
+        U = np.asarray(U, dtype=float)
+        B, N = U.shape[0], U.shape[1]
+        Q = np.empty((B, N+1, self.n_q))
+        Q[:, 0] = np.asarray(Q0, dtype=float).reshape((B, self.n_q))
+        for k in range(N):
+            Q[:, k+1] = self.fd(Q[:, k], U[:, k], P)
+        return Q
+
+    def step(self, vehicle_state: VehicleState, inplace=True, update_frame=True) -> VehicleState:
+        '''
+        steps the model forward one time step (self.dt) with fd, or with solve_ivp on fc if model_config.step_method is 'adaptive'
+        if update_frame is False, only the frame of reference of the model is updated, the other one (global pose
+        for curvilinear models, track frame pose for global models) is left for the caller to reconstruct from the track
+        '''
+        if not inplace:
+            vehicle_state = deepcopy(vehicle_state)
+        q, u = self.state2qu(vehicle_state)
+        tf = vehicle_state.t + self.dt
+
+        if self.step_method == 'adaptive':
+            sol = solve_ivp(lambda t, z: self.fc(z, u), (0, self.dt), q, t_eval=[self.dt],
+                            rtol=self.model_config.step_rtol, atol=self.model_config.step_atol)
+            q_n = sol.y.squeeze()
+        else:
+            q_n = self.fd(q, u)
+        a, aa = self.accelerations(q_n, u)
+
+        self.qu2state(vehicle_state, q_n, u)
+        vehicle_state.t = tf
+        vehicle_state.a.a_long, vehicle_state.a.a_tran, vehicle_state.a.a_n = float(a[0]), float(a[1]), float(a[2])
+        vehicle_state.aa.a_phi, vehicle_state.aa.a_theta, vehicle_state.aa.a_psi = float(aa[0]), float(aa[1]), float(aa[2])
+
+        if self.track is not None and update_frame:
+            if self.curvature_model:
+                self.track.local_to_global_typed(vehicle_state)
+            else:
+                self.track.global_to_local_typed(vehicle_state)
+        return vehicle_state
+
+    def _init_curvature(self):
+        '''
+        vectorized track curvature as a function of s, equal to the curvature Function used by the CasADi models
+        '''
+        track = self.track
+        if isinstance(track, RadiusArclengthTrack):
+            L = track.track_length
+            s_bp, c = track.key_pts[1:-1, 3], track.key_pts[1:, 5]
+            s_bp_list, c_list = s_bp.tolist(), c.tolist()
+            # Same wrapping and piecewise constant lookup as ca.pw_const in get_curvature_casadi_fn
+            def get_curvature(s):
+                if isinstance(s, float):
+                    return c_list[bisect.bisect_right(s_bp_list, math.fmod(math.fmod(s, L) + L, L))]
+                return c[np.searchsorted(s_bp, np.fmod(np.fmod(s, L) + L, L), side='right')]
+        else:
+            f = track.get_curvature_casadi_fn()
+            def get_curvature(s):
+                if isinstance(s, float):
+                    return float(f(s))
+                s = np.asarray(s, dtype=float)
+                return np.array(f.map(max(s.size, 1))(s.reshape((1, -1)))).reshape(s.shape)
+        self.get_curvature = get_curvature
+
+    @staticmethod
+    def _sign(x, ops, eps = 1e-3):
+        ''' smooth apporoximation to sign(x), as ca_sign '''
+        return x / ops.sqrt(x**2 + eps**2)
+
+
+class NumpyDynamicBicycle(NumpyDynamicsModel):
+    '''
+    Global frame of reference dynamic bicycle model - Pacejka model tire forces, NumPy version of CasadiDynamicBicycle
+
+    Body frame velocities and global frame positions
+    '''
+    param_map = _dynamic_bicycle_params
+    blend_kinematic = False
+
+    def __init__(self, t0: float, model_config: DynamicBicycleConfig = DynamicBicycleConfig(), track=None):
+        super().__init__(t0, model_config, track=track)
+
+        self.n_q = 6
+        self.n_u = 2
+
+        self.L_f            = self.model_config.wheel_dist_front
+        self.L_r            = self.model_config.wheel_dist_rear
+
+        self.m              = self.model_config.mass
+        self.I_z            = self.model_config.yaw_inertia
+        self.g              = self.model_config.gravity
+
+        self.c_dr           = self.model_config.drag_coefficient
+        self.c_da           = self.model_config.damping_coefficient
+        self.c_r            = self.model_config.rolling_resistance
+        self.p_r            = self.model_config.rolling_resistance_exponent
+
+        self.mu             = self.model_config.wheel_friction
+        self.tire_model     = self.model_config.tire_model
+        self.drive_wheels   = self.model_config.drive_wheels
+
+        self.pacejka_Bf     = self.model_config.pacejka_b_front
+        self.pacejka_Br     = self.model_config.pacejka_b_rear
+        self.pacejka_Cf     = self.model_config.pacejka_c_front
+        self.pacejka_Cr     = self.model_config.pacejka_c_rear
+        self.pacejka_Df     = self.model_config.pacejka_d_front
+        self.pacejka_Dr     = self.model_config.pacejka_d_rear
+
+        self.linear_Bf      = self.model_config.linear_bf
+        self.linear_Br      = self.model_config.linear_br
+
+        self.simple_slip    = self.model_config.simple_slip
+
+        if self.tire_model not in ['linear', 'pacejka']:
+            raise(ValueError("Tire model must be 'linear' or 'pacejka'"))
+        if 'wheel_friction' in self.param_names and ('pacejka_d_front' in self.param_names or 'pacejka_d_rear' in self.param_names):
+            raise ValueError('wheel_friction and pacejka_d_front/pacejka_d_rear cannot both be runtime parameters')
+
+    def _derived_constants(self, c: dict):
+        if 'wheel_friction' in self.param_names:
+            c['pacejka_Df'] = c['mu']*c['m']*self.g * self.L_r / (self.L_r + self.L_f)
+            c['pacejka_Dr'] = c['mu']*c['m']*self.g * self.L_f / (self.L_r + self.L_f)
+
+    def _forces(self, vx, vy, psidot, u_a, u_s, c, ops):
+        '''
+        body frame accelerations ax, ay and yaw acceleration, as in CasadiDynamicBicycle
+        '''
+        if self.simple_slip:
+            alpha_f = -ops.arctan2(vy + self.L_f * psidot, vx) + u_s
+        else:
+            alpha_f = -ops.arctan2((vy + self.L_f * psidot) * ops.cos(u_s) - vx * ops.sin(u_s),
+                                vx * ops.cos(u_s) + (vy + self.L_f * psidot) * ops.sin(u_s))
+        alpha_r = -ops.arctan2(vy - self.L_r * psidot, vx)
+
+        if self.tire_model == 'pacejka':
+            fyf = c['pacejka_Df'] * ops.sin(c['pacejka_Cf'] * ops.arctan(c['pacejka_Bf'] * alpha_f))
+            fyr = c['pacejka_Dr'] * ops.sin(c['pacejka_Cr'] * ops.arctan(c['pacejka_Br'] * alpha_r))
+        else:
+            fyf = c['linear_Bf'] * c['m']*self.g*self.L_r/(self.L_f+self.L_r) * alpha_f
+            fyr = c['linear_Br'] * c['m']*self.g*self.L_f/(self.L_f+self.L_r) * alpha_r
+
+        F_ext = - c['c_da'] * vx \
+                - c['c_dr'] * vx * abs(vx) \
+                - c['c_r'] * abs(vx)**self.p_r * self._sign(vx, ops)
+
+        if self.drive_wheels == 'all':
+            _ar = u_a/2
+            _af = u_a/2
+        elif self.drive_wheels == 'rear':
+            _ar = u_a
+            _af = 0
+        ax = _ar + _af*ops.cos(u_s) + (F_ext - fyf * ops.sin(u_s)) / c['m']
+        ay = _af*ops.sin(u_s) + (fyf * ops.cos(u_s) + fyr) / c['m']
+        alphaz = (self.L_f * fyf * ops.cos(u_s) - self.L_r * fyr) / c['I_z']
+
+        if self.blend_kinematic:
+            # Same blending as _blend_kinematic_bicycle
+            L = self.L_f + self.L_r
+            v_min, v_max = self.model_config.blend_v_min, self.model_config.blend_v_max
+            tau = self.model_config.blend_tau
+            t = ops.fmin(ops.fmax((vx - v_min) / (v_max - v_min), 0), 1)
+            lam = t**2 * (3 - 2*t)
+
+            tan_gamma = ops.tan(u_s)
+            dvx_kin = u_a + F_ext / c['m']
+            dvy_kin = dvx_kin * tan_gamma * self.L_r / L + (vx * tan_gamma * self.L_r / L - vy) / tau
+            dpsidot_kin = dvx_kin * tan_gamma / L + (vx * tan_gamma / L - psidot) / tau
+
+            ax = lam * ax + (1 - lam) * (dvx_kin - psidot * vy)
+            ay = lam * ay + (1 - lam) * (dvy_kin + psidot * vx)
+            alphaz = lam * alphaz + (1 - lam) * dpsidot_kin
+        return ax, ay, alphaz
+
+    def _fc(self, q, u, c, ops):
+        vx, vy, psidot, _, _, psi = ops.split(q)
+        ax, ay, alphaz = self._forces(vx, vy, psidot, u[0], u[1], c, ops)
+        return ops.stack(ax + psidot * vy,
+                         ay - psidot * vx,
+                         alphaz,
+                         vx * ops.cos(psi) - vy * ops.sin(psi),
+                         vy * ops.cos(psi) + vx * ops.sin(psi),
+                         psidot)
+
+    def _accelerations(self, q, u, c, ops):
+        vx, vy, psidot = ops.split(q)[:3]
+        ax, ay, alphaz = self._forces(vx, vy, psidot, u[0], u[1], c, ops)
+        zero = 0*ax
+        return ops.stack(ax, ay, zero), ops.stack(zero, zero, alphaz)
+
+    state2qu = CasadiDynamicBicycle.state2qu
+    state2q = CasadiDynamicBicycle.state2q
+    input2u = CasadiDynamicBicycle.input2u
+    u2input = CasadiDynamicBicycle.u2input
+    q2state = CasadiDynamicBicycle.q2state
+    qu2state = CasadiDynamicBicycle.qu2state
+    qu2prediction = CasadiDynamicBicycle.qu2prediction
+
+
+class NumpyDynamicCLBicycle(NumpyDynamicBicycle):
+    '''
+    Frenet frame of reference dynamic bicycle model - Pacejka model tire forces, NumPy version of CasadiDynamicCLBicycle
+
+    Body frame velocities and track frame positions
+    '''
+    curvature_model = True
+
+    def __init__(self, t0: float, model_config: DynamicBicycleConfig = DynamicBicycleConfig(), track=None):
+        super().__init__(t0, model_config, track=track)
+        self._init_curvature()
+
+    def _fc(self, q, u, c, ops):
+        vx, vy, psidot, epsi, s, xtran = ops.split(q)
+        ax, ay, alphaz = self._forces(vx, vy, psidot, u[0], u[1], c, ops)
+        kappa = self.get_curvature(s)
+        ds = (vx * ops.cos(epsi) - vy * ops.sin(epsi)) / (1 - xtran * kappa)
+        return ops.stack(ax + psidot * vy,
+                         ay - psidot * vx,
+                         alphaz,
+                         psidot - kappa * (vx * ops.cos(epsi) - vy * ops.sin(epsi)) / (1 - xtran * kappa),
+                         ds,
+                         vx * ops.sin(epsi) + vy * ops.cos(epsi))
+
+    state2qu = CasadiDynamicCLBicycle.state2qu
+    state2q = CasadiDynamicCLBicycle.state2q
+    input2u = CasadiDynamicCLBicycle.input2u
+    u2input = CasadiDynamicCLBicycle.u2input
+    q2state = CasadiDynamicCLBicycle.q2state
+    qu2state = CasadiDynamicCLBicycle.qu2state
+    qu2prediction = CasadiDynamicCLBicycle.qu2prediction
+
+
+class NumpyDynamicBlendedBicycle(NumpyDynamicBicycle):
+    '''
+    NumPy version of CasadiDynamicBlendedBicycle
+    '''
+    blend_kinematic = True
+
+
+class NumpyDynamicBlendedCLBicycle(NumpyDynamicCLBicycle):
+    '''
+    NumPy version of CasadiDynamicBlendedCLBicycle
+    '''
+    blend_kinematic = True
+
+
+class NumpyKinematicBicycle(NumpyDynamicsModel):
+    '''
+    Global frame of reference kinematic bicycle, NumPy version of CasadiKinematicBicycle
+
+    Body frame velocities and global frame positions
+    '''
+    # index of the velocity in the state vector
+    _v_idx = 2
+
+    def __init__(self, t0: float, model_config: KinematicBicycleConfig = KinematicBicycleConfig(), track=None):
+        super().__init__(t0, model_config, track=track)
+
+        self.n_q = 4
+        self.n_u = 2
+
+        self.L_f    = self.model_config.wheel_dist_front
+        self.L_r    = self.model_config.wheel_dist_rear
+
+        self.c_dr   = self.model_config.drag_coefficient
+        self.c_da   = self.model_config.damping_coefficient
+        self.c_s    = self.model_config.slip_coefficient
+        self.c_r    = self.model_config.rolling_resistance
+        self.p_r    = self.model_config.rolling_resistance_exponent
+
+        self.m      = self.model_config.mass
+
+    def _longitudinal(self, v, u_a, u_s, ops):
+        '''
+        slip angle, yaw rate and longitudinal acceleration, as in CasadiKinematicBicycle
+        '''
+        beta = ops.arctan2(ops.tan(u_s) * self.L_r, self.L_f + self.L_r)
+        psidot = v / self.L_r * ops.sin(beta)
+        F_ext = - self.c_da * v \
+                - self.c_dr * v * abs(v) \
+                - self.c_r * abs(v)**self.p_r * self._sign(v, ops) \
+                - self.c_s * psidot**2
+        return beta, psidot, u_a + F_ext/self.m
+
+    def _fc(self, q, u, c, ops):
+        _, _, v, psi = ops.split(q)
+        beta, psidot, dv = self._longitudinal(v, u[0], u[1], ops)
+        return ops.stack(v * ops.cos(beta + psi),
+                         v * ops.sin(beta + psi),
+                         dv,
+                         psidot)
+
+    def _accelerations(self, q, u, c, ops):
+        beta, _, dv = self._longitudinal(ops.split(q)[self._v_idx], u[0], u[1], ops)
+        zero = 0*dv
+        return ops.stack(dv * ops.cos(beta), dv * ops.sin(beta), zero), ops.stack(zero, zero, dv/self.L_r*ops.sin(beta))
+
+    state2qu = CasadiKinematicBicycle.state2qu
+    state2q = CasadiKinematicBicycle.state2q
+    input2u = CasadiKinematicBicycle.input2u
+    u2input = CasadiKinematicBicycle.u2input
+    q2state = CasadiKinematicBicycle.q2state
+    qu2state = CasadiKinematicBicycle.qu2state
+    qu2prediction = CasadiKinematicBicycle.qu2prediction
+
+
+class NumpyKinematicCLBicycle(NumpyKinematicBicycle):
+    '''
+    Frenet frame of reference kinematic bicycle, NumPy version of CasadiKinematicCLBicycle
+
+    Body frame velocities and track frame positions
+    '''
+    curvature_model = True
+    _v_idx = 0
+
+    def __init__(self, t0: float, model_config: KinematicBicycleConfig = KinematicBicycleConfig(), track=None):
+        super().__init__(t0, model_config, track=track)
+        self._init_curvature()
+
+    def _fc(self, q, u, c, ops):
+        v, epsi, s, xtran = ops.split(q)
+        beta, psidot, dv = self._longitudinal(v, u[0], u[1], ops)
+        kappa = self.get_curvature(s)
+        return ops.stack(dv,
+                         psidot - kappa * v * ops.cos(beta + epsi) / (1 - xtran * kappa),
+                         v * ops.cos(beta + epsi) / (1 - xtran * kappa),
+                         v * ops.sin(beta + epsi))
+
+    state2qu = CasadiKinematicCLBicycle.state2qu
+    state2q = CasadiKinematicCLBicycle.state2q
+    input2u = CasadiKinematicCLBicycle.input2u
+    u2input = CasadiKinematicCLBicycle.u2input
+    q2state = CasadiKinematicCLBicycle.q2state
+    qu2state = CasadiKinematicCLBicycle.qu2state
+    qu2prediction = CasadiKinematicCLBicycle.qu2prediction
+
+
+def get_numpy_dynamics_model(t_start: float, model_config: DynamicsConfig, track=None) -> NumpyDynamicsModel:
+    '''
+    NumPy counterpart of get_dynamics_model, used when model_config.backend is 'numpy'
+    '''
+    if model_config.model_name == 'dynamic_bicycle':
+        return NumpyDynamicBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'dynamic_bicycle_cl':
+        return NumpyDynamicCLBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'dynamic_bicycle_blended':
+        return NumpyDynamicBlendedBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'dynamic_bicycle_blended_cl':
+        return NumpyDynamicBlendedCLBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'kinematic_bicycle':
+        return NumpyKinematicBicycle(t_start, model_config, track=track)
+    elif model_config.model_name == 'kinematic_bicycle_cl':
+        return NumpyKinematicCLBicycle(t_start, model_config, track=track)
+    else:
+        raise ValueError('Vehicle model %s is not available with the NumPy backend' % model_config.model_name)
@@ -1,4 +1,5 @@
 from abc import abstractmethod
+import math
 import numpy as np
 
 import pdb
@@ -42,7 +43,55 @@ class BaseTrack():
             data.e.psi = xy_coord[2]
             return 1
         return 0
+
+    def global_to_local_batch(self, xy_coords):
+        '''
+        global_to_local for an array of poses (B, 3) of (x, y, psi), returns (B, 3) of (s, e_y, e_psi)
+        '''
+        return np.array([self.global_to_local(c) for c in np.asarray(xy_coords, dtype=float).reshape((-1, 3))], dtype=float).reshape((-1, 3))
+
+    def local_to_global_batch(self, cl_coords):
+        '''
+        local_to_global for an array of poses (B, 3) of (s, e_y, e_psi), returns (B, 3) of (x, y, psi)
+        '''
+        return np.array([self.local_to_global(c) for c in np.asarray(cl_coords, dtype=float).reshape((-1, 3))], dtype=float).reshape((-1, 3))
     
+    def get_curvature_batch(self, s):
+        return np.array([self.get_curvature(_s) for _s in np.asarray(s, dtype=float).reshape(-1)])
+
+    def get_boundary_widths_batch(self, s):
+        '''
+        distance from the centerline to the left and right track boundaries at s (B,)
+        '''
+        w = np.full(np.asarray(s).size, self.half_width, dtype=float)
+        return w, w.copy()
+
+    def footprint_lateral_bounds_batch(self, cl_coords, VL=0.37, VW=0.195):
+        '''
+        smallest and largest lateral offset (B, 2) reached by the VL x VW footprint of vehicles at (s, e_y, e_psi) (B, 3)
+        The footprint is tested against the osculating circle of the centerline at s (see footprint_points)
+        '''
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        k = self.get_curvature_batch(cl_coords[:, 0])[:, None]
+        px, py = footprint_points_batch(0., cl_coords[:, 1:2], cl_coords[:, 2:3], k, VL, VW)
+        e_y = lateral_offset_batch(px, py, k)
+        return np.column_stack([e_y.min(axis=1), e_y.max(axis=1)])
+
+    def footprint_lateral_bounds(self, cl_coord, VL=0.37, VW=0.195):
+        return tuple(self.footprint_lateral_bounds_batch(cl_coord, VL, VW)[0].tolist())
+
+    def footprint_off_track_batch(self, cl_coords, VL=0.37, VW=0.195):
+        '''
+        mask (B,) of the vehicles at (s, e_y, e_psi) (B, 3) with part of their VL x VW footprint outside the track
+        '''
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        bounds = self.footprint_lateral_bounds_batch(cl_coords, VL, VW)
+        left, right = self.get_boundary_widths_batch(cl_coords[:, 0])
+        return (bounds[:, 1] > left) | (bounds[:, 0] < -right)
+
+    def footprint_off_track(self, cl_coord, VL=0.37, VW=0.195):
+        return bool(self.footprint_off_track_batch(cl_coord, VL, VW)[0])
+
     def plot_map(self, ax, pts_per_dist=None, close_loop=True, distance_markers=0):
         track = self.get_track_xy(pts_per_dist, close_loop)
         
@@ -131,4 +180,50 @@ class BaseTrack():
                  bound_out=dict(x=x_bound_out, y=y_bound_out))
         
         return D
-    
\ No newline at end of file
+    
+
+
+"""
+Footprint of a vehicle in the frame of a centerline point (x along the track tangent, y to the left)
+
+On a segment of constant curvature k the lateral offset of a point is its signed distance to the offset circle,
+so the largest offset on the outside of a curve is reached at a corner of the footprint and the largest on the
+inside (where the boundary can cut an edge between two corners) at the point of the footprint closest to the
+center of curvature. The footprint points are the 4 corners and this closest point, for k = 0 it is a point
+inside the footprint and does not change the bounds.
+"""
+def footprint_points(x0, y0, psi, k, VL, VW):
+    hl, hw = VL / 2, VW / 2
+    c, s = math.cos(psi), math.sin(psi)
+    pts = [(x0 + a * c - b * s, y0 + a * s + b * c) for a, b in ((hl, hw), (hl, -hw), (-hl, hw), (-hl, -hw))]
+    r = 1 / k if k != 0 else 0.
+    u = c * -x0 + s * (r - y0)
+    v = -s * -x0 + c * (r - y0)
+    u, v = min(max(u, -hl), hl), min(max(v, -hw), hw)
+    pts.append((x0 + u * c - v * s, y0 + u * s + v * c))
+    return pts
+
+def footprint_points_batch(x0, y0, psi, k, VL, VW):
+    '''
+    footprint_points for arrays of poses and curvatures (B, 1), returns the x and y (B, 5) of the points
+    '''
+    hl, hw = VL / 2, VW / 2
+    c, s = np.cos(psi), np.sin(psi)
+    r = 1 / np.where(k == 0, np.inf, k)
+    u = np.clip(c * -x0 + s * (r - y0), -hl, hl)
+    v = np.clip(s * x0 + c * (r - y0), -hw, hw)
+    a, b = np.array([hl, hl, -hl, -hl, 0.]), np.array([hw, -hw, hw, -hw, 0.])
+    px, py = x0 + a * c - b * s, y0 + a * s + b * c
+    px[:, 4:] += u * c - v * s
+    py[:, 4:] += u * s + v * c
+    return px, py
+
+def lateral_offset(px, py, k):
+    '''
+    signed lateral offset of the point (px, py) from a centerline of curvature k through the origin, tangent to x
+    (1 - sqrt((1 - k y)^2 + (k x)^2)) / k, written to also hold for k = 0
+    '''
+    return (2 * py - k * (px * px + py * py)) / (1 + math.sqrt((1 - k * py)**2 + (k * px)**2))
+
+def lateral_offset_batch(px, py, k):
+    return (2 * py - k * (px * px + py * py)) / (1 + np.sqrt((1 - k * py)**2 + (k * px)**2))
@@ -119,6 +119,16 @@ class CasadiBSplineTrack(BaseTrack):
         c = (dx * ddy - dy * ddx) / np.power(dx**2 + dy**2, 1.5)
         return c
     
+    def get_curvature_batch(self, s):
+        s = np.asarray(s, dtype=float).reshape((1, -1))
+        dx, dy = np.array(self.dx(s)).ravel(), np.array(self.dy(s)).ravel()
+        ddx, ddy = np.array(self.ddx(s)).ravel(), np.array(self.ddy(s)).ravel()
+        return (dx * ddy - dy * ddx) / np.power(dx**2 + dy**2, 1.5)
+
+    def get_boundary_widths_batch(self, s):
+        s = np.asarray(s, dtype=float).reshape((1, -1))
+        return np.array(self.left_width(s)).ravel(), np.array(self.right_width(s)).ravel()
+
     def get_curvature_casadi_fn(self):
         sym_s = ca.MX.sym('s', 1)
         # Makes sure s is within [0, track_length]
@@ -234,6 +244,21 @@ class CasadiBSplineTrack(BaseTrack):
 
         return x, y, psi
 
+    def local_to_global_batch(self, cl_coords):
+        '''
+        local_to_global for an array of poses (B, 3), the spline functions are evaluated once on the row of all s
+        '''
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        s, ey, epsi = cl_coords[:, 0][None], cl_coords[:, 1], cl_coords[:, 2]
+
+        dxy = np.vstack([np.array(self.dx(s)), np.array(self.dy(s))])
+        n = dxy / np.linalg.norm(dxy, axis=0)
+
+        x = np.array(self.x(s)).ravel() - ey * n[1]
+        y = np.array(self.y(s)).ravel() + ey * n[0]
+        psi = epsi + np.arctan2(n[1], n[0])
+        return np.column_stack([x, y, psi])
+
 def plot_tests():
     from mpclab_common.track import get_track
     import matplotlib.pyplot as plt
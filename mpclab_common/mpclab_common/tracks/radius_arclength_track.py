@@ -5,9 +5,11 @@ from numpy import linalg as la
 import casadi as ca
 
 import copy
+import bisect
+import math
 import pdb
 
-from mpclab_common.tracks.base_track import BaseTrack
+from mpclab_common.tracks.base_track import BaseTrack, footprint_points, footprint_points_batch, lateral_offset, lateral_offset_batch
 
 class RadiusArclengthTrack():
     def __init__(self, track_width=None, slack=None, cl_segs=None):
@@ -360,6 +362,10 @@ class RadiusArclengthTrack():
     def get_halfwidth(self, s):
         return self.half_width
 
+    def get_boundary_widths_batch(self, s):
+        w = np.full(np.asarray(s).size, self.half_width, dtype=float)
+        return w, w.copy()
+
     def get_track_key_pts(self, cl_segs, init_pos):
         if cl_segs is None:
             raise ValueError('Track segments have not been defined')
@@ -808,6 +814,262 @@ class RadiusArclengthTrack():
             psi = wrap_angle(psi_d + e_psi)
         return (x, y, psi)
 
+    """
+    Vectorized global_to_local for B poses at once, every pose is tested against all segments and the first
+    matching segment is used, as in the loop of global_to_local
+    Input:
+        xy_coords: array (B, 3) of (x, y, psi)
+    Output:
+        array (B, 3) of (s, e_y, e_psi)
+    """
+    def global_to_local_batch(self, xy_coords, line='center'):
+        if self.key_pts is None:
+            raise ValueError('Track key points have not been defined')
+
+        xy_coords = np.asarray(xy_coords, dtype=float).reshape((-1, 3))
+        x, y, psi = xy_coords[:, 0:1], xy_coords[:, 1:2], xy_coords[:, 2:3]
+
+        # Segment i goes from key point i to key point i+1, arrays are (B, n_segments)
+        x_s, y_s, psi_s, s_s = self.key_pts[:-1, 0], self.key_pts[:-1, 1], self.key_pts[:-1, 2], self.key_pts[:-1, 3]
+        x_f, y_f, psi_f, s_f = self.key_pts[1:, 0], self.key_pts[1:, 1], self.key_pts[1:, 2], self.key_pts[1:, 3]
+        curve_f, l = self.key_pts[1:, 5], self.key_pts[1:, 4]
+        w = self.track_width / 2 + self.slack
+
+        at_start = (x_s == x) & (y_s == y)
+        at_end = (x_f == x) & (y_f == y)
+
+        # Straight segments
+        v_x, v_y = x - x_s, y - y_s
+        on_segment = (np.abs(compute_angle_batch(x_s, y_s, x, y, x_f, y_f)) <= np.pi / 2) \
+            & (np.abs(compute_angle_batch(x_f, y_f, x, y, x_s, y_s)) <= np.pi / 2)
+        ang = compute_angle_batch(x_s, y_s, x_f, y_f, x, y)
+        norm_v = np.sqrt(v_x**2 + v_y**2)
+        e_y_straight = norm_v * np.sin(ang)
+        s_straight = s_s + norm_v * np.cos(ang)
+        straight = (curve_f == 0) & on_segment & (np.abs(e_y_straight) <= w)
+
+        # Curved segments
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = 1 / curve_f
+            dir = np.sign(r)
+            x_c = x_s + np.abs(r) * np.cos(psi_s + dir * np.pi / 2)
+            y_c = y_s + np.abs(r) * np.sin(psi_s + dir * np.pi / 2)
+            span_ang = l / r
+            cur_ang = compute_angle_batch(x_c, y_c, x_s, y_s, x, y)
+            e_y_curved = -np.sign(dir) * (np.sqrt((x - x_c)**2 + (y - y_c)**2) - np.abs(r))
+            s_curved = np.mod(s_s + np.abs(cur_ang) * np.abs(r), self.track_length)
+        curved = (curve_f != 0) & (np.sign(span_ang) == np.sign(cur_ang)) & (np.abs(span_ang) >= np.abs(cur_ang)) \
+            & (np.abs(e_y_curved) <= w)
+
+        match = at_start | at_end | straight | curved
+        found = match.any(axis=1)
+        if not found.all():
+            raise ValueError('Point is out of the track!')
+        idx = np.argmax(match, axis=1)
+        b = np.arange(xy_coords.shape[0])
+        psi = psi[:, 0]
+
+        at_start, at_end, straight = at_start[b, idx], at_end[b, idx], straight[b, idx]
+        s = np.where(at_start, s_s[idx], np.where(at_end, s_f[idx], np.where(straight, s_straight[b, idx], s_curved[b, idx])))
+        e_y = np.where(at_start | at_end, 0., np.where(straight, e_y_straight[b, idx], e_y_curved[b, idx]))
+        psi_ref = np.where(at_start | straight, psi_s[idx], np.where(at_end, psi_f[idx], psi_s[idx] + cur_ang[b, idx]))
+        e_psi = unwrap_angle_batch(psi_ref, psi) - psi_ref
+
+        if line == 'inside':
+            e_y = e_y - self.track_width / 5
+        elif line == 'outside':
+            e_y = e_y + self.track_width / 5
+        elif line == 'pid_offset':
+            e_y = e_y + (0.1 * self.track_width / 2)
+        return np.column_stack([s, e_y, e_psi])
+
+    """
+    Vectorized local_to_global for B poses at once
+    Input:
+        cl_coords: array (B, 3) of (s, e_y, e_psi)
+    Output:
+        array (B, 3) of (x, y, psi)
+    """
+    def local_to_global_batch(self, cl_coords):
+        if self.key_pts is None:
+            raise ValueError('Track key points have not been defined')
+
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        s = np.mod(cl_coords[:, 0], self.track_length)
+        s = np.where(s >= self.track_length, s - self.track_length, s)
+        e_y, e_psi = cl_coords[:, 1], cl_coords[:, 2]
+
+        key_pt_idx_s = np.searchsorted(self.key_pts[:, 3], s, side='right') - 1
+        key_pt_idx_f = key_pt_idx_s + 1
+        x_s, y_s, psi_s = self.key_pts[key_pt_idx_s, 0], self.key_pts[key_pt_idx_s, 1], self.key_pts[key_pt_idx_s, 2]
+        x_f, y_f, psi_f = self.key_pts[key_pt_idx_f, 0], self.key_pts[key_pt_idx_f, 1], self.key_pts[key_pt_idx_f, 2]
+        curve_f = self.key_pts[key_pt_idx_f, 5]
+        l = self.key_pts[key_pt_idx_f, 4]
+        d = s - self.key_pts[key_pt_idx_s, 3]
+
+        # Straight segments
+        x = x_s + (x_f - x_s) * d / l + e_y * np.cos(psi_f + np.pi / 2)
+        y = y_s + (y_f - y_s) * d / l + e_y * np.sin(psi_f + np.pi / 2)
+        psi = wrap_angle_batch(psi_f + e_psi)
+
+        # Curved segments
+        curved = curve_f != 0
+        if curved.any():
+            r = 1 / curve_f[curved]
+            dir = np.where(r >= 0, 1, -1)
+            _psi_s, _e_y = psi_s[curved], e_y[curved]
+            x_c = x_s[curved] + np.abs(r) * np.cos(_psi_s + dir * np.pi / 2)
+            y_c = y_s[curved] + np.abs(r) * np.sin(_psi_s + dir * np.pi / 2)
+            span_ang = d[curved] / np.abs(r)
+            psi_d = wrap_angle_batch(_psi_s + dir * span_ang)
+            ang_norm = wrap_angle_batch(_psi_s + dir * np.pi / 2)
+            ang = -np.where(ang_norm >= 0, 1, -1) * (np.pi - np.abs(ang_norm))
+            x[curved] = x_c + (np.abs(r) - dir * _e_y) * np.cos(ang + dir * span_ang)
+            y[curved] = y_c + (np.abs(r) - dir * _e_y) * np.sin(ang + dir * span_ang)
+            psi[curved] = wrap_angle_batch(psi_d + e_psi[curved])
+        return np.column_stack([x, y, psi])
+
+    """
+    Lateral extent of the VL x VW footprint of a vehicle, exact on the constant curvature segments of the track
+    Input:
+        cl_coord: (s, e_y, e_psi) of the vehicle reference point (center of the footprint)
+    Output:
+        (e_y_min, e_y_max): smallest and largest lateral offset reached by the footprint
+    The points of the footprint are tested in the frame of the segment of the reference point (see footprint_points in
+    base_track), then of the next and previous segments for as long as some of them lie beyond the segment, each point
+    counting in the segment it lies in. Points further from a segment than the footprint can reach (|e_y| plus the
+    radius of the footprint) belong to another part of the track, e.g. across a hairpin.
+    """
+    def footprint_lateral_bounds(self, cl_coord, VL=0.37, VW=0.195):
+        if self.key_pts is None:
+            raise ValueError('Track key points have not been defined')
+        s, e_y, e_psi = map(float, cl_coord)
+        L = self.track_length
+        s = math.fmod(math.fmod(s, L) + L, L)
+        kp, kp_s = self._key_pts_lists()
+        i = min(bisect.bisect_right(kp_s, s) - 1, self.n_segs - 1)
+        xg, yg, pg = self._segment_pose_to_global(kp, i, s, e_y, e_psi)
+        e_lim = abs(e_y) + math.sqrt(VL**2 + VW**2) / 2
+
+        e_min, e_max, ahead, behind = self._footprint_in_segment(kp, i, xg, yg, pg, e_lim, VL, VW)
+        for direction, more in ((1, ahead), (-1, behind)):
+            m = i
+            while more and abs(m - i) < self.n_segs:
+                m += direction
+                if not (0 <= m < self.n_segs or self.circuit):
+                    break
+                _e_min, _e_max, ahead, behind = self._footprint_in_segment(kp, m % self.n_segs, xg, yg, pg, e_lim, VL, VW)
+                e_min, e_max = min(e_min, _e_min), max(e_max, _e_max)
+                more = ahead if direction == 1 else behind
+        return e_min, e_max
+
+    def _key_pts_lists(self):
+        # The key points and their s as nested lists for the scalar footprint, converted once per key_pts array
+        if getattr(self, '_key_pts_cache', (None,))[0] is not self.key_pts:
+            kp = self.key_pts.tolist()
+            self._key_pts_cache = (self.key_pts, kp, [p[3] for p in kp])
+        return self._key_pts_cache[1:]
+
+    def footprint_lateral_bounds_batch(self, cl_coords, VL=0.37, VW=0.195):
+        if self.key_pts is None:
+            raise ValueError('Track key points have not been defined')
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        s = np.mod(cl_coords[:, 0], self.track_length)
+        i = np.minimum(np.searchsorted(self.key_pts[:, 3], s, side='right') - 1, self.n_segs - 1)
+        kp = self.key_pts
+        xg, yg, pg = self._segment_pose_to_global(kp, i, s, cl_coords[:, 1], cl_coords[:, 2])
+        e_lim = np.abs(cl_coords[:, 1]) + np.sqrt(VL**2 + VW**2) / 2
+
+        e_min, e_max, ahead, behind = self._footprint_in_segment(kp, i, xg, yg, pg, e_lim, VL, VW)
+        for direction, more in ((1, ahead), (-1, behind)):
+            m = i.copy()
+            for _ in range(self.n_segs - 1):
+                m = m + direction
+                if not self.circuit:
+                    more = more & (m >= 0) & (m < self.n_segs)
+                b = np.nonzero(more)[0]
+                if b.size == 0:
+                    break
+                _e_min, _e_max, ahead, behind = self._footprint_in_segment(kp, np.mod(m[b], self.n_segs), xg[b], yg[b], pg[b],
+                                                                           e_lim[b], VL, VW)
+                e_min[b], e_max[b] = np.minimum(e_min[b], _e_min), np.maximum(e_max[b], _e_max)
+                more = np.zeros_like(more)
+                more[b] = ahead if direction == 1 else behind
+        return np.column_stack([e_min, e_max])
+
+    @staticmethod
+    def _segment_pose_to_global(kp, i, s, e_y, e_psi):
+        # Same as local_to_global, from the start pose of segment i, for floats (kp as nested lists) or arrays
+        if isinstance(s, float):
+            (x_s, y_s, psi_s, s_s), k = kp[i][:4], kp[i + 1][5]
+            d = s - s_s
+            phi = k * d
+            x_l, y_l = (math.sin(phi) / k, 2 * math.sin(phi / 2)**2 / k) if k != 0 else (d, 0.)
+            c, sn, c_p, s_p = math.cos(psi_s), math.sin(psi_s), math.cos(phi), math.sin(phi)
+        else:
+            x_s, y_s, psi_s, k = kp[i, 0], kp[i, 1], kp[i, 2], kp[i + 1, 5]
+            d = s - kp[i, 3]
+            phi = k * d
+            straight, k = k == 0, np.where(k == 0, 1., k)
+            x_l = np.where(straight, d, np.sin(phi) / k)
+            y_l = np.where(straight, 0., 2 * np.sin(phi / 2)**2 / k)
+            c, sn, c_p, s_p = np.cos(psi_s), np.sin(psi_s), np.cos(phi), np.sin(phi)
+        x_l, y_l = x_l - e_y * s_p, y_l + e_y * c_p
+        return x_s + c * x_l - sn * y_l, y_s + sn * x_l + c * y_l, psi_s + phi + e_psi
+
+    @staticmethod
+    def _footprint_in_segment(kp, m, xg, yg, pg, e_lim, VL, VW):
+        '''
+        lateral bounds of the footprint points of the vehicles at the global poses (xg, yg, pg) that lie in segment m
+        (within e_lim of its centerline), and whether some of them are ahead of its end or behind its start
+        '''
+        if isinstance(xg, float):
+            (x_m, y_m, psi_m), l, k = kp[m][:3], kp[m + 1][4], kp[m + 1][5]
+            c, sn = math.cos(psi_m), math.sin(psi_m)
+            dx, dy = xg - x_m, yg - y_m
+            e_min, e_max, ahead, behind = np.inf, -np.inf, False, False
+            for px, py in footprint_points(c * dx + sn * dy, c * dy - sn * dx, pg - psi_m, k, VL, VW):
+                e = lateral_offset(px, py, k)
+                if abs(e) > e_lim + 1e-9:
+                    continue
+                # Arc length position from the middle of the segment, arcs can turn by more than pi
+                sp = l / 2 + math.remainder(math.atan2(k * px, 1 - k * py) - k * l / 2, 2 * math.pi) / k if k != 0 else px
+                ahead, behind = ahead or sp > l, behind or sp < 0
+                if -1e-9 <= sp <= l + 1e-9:
+                    e_min, e_max = min(e_min, e), max(e_max, e)
+            return e_min, e_max, ahead, behind
+
+        x_m, y_m, psi_m, k, l = kp[m, 0], kp[m, 1], kp[m, 2], kp[m + 1, 5][:, None], kp[m + 1, 4][:, None]
+        c, sn = np.cos(psi_m)[:, None], np.sin(psi_m)[:, None]
+        dx, dy = (xg - x_m)[:, None], (yg - y_m)[:, None]
+        px, py = footprint_points_batch(c * dx + sn * dy, c * dy - sn * dx, (pg - psi_m)[:, None], k, VL, VW)
+        e = lateral_offset_batch(px, py, k)
+        sp = np.where(k == 0, px, l / 2 + wrap_angle_batch(np.arctan2(k * px, 1 - k * py) - k * l / 2) / np.where(k == 0, 1., k))
+        near = np.abs(e) <= e_lim[:, None] + 1e-9
+        inside = near & (sp >= -1e-9) & (sp <= l + 1e-9)
+        return np.where(inside, e, np.inf).min(axis=1), np.where(inside, e, -np.inf).max(axis=1), \
+            (near & (sp > l)).any(axis=1), (near & (sp < 0)).any(axis=1)
+
+    def footprint_off_track(self, cl_coord, VL=0.37, VW=0.195):
+        # The footprint is within its radius of the reference point, only vehicles close to the boundary are tested
+        e_y = abs(cl_coord[1])
+        if e_y + math.sqrt(VL**2 + VW**2) / 2 <= self.half_width:
+            return False
+        if e_y > self.half_width:
+            return True
+        e_min, e_max = self.footprint_lateral_bounds(cl_coord, VL, VW)
+        return e_max > self.half_width or e_min < -self.half_width
+
+    def footprint_off_track_batch(self, cl_coords, VL=0.37, VW=0.195):
+        cl_coords = np.asarray(cl_coords, dtype=float).reshape((-1, 3))
+        e_y = np.abs(cl_coords[:, 1])
+        off = e_y > self.half_width
+        near = ~off & (e_y + np.sqrt(VL**2 + VW**2) / 2 > self.half_width)
+        if near.any():
+            bounds = self.footprint_lateral_bounds_batch(cl_coords[near], VL, VW)
+            off[near] = (bounds[:, 1] > self.half_width) | (bounds[:, 0] < -self.half_width)
+        return off
+
     # def get_curvature_casadi_fn_dynamic(self):
     #     sym_s = ca.SX.sym('s', 1)
     #     track_length = ca.SX.sym('track_length', 1)
@@ -967,6 +1229,20 @@ def wrap_angle(theta):
     return wrapped_angle
 
 
+def wrap_angle_batch(theta):
+    return np.where(theta < -np.pi, 2 * np.pi + theta, np.where(theta > np.pi, theta - 2 * np.pi, theta))
+
+
+def unwrap_angle_batch(ref, theta):
+    '''
+    theta shifted by a multiple of 2 pi to within pi of ref, elementwise the same as np.unwrap([ref, theta])[1]
+    '''
+    dd = theta - ref
+    ddmod = np.mod(dd + np.pi, 2 * np.pi) - np.pi
+    ddmod = np.where((ddmod == -np.pi) & (dd > 0), np.pi, ddmod)
+    return theta + np.where(np.abs(dd) < np.pi, 0, ddmod - dd)
+
+
 def sign(a):
     if a >= 0:
         res = 1
@@ -995,6 +1271,15 @@ def compute_angle(point_0, point_1, point_2):
 
     return theta
 
+
+def compute_angle_batch(x_0, y_0, x_1, y_1, x_2, y_2):
+    '''
+    compute_angle for broadcasting arrays of point coordinates
+    '''
+    v_1x, v_1y = x_1 - x_0, y_1 - y_0
+    v_2x, v_2y = x_2 - x_0, y_2 - y_0
+    return np.arctan2(v_1x * v_2y - v_1y * v_2x, v_1x * v_2x + v_1y * v_2y)
+
 if __name__ == "__main__":
     from mpclab_common.track import get_track
 
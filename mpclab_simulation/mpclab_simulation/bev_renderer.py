@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+def track_polygon(track, boundary_resolution: float = 0.01, offset: float = 0.) -> np.ndarray:
+    '''
+    (N, 2) polygon of the track surface, with the boundaries moved outwards by offset: the left boundary from the start
+    to the end, then the right boundary back (the seam at the start line has zero width, so closed tracks give the
+    whole loop)
+    '''
+    n = max(int(np.ceil(track.track_length / boundary_resolution)), 2)
+    s = np.linspace(0, track.track_length, n + 1)
+    if hasattr(track, 'get_boundary_widths_batch'):
+        left, right = track.get_boundary_widths_batch(s)
+    else:
+        left = right = np.full(s.shape, track.half_width)
+    left_xy = track.local_to_global_batch(np.column_stack([s, left + offset, np.zeros_like(s)]))[:, :2]
+    right_xy = track.local_to_global_batch(np.column_stack([s, -right - offset, np.zeros_like(s)]))[:, :2]
+    return np.concatenate([left_xy, right_xy[::-1]])
+
+
+def rasterize_track(track, map_resolution: float, boundary_resolution: float = 0.01, offset: float = 0., pad: int = 2,
+                    extent: np.ndarray = None):
+    '''
+    even-odd scanline fill of the track polygon (see track_polygon), returns the uint8 mask (255 on the track, 0
+    outside, rows along y) and the global (x, y) of the center of its pixel (0, 0)
+    extent: (x_min, y_min, x_max, y_max) covered by the mask, defaults to the polygon, with a border of pad pixels
+    '''
+    poly = track_polygon(track, boundary_resolution, offset)
+    lo, hi = (poly.min(axis=0), poly.max(axis=0)) if extent is None else (np.asarray(extent[:2]), np.asarray(extent[2:]))
+    origin = lo - pad * map_resolution
+    n_rows, n_cols = (np.ceil((hi - origin) / map_resolution).astype(int) + pad + 1)[::-1]
+    # Polygon in pixel units
+    px, py = ((poly - origin) / map_resolution).T
+    x0, y0, x1, y1 = px, py, np.roll(px, -1), np.roll(py, -1)
+
+    # Crossings of every edge with the horizontal lines through the pixel centers, half-open in y so that a vertex
+    # shared by two edges is only counted once
+    r = np.arange(n_rows)[:, None]
+    crosses = (np.minimum(y0, y1) <= r) & (r < np.maximum(y0, y1))
+    row, edge = np.nonzero(crosses)
+    x = x0[edge] + (row - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    # Toggle the parity from the first pixel center right of each crossing
+    parity = np.zeros((n_rows, n_cols + 1), dtype=np.int32)
+    np.add.at(parity, (row, np.clip(np.ceil(x).astype(int), 0, n_cols)), 1)
+    mask = np.where(np.cumsum(parity, axis=1)[:, :n_cols] % 2 == 1, 255, 0).astype(np.uint8)
+    return mask, origin
+
+
+class BEVRenderer():
+    '''
+    Ego-centred, ego-rotated bird's-eye-view raster of the drivable area of the track
+
+    The track surface is rasterized once into a global uint8 mask (255 on the track, 0 outside, see rasterize_track)
+    with map_resolution meters per pixel. Every view is an affine resample (nearest pixel) of the mask: pixel
+    (row, col) of the (H, W) image is the point (H * forward - 1/2 - row, W / 2 - 1/2 - col) * resolution of the
+    vehicle frame, i.e. the vehicle looks up and its left is on the left of the image, and forward is the fraction of
+    the image in front of it. The views of a batch of vehicles are computed with a single gather.
+    '''
+    def __init__(self, track, size=(64, 64), resolution: float = 0.05, forward: float = 0.75,
+                 map_resolution: float = 0.02, boundary_resolution: float = 0.01):
+        self.height, self.width = size
+        self.resolution = resolution
+        self.forward = forward
+        self.map_resolution = map_resolution
+
+        # Pixel centers in the vehicle frame (x forward along the rows, y to the left along the columns), in mask pixels
+        self._u = ((self.height * forward - 0.5 - np.arange(self.height)) * resolution / map_resolution)[:, None]
+        self._v = ((self.width / 2 - 0.5 - np.arange(self.width)) * resolution / map_resolution)[None, :]
+
+        # The mask is padded by the radius of the views, so the views of the vehicles in its extent need no clipping
+        self._block = max(16384 // (self.height * self.width), 1)
+        self._pad = int(np.ceil(np.hypot(np.abs(self._u).max(), np.abs(self._v).max()))) + 1
+        self.mask, self.origin = rasterize_track(track, map_resolution, boundary_resolution, pad=self._pad)
+
+    def render(self, poses: np.ndarray) -> np.ndarray:
+        '''
+        views (B, H, W) uint8 of the vehicles at poses (B, 3) of (x, y, psi)
+        '''
+        poses = np.asarray(poses, dtype=float).reshape((-1, 3))
+        n_rows, n_cols = self.mask.shape
+        # Position of the vehicles in mask pixels (+ 1/2 to round to the nearest pixel), the views of the vehicles
+        # out of the padded extent of the mask are empty
+        x = (poses[:, 0] - self.origin[0]) / self.map_resolution + 0.5
+        y = (poses[:, 1] - self.origin[1]) / self.map_resolution + 0.5
+        in_map = (x >= self._pad) & (x <= n_cols - self._pad) & (y >= self._pad) & (y <= n_rows - self._pad)
+        x, y = np.where(in_map, x, n_cols / 2), np.where(in_map, y, n_rows / 2)
+        c, s = np.cos(poses[:, 2]), np.sin(poses[:, 2])
+
+        # Rotation of the pixel grid, separable in the rows and columns of the view: (B, H, 1) and (B, 1, W) terms
+        b = (slice(None), None, None)
+        col_u, col_v = (x[b] + c[b] * self._u).astype(np.float32), (s[b] * self._v).astype(np.float32)
+        row_u, row_v = (y[b] + s[b] * self._u).astype(np.float32), (c[b] * self._v).astype(np.float32)
+        mask = self.mask.ravel()
+        views = np.empty((poses.shape[0], self.height, self.width), dtype=np.uint8)
+        # Blocks of vehicles, so that the per pixel temporaries stay in cache
+        for i in range(0, poses.shape[0], self._block):
+            j = slice(i, i + self._block)
+            col = (col_u[j] - col_v[j]).astype(np.intp)
+            row = (row_u[j] + row_v[j]).astype(np.intp)
+            row *= n_cols
+            row += col
+            np.take(mask, row, out=views[j])
+        views[~in_map] = 0
+        return views
+
+
+if __name__ == '__main__':
+    import time
+    from mpclab_common.track import get_track
+
+    track = get_track('L_track_barc')
+    t = time.perf_counter()
+    bev = BEVRenderer(track)
+    print('Mask %s rasterized in %.1f ms' % (bev.mask.shape, (time.perf_counter() - t) * 1e3))
+    rng = np.random.default_rng(0)
+    for B in [1, 32, 256]:
+        cl = np.column_stack([rng.uniform(0, track.track_length, B), rng.uniform(-0.4, 0.4, B), rng.uniform(-0.5, 0.5, B)])
+        poses = track.local_to_global_batch(cl)
+        n = max(2000 // B, 10)
+        t = time.perf_counter()
+        for _ in range(n):
+            views = bev.render(poses)
+        t = (time.perf_counter() - t) / n
+        print('%i vehicles, %ix%i views: %.1f us per render, %.0f views / s' % (B, bev.height, bev.width, t * 1e6, B / t))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from mpclab_common.tracks.radius_arclength_track import RadiusArclengthTrack
+
+class CollisionChecker():
+    '''
+    Vehicle-to-vehicle collision detection for K cars modelled as oriented rectangles of length VL and width VW
+    centered on the vehicle reference point
+
+    Broad phase: sort and sweep on the track progress s (with wrap-around at the track length) when s is given,
+    otherwise on the global x coordinate. Each car covers an interval of the radius of its bounding circle, scaled
+    by the largest ratio between the progress along the centerline and the distance travelled by an offset point
+    (inside of the tightest curve), so no colliding pair is ever missed. The overlapping pairs are then filtered
+    with their bounding circles.
+    Narrow phase: exact separating axis test of the oriented rectangles, vectorized over the candidate pairs.
+    '''
+    def __init__(self, VL: float = 0.37, VW: float = 0.195, track=None):
+        self.VL = VL
+        self.VW = VW
+        self.radius = np.sqrt(VL**2 + VW**2) / 2
+
+        self.track_length = None
+        self.s_scale = 1.
+        if track is not None:
+            self.track_length = track.track_length
+            w = track.half_width + getattr(track, 'slack', 0)
+            if isinstance(track, RadiusArclengthTrack):
+                k_max = np.abs(track.key_pts[:, 5]).max()
+            else:
+                f_curvature = track.get_curvature_casadi_fn()
+                k_max = np.abs(np.array(f_curvature(np.linspace(0, track.track_length, 1000)[None]))).max()
+            # An offset point on the inside of a curve moves 1 - k*w times as far as its projection on the centerline
+            self.s_scale = 1 / (1 - k_max * w) if k_max * w < 1 else np.inf
+
+    def broad_phase(self, poses: np.ndarray, s: np.ndarray = None, margin: float = 0.) -> np.ndarray:
+        '''
+        candidate pairs (P, 2) with i < j, from the poses (K, 3) of (x, y, psi) and optionally the track progress s (K,)
+        margin: distance the cars can travel before the candidates are tested, widens the intervals and circles
+        '''
+        K = poses.shape[0]
+        if s is not None and self.track_length is not None and np.isfinite(self.s_scale):
+            key, extent, L = np.mod(s, self.track_length), (self.radius + margin) * self.s_scale, self.track_length
+            if 2 * extent >= L / 2:
+                return np.column_stack(np.triu_indices(K, 1))
+        else:
+            key, extent, L = poses[:, 0], self.radius + margin, None
+
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        if L is not None:
+            # Second copy of the sorted keys shifted by one lap, for the pairs across the start line
+            sorted_key = np.concatenate([sorted_key, sorted_key + L])
+            order = np.concatenate([order, order])
+        # Candidates of the i-th car in sorted order: the following cars with key within 2 * extent
+        first = np.arange(1, K + 1)
+        last = np.searchsorted(sorted_key, sorted_key[:K] + 2 * extent, side='right')
+        counts = np.maximum(last - first, 0)
+        if counts.sum() == 0:
+            return np.zeros((0, 2), dtype=int)
+        i = np.repeat(np.arange(K), counts)
+        j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+        a, b = order[i], order[j]
+        # Bounding circle test, the sweep only separates the cars along one coordinate
+        d = poses[b, :2] - poses[a, :2]
+        r = 2 * (self.radius + margin)
+        close = d[:, 0]**2 + d[:, 1]**2 <= r**2
+        a, b = a[close], b[close]
+        # With 2 * extent < L / 2 a pair is found either directly or across the start line, never twice
+        pairs = np.column_stack([np.minimum(a, b), np.maximum(a, b)])
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+    def narrow_phase(self, poses: np.ndarray, pairs: np.ndarray):
+        '''
+        separating axis test of the oriented rectangles of the candidate pairs
+        returns the colliding pairs (P, 2), their penetration depth (P,) and the contact normal (P, 2) pointing from
+        the first car of the pair to the second (the axis of least penetration)
+        '''
+        a, b = poses[pairs[:, 0]], poses[pairs[:, 1]]
+        d_x, d_y = b[:, 0] - a[:, 0], b[:, 1] - a[:, 1]
+        c_a, s_a, c_b, s_b = np.cos(a[:, 2]), np.sin(a[:, 2]), np.cos(b[:, 2]), np.sin(b[:, 2])
+
+        # Both boxes have the same size, so their half extents projected on the long and lateral axes of either box
+        # only depend on the relative heading
+        hl, hw = self.VL / 2, self.VW / 2
+        c_rel = np.abs(c_a * c_b + s_a * s_b)
+        s_rel = np.abs(s_a * c_b - c_a * s_b)
+        r_long = hl + hl * c_rel + hw * s_rel
+        r_lat = hw + hl * s_rel + hw * c_rel
+
+        # Distance between the centers along the long and lateral axis of a, then of b
+        dist = np.column_stack([c_a * d_x + s_a * d_y, c_a * d_y - s_a * d_x, c_b * d_x + s_b * d_y, c_b * d_y - s_b * d_x])
+        overlap = np.column_stack([r_long, r_lat, r_long, r_lat]) - np.abs(dist)
+
+        colliding = (overlap > 0).all(axis=1)
+        if not colliding.any():
+            return np.zeros((0, 2), dtype=int), np.zeros(0), np.zeros((0, 2))
+        overlap, dist = overlap[colliding], dist[colliding]
+        c_a, s_a, c_b, s_b = c_a[colliding], s_a[colliding], c_b[colliding], s_b[colliding]
+        axes = np.stack([np.column_stack([c_a, s_a]), np.column_stack([-s_a, c_a]),
+                         np.column_stack([c_b, s_b]), np.column_stack([-s_b, c_b])], axis=1)
+        k = np.argmin(overlap, axis=1)
+        idx = np.arange(k.shape[0])
+        depth = overlap[idx, k]
+        normal = axes[idx, k] * np.where(dist[idx, k] < 0, -1, 1)[:, None]
+        return pairs[colliding], depth, normal
+
+    def check(self, poses: np.ndarray, s: np.ndarray = None, margin: float = 0.) -> dict:
+        '''
+        collisions between the cars at poses (K, 3) of (x, y, psi), optionally with the track progress s (K,)
+        for the broad phase, see broad_phase
+        returns a dict with the colliding pairs (P, 2), the penetration depth (P,) and normal (P, 2) of each contact
+        '''
+        poses = np.asarray(poses, dtype=float).reshape((-1, 3))
+        if s is not None:
+            s = np.asarray(s, dtype=float).reshape(-1)
+        pairs = self.broad_phase(poses, s, margin)
+        if pairs.shape[0] == 0:
+            return self.no_contacts()
+        pairs, depth, normal = self.narrow_phase(poses, pairs)
+        return {'pairs': pairs, 'depth': depth, 'normal': normal}
+
+    @staticmethod
+    def no_contacts() -> dict:
+        return {'pairs': np.zeros((0, 2), dtype=int), 'depth': np.zeros(0), 'normal': np.zeros((0, 2))}
+
+    @staticmethod
+    def in_collision(contacts: dict, n_agents: int) -> np.ndarray:
+        '''
+        mask (n_agents,) of the cars in at least one contact
+        '''
+        mask = np.zeros(n_agents, dtype=bool)
+        mask[contacts['pairs'].ravel()] = True
+        return mask
+
+
+if __name__ == '__main__':
+    import time
+    from mpclab_common.track import get_track
+
+    track = get_track('L_track_barc')
+    checker = CollisionChecker(track=track)
+    rng = np.random.default_rng(0)
+    for K in [8, 32, 128]:
+        cl = np.column_stack([rng.uniform(0, track.track_length, K), rng.uniform(-0.4, 0.4, K), rng.uniform(-0.3, 0.3, K)])
+        poses = track.local_to_global_batch(cl)
+        t = time.perf_counter()
+        for _ in range(1000):
+            contacts = checker.check(poses, cl[:, 0])
+        t = (time.perf_counter() - t) / 1000
+        all_pairs = np.column_stack(np.triu_indices(K, 1))
+        brute = checker.narrow_phase(poses, all_pairs)[0]
+        assert np.array_equal(brute, contacts['pairs'])
+        print('K = %i: %i contacts, %.1f us per check' % (K, len(contacts['pairs']), t * 1e6))
@@ -7,15 +7,19 @@ from mpclab_common.pytypes import VehicleState
 
 from collections import deque
 import copy
+import dataclasses
 import pdb
 
 class DynamicsSimulator():
     '''
     Class for simulating vehicle dynamics possibly with delay
     '''
-    def __init__(self, t0: float, dynamics_config, delay=None, track=None):
+    def __init__(self, t0: float, dynamics_config, delay=None, track=None, integrator=None, substeps=None, rtol=None, atol=None):
         # delay: delay time in seconds for each input channel
-        self.model = get_dynamics_model(t0, dynamics_config, track=track)
+        # integrator: overrides the integrator of the model step, 'euler', 'rk2', 'rk3', 'rk4' (fixed step fd) or 'adaptive' (solve_ivp)
+        # substeps: number of fixed steps per dt for the RK methods (DynamicsConfig.M), euler always takes a single step
+        # rtol, atol: tolerances of the adaptive integrator
+        self.model = get_dynamics_model(t0, self.integrator_config(dynamics_config, integrator, substeps, rtol, atol), track=track)
         if delay is not None:
             self.delay_steps = [int(d/self.model.dt) for d in delay]
             self.delay_buffer = [deque([0 for _ in range(self.delay_steps[i])], maxlen=self.delay_steps[i]) for i in range(self.model.n_u)]
@@ -24,8 +28,66 @@ class DynamicsSimulator():
             self.delay_buffer = None
         return
 
-    def step(self, state: VehicleState, T=None):
+    @staticmethod
+    def integrator_config(dynamics_config, integrator=None, substeps=None, rtol=None, atol=None):
+        '''
+        Returns a copy of dynamics_config with the integrator settings of the model step replaced
+        '''
+        changes = dict()
+        if integrator == 'adaptive':
+            changes['step_method'] = 'adaptive'
+        elif integrator in ['euler', 'rk2', 'rk3', 'rk4']:
+            changes['step_method'] = 'discrete'
+            changes['discretization_method'] = integrator
+        elif integrator is not None:
+            raise ValueError('Integrator %s not recognized, choose from euler, rk2, rk3, rk4 or adaptive' % integrator)
+        if substeps is not None:
+            if substeps < 1:
+                raise ValueError('Number of substeps must be positive, got %i' % substeps)
+            changes['M'] = int(substeps)
+        if rtol is not None:
+            changes['step_rtol'] = rtol
+        if atol is not None:
+            changes['step_atol'] = atol
+        if not changes:
+            return dynamics_config
+        return dataclasses.replace(dynamics_config, **changes)
+
+    def get_delay_state(self) -> np.ndarray:
+        '''
+        Returns the contents of the input delay buffers as a flat array (channel by channel, oldest first)
+        '''
+        if self.delay_buffer is None:
+            return np.zeros(0)
+        return np.concatenate([np.array(b, dtype=float) for b in self.delay_buffer])
+
+    def set_delay_state(self, delay_state: np.ndarray):
+        '''
+        Overwrites the input delay buffers with an array produced by get_delay_state
+        '''
+        if self.delay_buffer is None:
+            return
+        delay_state = np.asarray(delay_state, dtype=float)
+        if delay_state.size != sum(self.delay_steps):
+            raise ValueError('Delay state has %i entries, expected %i' % (delay_state.size, sum(self.delay_steps)))
+        i = 0
+        for b, n in zip(self.delay_buffer, self.delay_steps):
+            b.clear()
+            b.extend(delay_state[i:i+n].tolist())
+            i += n
+
+    def get_params(self) -> dict:
+        return self.model.get_params()
+
+    def set_params(self, params):
+        '''
+        Sets the runtime parameters of the simulated model (see DynamicsConfig.params), takes effect from the next step
+        '''
+        self.model.set_params(params)
+
+    def step(self, state: VehicleState, T=None, update_frame=True):
         # T: simulation duration in seconds
+        # update_frame: passed to the model step, if False the pose in the other frame of reference is not updated
         if T is None:
             sim_steps = 1
         else:
@@ -38,5 +100,5 @@ class DynamicsSimulator():
                 self.model.u2input(state.u, u_delay)
                 for i in range(self.model.n_u):
                     self.delay_buffer[i].append(u_new[i])
-            self.model.step(state)
+            self.model.step(state, update_frame=update_frame)
 
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from mpclab_common.tracks.radius_arclength_track import RadiusArclengthTrack
+
+class RangeSensor():
+    '''
+    Planar ray-cast range sensor ("lidar") measuring the distance from the vehicle to the track boundaries
+
+    n_rays rays spread over fov (centered on the heading, evenly around the vehicle for fov = 2 pi), rays that do not
+    hit a boundary within max_range return max_range.
+    The boundaries of a RadiusArclengthTrack are the exact lines and arcs of its segments (offset by the half width),
+    other tracks are approximated by polylines sampled every resolution meters of the centerline. offset moves the
+    boundaries outwards (e.g. to the walls beyond the track limits).
+    The boundaries may be split in pieces of at most piece_length (arcs are always split in turns of less than pi), and
+    all the rays of all the vehicles are cast at once. For every vehicle, the pieces in range are culled with their
+    bounding circles, and the angular extent of each piece seen from the vehicle (from the directions of its end points,
+    and of its tangent points for the arcs seen from outside their circle) gives the exact interval of rays that hit it,
+    so only these (ray, piece) pairs are evaluated, each with a couple of multiply-adds with the coefficients of the
+    piece precomputed per vehicle: a ray of a line is at 1 / (a . d), a ray of an arc at the near or far root of its
+    circle. The closest hit is kept.
+    Building the pairs has a fixed cost per cast, so when there are at most dense_size (vehicle, piece, ray) triples
+    (e.g. a single vehicle), every ray is rather intersected with every piece, in dense arrays.
+    Throughput (L_track_barc, 64 rays, one core, see __main__): ~0.7k rays / ms for a single vehicle, where a cast
+    (~80-95 us) is the fixed cost of its NumPy calls, ~7k rays / ms for 32 vehicles and ~9-14k rays / ms for 256, i.e.
+    10k rays / ms are only reached by batches of a couple hundred vehicles.
+    '''
+    dense_size = 8192
+
+    def __init__(self, track, n_rays: int = 32, fov: float = 2 * np.pi, max_range: float = 4., resolution: float = 0.05,
+                 piece_length: float = np.inf, offset: float = 0.):
+        self.n_rays = n_rays
+        self.fov = fov
+        self.max_range = max_range
+        self._full_circle = bool(np.isclose(fov, 2 * np.pi))
+        if self._full_circle:
+            self.angles = np.linspace(-np.pi, np.pi, n_rays, endpoint=False)
+        else:
+            self.angles = np.linspace(-fov / 2, fov / 2, n_rays)
+        self._cos, self._sin = np.cos(self.angles), np.sin(self.angles)
+        self._rays_2 = np.tile(self._cos - 1j * self._sin, 2)
+        # Rays are evenly spaced, the rays in an angular interval are found from its bounds in units of the spacing
+        self._spacing = 2 * np.pi / n_rays if self._full_circle else fov / max(n_rays - 1, 1)
+        self._lap = 2 * np.pi / self._spacing
+
+        if isinstance(track, RadiusArclengthTrack):
+            lines, self._arcs = self._track_primitives(track, piece_length, offset)
+        else:
+            lines, self._arcs = self._polyline_primitives(track, resolution, offset), np.zeros((0, 7))
+        self._lines = self._split_lines(lines, piece_length)
+
+        # Bounding circles (center x, center y, squared culling distance) and end points of the lines then the arcs
+        self._n_lines = self._lines.shape[0]
+        x0, y0, x1, y1 = self._lines.T
+        length = np.hypot(x1 - x0, y1 - y0)
+        c_x, c_y, rho, m_x, m_y, cos_half, half = self._arcs.T
+        theta_m = np.arctan2(m_y, m_x)
+        self._bound_x = np.concatenate([(x0 + x1) / 2, c_x + rho * m_x])
+        self._bound_y = np.concatenate([(y0 + y1) / 2, c_y + rho * m_y])
+        self._bound_r2 = (max_range + np.concatenate([length / 2, 2 * rho * np.sin(half / 2)]))**2
+        self._x0 = np.concatenate([x0, c_x + rho * np.cos(theta_m - half)])
+        self._y0 = np.concatenate([y0, c_y + rho * np.sin(theta_m - half)])
+        self._x1 = np.concatenate([x1, c_x + rho * np.cos(theta_m + half)])
+        self._y1 = np.concatenate([y1, c_y + rho * np.sin(theta_m + half)])
+        # Lines: unit normal and its product with the points of the line
+        self._n_x, self._n_y = -(y1 - y0) / np.maximum(length, 1e-12), (x1 - x0) / np.maximum(length, 1e-12)
+        self._n_p = self._n_x * x0 + self._n_y * y0
+        self._e_x, self._e_y = x1 - x0, y1 - y0
+        # Arcs: center, radius and squared radius, middle direction, cos of the half span, distance of the chord to the
+        # center
+        self._c_x, self._c_y, self._rho, self._rho_2 = c_x.copy(), c_y.copy(), rho.copy(), rho**2
+        self._m_x, self._m_y, self._cos_half, self._chord = m_x.copy(), m_y.copy(), cos_half.copy(), rho * cos_half
+        # and end points relative to the center
+        self._e0_x, self._e0_y = self._x0[self._n_lines:] - c_x, self._y0[self._n_lines:] - c_y
+        self._e1_x, self._e1_y = self._x1[self._n_lines:] - c_x, self._y1[self._n_lines:] - c_y
+        # Directions of the rays (in the frame of the vehicle) on two laps, tiled for the last number of vehicles
+        self._ray_table = np.zeros(0, dtype=complex)
+
+    @staticmethod
+    def _track_primitives(track: RadiusArclengthTrack, piece_length: float, offset: float = 0.):
+        '''
+        lines (S, 4) of (x0, y0, x1, y1) and arcs (S, 7) of (center x, center y, radius, unit vector from the center
+        to the middle of the arc, cos of the half span, half span) of the inner and outer boundaries
+        '''
+        lines, arcs = [], []
+        kp = track.key_pts
+        for m in range(track.n_segs):
+            x, y, psi = kp[m, 0:3]
+            k, l = kp[m + 1, 5], kp[m + 1, 4]
+            n = np.array([-np.sin(psi), np.cos(psi)])
+            for e in (track.half_width + offset, -track.half_width - offset):
+                if k == 0:
+                    p0 = np.array([x, y]) + e * n
+                    lines.append(np.concatenate([p0, p0 + l * np.array([np.cos(psi), np.sin(psi)])]))
+                    continue
+                rho = abs(1 / k - e)
+                if rho <= 0:
+                    continue
+                c = np.array([x, y]) + n / k
+                theta_0 = psi - np.sign(k) * np.pi / 2
+                # Pieces turning by less than pi, so that the points of a piece are the points of its circle on the far
+                # side of its chord
+                n_split = int(max(np.ceil(abs(k * l) / np.pi), np.ceil(rho * abs(k * l) / piece_length)))
+                span = k * l / n_split
+                for j in range(n_split):
+                    theta_m = theta_0 + (j + 0.5) * span
+                    arcs.append([c[0], c[1], rho, np.cos(theta_m), np.sin(theta_m), np.cos(abs(span) / 2), abs(span) / 2])
+        return np.array(lines).reshape((-1, 4)), np.array(arcs).reshape((-1, 7))
+
+    @staticmethod
+    def _polyline_primitives(track, resolution, offset=0.):
+        n = max(int(np.ceil(track.track_length / resolution)), 2)
+        s = np.linspace(0, track.track_length, n + 1)
+        left, right = track.get_boundary_widths_batch(s)
+        lines = []
+        for e in (left + offset, -right - offset):
+            xy = track.local_to_global_batch(np.column_stack([s, e, np.zeros_like(s)]))[:, :2]
+            lines.append(np.column_stack([xy[:-1], xy[1:]]))
+        return np.concatenate(lines)
+
+    @staticmethod
+    def _split_lines(lines, piece_length):
+        n = np.maximum(np.ceil(np.linalg.norm(lines[:, 2:4] - lines[:, 0:2], axis=1) / piece_length), 1).astype(int)
+        f = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))[:, None]
+        p0, p1, n = np.repeat(lines[:, 0:2], n, axis=0), np.repeat(lines[:, 2:4], n, axis=0), np.repeat(n, n)[:, None]
+        return np.column_stack([p0 + (p1 - p0) * f / n, p0 + (p1 - p0) * (f + 1) / n])
+
+    def _ray_pairs(self, b: np.ndarray, lo: np.ndarray, span: np.ndarray, heading: np.ndarray):
+        '''
+        rays of the vehicles b whose direction is in the angular intervals [lo, lo + span]: the indices of the rays in
+        the (B, 2 n_rays) ranges, where the rays are repeated on a second lap so that every interval is a single run of
+        rays, and the number of rays of every interval
+        '''
+        R = self.n_rays
+        # Interval relative to the first ray in units of the spacing, from [0, lap), slightly widened so that the rays
+        # hitting an end point shared by two pieces are kept by either
+        lo = (lo - heading[b]) * (1 / self._spacing) - 1e-7
+        lo -= self._lap * np.floor(lo * (1 / self._lap))
+        hi = lo + span * (1 / self._spacing) + 2e-7
+        first = np.minimum(np.ceil(lo), R)
+        # Past the lap, the rays of the second lap
+        if self._full_circle:
+            last = np.floor(hi)
+        else:
+            last = np.where(hi >= self._lap, np.floor(hi - self._lap) + R, np.minimum(np.floor(hi), R - 1))
+        count = np.maximum(np.minimum(last, 2 * R - 1) - first + 1, 0).astype(np.intp)
+        offsets = np.cumsum(count) - count
+        return np.repeat(b * (2 * R) + first.astype(np.intp) - offsets, count) + np.arange(offsets[-1] + count[-1]), count
+
+    def _cast_dense(self, poses: np.ndarray) -> np.ndarray:
+        '''
+        ranges (B, n_rays) of every ray against every piece, in (B, pieces, n_rays) arrays
+        '''
+        x, y = poses[:, 0, None, None], poses[:, 1, None, None]
+        c, s = np.cos(poses[:, 2:3]), np.sin(poses[:, 2:3])
+        d_x, d_y = (c * self._cos - s * self._sin)[:, None], (s * self._cos + c * self._sin)[:, None]
+        n_l = self._n_lines
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # o + t d = p0 + u e with e = p1 - p0: t = (w x e) / (d x e), u = (w x d) / (d x e) with w = p0 - o
+            w_x, w_y = self._x0[:n_l, None] - x, self._y0[:n_l, None] - y
+            e_x, e_y = self._e_x[:, None], self._e_y[:, None]
+            inv_den = 1 / (d_x * e_y - d_y * e_x)
+            t = (w_x * e_y - w_y * e_x) * inv_den
+            u = (w_x * d_y - w_y * d_x) * inv_den
+            dist = t.min(axis=1, initial=self.max_range, where=(t > 0) & (u >= 0) & (u <= 1))
+            # The nearest root if it is on the piece (beyond the chord), otherwise the far one
+            oc_x, oc_y = x - self._c_x[:, None], y - self._c_y[:, None]
+            m_x, m_y = self._m_x[:, None], self._m_y[:, None]
+            h = d_x * oc_x + d_y * oc_y
+            sq = np.sqrt(h * h - (oc_x * oc_x + oc_y * oc_y - self._rho_2[:, None]))
+            t_near, t_far = -h - sq, sq - h
+            d_m = d_x * m_x + d_y * m_y
+            oc_m = oc_x * m_x + oc_y * m_y - self._chord[:, None]
+            hit_near = (t_near > 0) & (oc_m + t_near * d_m >= 0)
+            t = np.where(hit_near, t_near, t_far)
+            hit = hit_near | ((t_far > 0) & (oc_m + t_far * d_m >= 0))
+            return np.minimum(dist, t.min(axis=1, initial=self.max_range, where=hit))
+
+    def cast(self, poses: np.ndarray) -> np.ndarray:
+        '''
+        ranges (B, n_rays) measured from the poses (B, 3) of (x, y, psi)
+        '''
+        poses = np.asarray(poses, dtype=float).reshape((-1, 3))
+        B, R = poses.shape[0], self.n_rays
+        if B * self._bound_x.size * R <= self.dense_size:
+            return self._cast_dense(poses)
+        # Pieces in range, lines first then arcs
+        p, b = np.nonzero((self._bound_x[:, None] - poses[:, 0])**2 + (self._bound_y[:, None] - poses[:, 1])**2
+                          <= self._bound_r2[:, None])
+        if p.size == 0:
+            return np.full((B, R), self.max_range)
+        n_l = int(p.searchsorted(self._n_lines))
+        o_x, o_y = poses[b, 0], poses[b, 1]
+        theta_0 = np.arctan2(self._y0[p] - o_y, self._x0[p] - o_x)
+        turn = np.arctan2(self._y1[p] - o_y, self._x1[p] - o_x) - theta_0
+
+        # Lines: the rays between the directions of the end points, o + t d is on the line n . x = n . p0 at
+        # t = 1 / (a . d) with a = n / (n . (p0 - o)) (away from the line)
+        p_l, turn_l = p[:n_l], turn[:n_l]
+        turn_l -= 2 * np.pi * np.rint(turn_l / (2 * np.pi))
+        n_x, n_y = self._n_x[p_l], self._n_y[p_l]
+        D = self._n_p[p_l] - n_x * o_x[:n_l] - n_y * o_y[:n_l]
+        D = np.copysign(np.maximum(np.abs(D), 1e-12), D)
+
+        # Arcs: |o + t d - c|^2 = rho^2 at t = -h -+ sqrt(h^2 - q), with h = d . (o - c) and q = |o - c|^2 - rho^2.
+        # Inside the circle (q <= 0), the direction of the rays turns with their far root along the circle, from the
+        # first end point to the last. Outside, the rays within beta = asin(rho / |o - c|) of the center hit the circle,
+        # the near roots on the front (between the tangent points, facing o) and the far roots on the back: the rays of
+        # the near roots on the piece are between the directions of its end points on the front and of the tangent
+        # points on the piece, the rays of the far roots between its end points on the back and the tangent points.
+        # When the piece covers the front and the back on both sides, the far interval also spans rays whose far root
+        # is off the piece, but whose near root is on it.
+        p_a, b_a, turn_a = p[n_l:] - self._n_lines, b[n_l:], turn[n_l:]
+        oc_x, oc_y = o_x[n_l:] - self._c_x[p_a], o_y[n_l:] - self._c_y[p_a]
+        oc_2 = oc_x * oc_x + oc_y * oc_y
+        rho_2 = self._rho_2[p_a]
+        q = oc_2 - rho_2
+        inside = q <= 0
+        oc = np.sqrt(oc_2)
+        cos_alpha = np.minimum(self._rho[p_a] / oc, 1)
+        beta = np.arcsin(cos_alpha)
+        phi = np.arctan2(-oc_y, -oc_x)
+        delta_0 = theta_0[n_l:] - phi
+        delta_0 -= 2 * np.pi * np.rint(delta_0 / (2 * np.pi))
+        delta_1 = delta_0 + turn_a
+        delta_1 -= 2 * np.pi * np.rint(delta_1 / (2 * np.pi))
+        # The tangent points c + rho (cos alpha u +- sin alpha u_perp) with u = (o - c) / |o - c|, seen at -+ beta, are on
+        # the piece if beyond its chord, the end points p are on the front if (p - c) . (o - c) >= rho^2
+        m_x, m_y, cos_half = self._m_x[p_a], self._m_y[p_a], self._cos_half[p_a]
+        u_m = cos_alpha * (oc_x * m_x + oc_y * m_y) / oc
+        u_perp_m = np.sqrt(1 - cos_alpha * cos_alpha) * (oc_x * m_y - oc_y * m_x) / oc
+        tangent_lo = np.where(u_m + u_perp_m >= cos_half, -beta, np.nan)
+        tangent_hi = np.where(u_m - u_perp_m >= cos_half, beta, np.nan)
+        front_0 = self._e0_x[p_a] * oc_x + self._e0_y[p_a] * oc_y >= rho_2
+        front_1 = self._e1_x[p_a] * oc_x + self._e1_y[p_a] * oc_y >= rho_2
+        near_0, near_1 = np.where(front_0, delta_0, np.nan), np.where(front_1, delta_1, np.nan)
+        far_0, far_1 = np.where(front_0, np.nan, delta_0), np.where(front_1, np.nan, delta_1)
+        # (NaN if not on the piece, ignored by fmin and fmax)
+        near_lo, near_hi = np.fmin(np.fmin(near_0, near_1), tangent_lo), np.fmax(np.fmax(near_0, near_1), tangent_hi)
+        far_lo, far_hi = np.fmin(np.fmin(far_0, far_1), tangent_lo), np.fmax(np.fmax(far_0, far_1), tangent_hi)
+
+        # Intervals of the lines, of the near roots then of the far roots of the arcs (empty intervals are NaN)
+        lo = np.concatenate([theta_0[:n_l] + np.minimum(turn_l, 0), np.where(inside, np.nan, phi + near_lo),
+                             np.where(inside, theta_0[n_l:], phi + far_lo)])
+        span = np.concatenate([np.abs(turn_l), near_hi - near_lo, np.where(inside, turn_a % (2 * np.pi), far_hi - far_lo)])
+        empty = np.isnan(lo)
+        lo[empty], span[empty] = 0, -1
+        b = np.concatenate([b, b_a])
+        i, count = self._ray_pairs(b, lo, span, self.angles[0] + poses[:, 2])
+
+        # a . d for the lines and -h for the arcs, as the real part of the product of a_x + i a_y (rotated in the frame of
+        # the vehicle) with the directions of the rays cos - i sin
+        a = np.concatenate([(n_x + 1j * n_y) / D, -oc_x - 1j * oc_y])
+        a = np.concatenate([a, a[n_l:]]) * np.exp(-1j * poses[:, 2])[b]
+        if self._ray_table.size != B * 2 * R:
+            self._ray_table = np.tile(self._rays_2, B)
+        t = np.repeat(a, count)
+        t *= self._ray_table[i]
+        t = np.ascontiguousarray(t.real)
+
+        # The lines at 1 / (a . d), the arcs at -h -+ sqrt(h^2 - q)
+        k_a = count[:n_l].sum()
+        k_f = count[:n_l + p_a.size].sum()
+        with np.errstate(divide='ignore'):
+            np.divide(1, t[:k_a], out=t[:k_a])
+        minus_h = t[k_a:]
+        sq = np.repeat(np.concatenate([q, q]), count[n_l:])
+        np.subtract(minus_h * minus_h, sq, out=sq)
+        np.sqrt(np.maximum(sq, 0, out=sq), out=sq)
+        np.negative(sq[:k_f - k_a], out=sq[:k_f - k_a])
+        minus_h += sq
+
+        dist = np.full((B, 2 * R), self.max_range)
+        np.minimum.at(dist.ravel(), i, t)
+        return np.minimum(dist[:, :R], dist[:, R:])
+
+
+if __name__ == '__main__':
+    import time
+    from mpclab_common.track import get_track
+
+    # Throughput target of the batched cast
+    target = 10000
+
+    track = get_track('L_track_barc')
+    sensor = RangeSensor(track, n_rays=64)
+    rng = np.random.default_rng(0)
+    for B in [1, 32, 256]:
+        cl = np.column_stack([rng.uniform(0, track.track_length, B), rng.uniform(-0.4, 0.4, B), rng.uniform(-0.5, 0.5, B)])
+        poses = track.local_to_global_batch(cl)
+        sensor.cast(poses)
+        n, t = max(2000 // B, 10), np.inf
+        for _ in range(10):
+            t0 = time.perf_counter()
+            for _ in range(n):
+                ranges = sensor.cast(poses)
+            t = min(t, (time.perf_counter() - t0) / n)
+        rate = B * sensor.n_rays / t / 1e3
+        print('%i vehicles x %i rays: %.1f us per cast, %.0f rays / ms (%s the target of %i rays / ms)'
+              % (B, sensor.n_rays, t * 1e6, rate, 'above' if rate >= target else 'below', target))
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from gym_carla.envs.barc.barc_env import BarcEnv
+
+
+def make_env(**kwargs):
+    env = BarcEnv('L_track_barc', do_render=False, dynamics_params=['mass'], **kwargs)
+    env.reset(seed=0, options={'spawning': 'fixed'})
+    for _ in range(5):
+        env.step(np.array([1., 0.1]))
+    return env
+
+
+def rollout(env, actions):
+    obs, rewards = [], []
+    for a in actions:
+        ob, rew, terminated, truncated, info = env.step(a)
+        obs.append(ob['state'])
+        rewards.append(rew)
+    return np.array(obs), np.array(rewards)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(frenet=True), dict(integrator='rk4', substeps=2)])
+def test_sim_state_restore_is_deterministic(kwargs):
+    env = make_env(**kwargs)
+    actions = np.random.default_rng(0).uniform([-0.5, -0.3], [1.5, 0.3], (20, 2))
+    snapshot = env.get_sim_state()
+    obs, rewards = rollout(env, actions)
+    assert not np.array_equal(env.get_sim_state(), snapshot)
+
+    env.set_sim_state(snapshot)
+    assert np.array_equal(env.get_sim_state(), snapshot)
+    obs_2, rewards_2 = rollout(env, actions)
+    assert np.array_equal(obs_2, obs)
+    assert np.array_equal(rewards_2, rewards)
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(frenet=True)])
+def test_evaluate_action_sequences_matches_step(kwargs):
+    env = make_env(**kwargs)
+    rng = np.random.default_rng(1)
+    actions = rng.uniform([-0.5, -0.3], [1.5, 0.3], (3, 10, 2))
+    masses = np.array([[2.0], [2.258], [3.0]])
+    snapshot = env.get_sim_state()
+    result = env.evaluate_action_sequences(actions, dynamics_params=masses)
+    # The env is left at the snapshot with its parameters
+    assert np.array_equal(env.get_sim_state(), snapshot)
+    assert env.dynamics_simulator.get_params() == {'mass': pytest.approx(2.258)}
+
+    for k in range(actions.shape[0]):
+        env.set_sim_state(snapshot)
+        env.dynamics_simulator.set_params(masses[k])
+        for h in range(actions.shape[1]):
+            ob, rew, terminated, truncated, info = env.step(actions[k, h])
+            assert np.array_equal(result['states'][k, h].astype(ob['state'].dtype), ob['state'])
+            assert result['rewards'][k, h] == rew
+            assert (result['terminated'][k, h], result['truncated'][k, h]) == (terminated, truncated)
+            if truncated:
+                # The rest of the sequence is not simulated
+                assert np.isnan(result['states'][k, h + 1:]).all() and not result['rewards'][k, h + 1:].any()
+                break
+        assert result['returns'][k] == pytest.approx(result['rewards'][k].sum())
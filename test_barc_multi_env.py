@@ -0,0 +1,29 @@
+import copy
+
+import numpy as np
+import pytest
+
+from gym_carla.envs.barc.barc_multi_env import BarcMultiEnv
+
+
+@pytest.mark.parametrize('masses', [(2.0, 4.0), (3.0, 3.0)])
+def test_agent_masses(masses):
+    # Two agents from the same state (not checked for collisions) with identical inputs, they only differ by their mass
+    env = BarcMultiEnv('L_track_barc', n_agents=2, check_collisions=False,
+                       dynamics_params=[{'mass': m} for m in masses])
+    ob, info = env.reset(seed=0, options={'spawning': 'fixed'})
+    assert info['dynamics_params'] == [{'mass': m} for m in masses]
+    env.sim_states[1] = copy.deepcopy(env.sim_states[0])
+    for _ in range(20):
+        ob, rew, terminated, truncated, info = env.step(np.tile([1., 0.2], (2, 1)))
+    diverged = np.abs(ob['state'][0] - ob['state'][1]).max() > 1e-3
+    assert diverged == (masses[0] != masses[1])
+
+
+def test_agent_params_in_reset_options():
+    env = BarcMultiEnv('L_track_barc', n_agents=2, dynamics_params=['mass'])
+    ob, info = env.reset(seed=0, options={'dynamics_params': [[2.5], {'mass': 3.5}]})
+    assert info['dynamics_params'] == [{'mass': 2.5}, {'mass': 3.5}]
+    assert BarcMultiEnv.agent_obs_info(ob, info, 1)[1]['dynamics_params'] == {'mass': 3.5}
+    with pytest.raises(ValueError):
+        env.reset(options={'dynamics_params': {'mass': 3.}})
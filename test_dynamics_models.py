@@ -0,0 +1,114 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+from mpclab_common.models.dynamics_models import get_dynamics_model
+from mpclab_common.models.model_types import DynamicBicycleConfig, KinematicBicycleConfig
+from mpclab_common.pytypes import VehicleState
+from mpclab_common.track import get_track
+
+
+@pytest.fixture(scope='module')
+def track():
+    return get_track('L_track_barc')
+
+
+@pytest.mark.parametrize('model_name', ['dynamic_bicycle_blended', 'dynamic_bicycle_blended_cl'])
+def test_blended_low_speed_yaw_rate(track, model_name):
+    # Below blend_v_min the blended model is a kinematic bicycle, which turns at vx * tan(gamma) / L
+    config = DynamicBicycleConfig(model_name=model_name, dt=0.01, discretization_method='rk4', M=2,
+                                  step_method='discrete')
+    model = get_dynamics_model(0, config, track=track)
+    state = VehicleState(t=0.)
+    state.p.s = 0.5
+    state.x.x, state.x.y, state.e.psi = track.local_to_global((0.5, 0, 0))
+    state.v.v_long, state.u.u_a, state.u.u_steer = 0.2, 0., 0.3
+    for _ in range(200):
+        model.step(state)
+
+    L = config.wheel_dist_front + config.wheel_dist_rear
+    assert state.v.v_long < config.blend_v_min
+    assert state.w.w_psi == pytest.approx(state.v.v_long * np.tan(0.3) / L, rel=1e-3)
+    assert state.v.v_tran == pytest.approx(state.v.v_long * np.tan(0.3) * config.wheel_dist_rear / L, rel=1e-3)
+
+
+def random_qu(model_name, track, B, rng):
+    # States around the centerline of the track (the curvilinear models need s, x_tran and e_psi on the track), speeds
+    # from below the blending range up
+    s, x_tran, e_psi = rng.uniform(0, track.track_length, B), rng.uniform(-0.2, 0.2, B), rng.uniform(-0.3, 0.3, B)
+    v = rng.uniform(0.05, 3., B)
+    x, y, psi = np.array([track.local_to_global((s[b], x_tran[b], e_psi[b])) for b in range(B)]).T
+    if model_name.startswith('dynamic_bicycle'):
+        vy, psidot = rng.uniform(-0.3, 0.3, B), rng.uniform(-1., 1., B)
+        q = [v, vy, psidot, e_psi, s, x_tran] if model_name.endswith('_cl') else [v, vy, psidot, x, y, psi]
+    else:
+        q = [v, e_psi, s, x_tran] if model_name.endswith('_cl') else [x, y, v, psi]
+    u = [rng.uniform(-1., 2., B), rng.uniform(-0.4, 0.4, B)]
+    return np.stack(q, axis=1), np.stack(u, axis=1)
+
+
+@pytest.mark.parametrize('discretization_method', ['rk2', 'rk4'])
+@pytest.mark.parametrize('model_name', ['dynamic_bicycle', 'dynamic_bicycle_cl', 'dynamic_bicycle_blended',
+                                        'dynamic_bicycle_blended_cl', 'kinematic_bicycle', 'kinematic_bicycle_cl'])
+def test_numpy_backend_matches_casadi(track, model_name, discretization_method):
+    config_type = DynamicBicycleConfig if model_name.startswith('dynamic') else KinematicBicycleConfig
+    params = ['mass', 'wheel_friction'] if model_name.startswith('dynamic') else None
+    config = config_type(model_name=model_name, dt=0.01, discretization_method=discretization_method, M=4,
+                         params=params)
+    casadi_model = get_dynamics_model(0, config, track=track)
+    numpy_model = get_dynamics_model(0, dataclasses.replace(config, backend='numpy'), track=track)
+    if params is not None:
+        for model in [casadi_model, numpy_model]:
+            model.set_params({'mass': 2.5, 'wheel_friction': 0.8})
+
+    Q, U = random_qu(model_name, track, 50, np.random.default_rng(0))
+    for fn_name in ['fc', 'fd']:
+        expected = casadi_model.evaluate_batch(fn_name, Q, U)
+        assert numpy_model.evaluate_batch(fn_name, Q, U) == pytest.approx(expected, rel=0, abs=1e-10)
+        # A single state is evaluated on Python floats
+        assert getattr(numpy_model, fn_name)(Q[0], U[0]) == pytest.approx(expected[0], rel=0, abs=1e-10)
+
+
+@pytest.mark.parametrize('model_name', ['dynamic_bicycle', 'dynamic_bicycle_cl'])
+def test_numpy_backend_step(track, model_name):
+    # Same VehicleState conversions (state2qu / qu2state) and fixed-step update as the CasADi model
+    config = DynamicBicycleConfig(model_name=model_name, dt=0.01, discretization_method='rk4', M=2,
+                                  step_method='discrete')
+    states = []
+    for backend in ['casadi', 'numpy']:
+        model = get_dynamics_model(0, dataclasses.replace(config, backend=backend), track=track)
+        state = VehicleState(t=0.)
+        state.p.s = 0.5
+        state.x.x, state.x.y, state.e.psi = track.local_to_global((0.5, 0, 0))
+        state.v.v_long, state.u.u_a, state.u.u_steer = 1., 0.5, 0.2
+        for _ in range(50):
+            model.step(state)
+        states.append(state)
+    for field in ['v_long', 'v_tran']:
+        assert getattr(states[1].v, field) == pytest.approx(getattr(states[0].v, field), rel=0, abs=1e-10)
+    assert states[1].w.w_psi == pytest.approx(states[0].w.w_psi, rel=0, abs=1e-10)
+    assert [states[1].x.x, states[1].x.y, states[1].e.psi] == pytest.approx([states[0].x.x, states[0].x.y,
+                                                                             states[0].e.psi], rel=0, abs=1e-10)
+    assert [states[1].p.s, states[1].p.x_tran, states[1].p.e_psi] == pytest.approx([states[0].p.s, states[0].p.x_tran,
+                                                                                   states[0].p.e_psi], rel=0, abs=1e-10)
+
+
+@pytest.mark.parametrize('hessians', [False, True])
+def test_linearize_trajectory_matches_stage_functions(track, hessians):
+    config = DynamicBicycleConfig(model_name='dynamic_bicycle', dt=0.1, discretization_method='rk4', M=4,
+                                  compute_hessians=hessians)
+    model = get_dynamics_model(0, config, track=track)
+    Q, U = random_qu('dynamic_bicycle', track, 8, np.random.default_rng(2))
+    lin = model.linearize_trajectory(Q, U, hessians=hessians)
+    A, B, c = lin[:3]
+    for k in range(Q.shape[0]):
+        A_k, B_k = np.array(model.fAd(Q[k], U[k])), np.array(model.fBd(Q[k], U[k]))
+        assert A[k] == pytest.approx(A_k, rel=1e-12, abs=1e-12)
+        assert B[k] == pytest.approx(B_k, rel=1e-12, abs=1e-12)
+        # q_k+1 = A_k q_k + B_k u_k + c_k at the linearization point
+        q_kp1 = np.array(model.fd(Q[k], U[k])).squeeze()
+        assert A_k @ Q[k] + B_k @ U[k] + c[k] == pytest.approx(q_kp1, rel=1e-12, abs=1e-12)
+        if hessians:
+            for H, f in zip(lin[3:], [model.fEd, model.fFd, model.fGd]):
+                assert H[k] == pytest.approx(np.stack([np.array(h) for h in f(Q[k], U[k])]), rel=1e-12, abs=1e-12)
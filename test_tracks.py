@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from mpclab_common.track import get_track
+
+
+@pytest.fixture(scope='module')
+def track():
+    return get_track('L_track_barc')
+
+
+def random_poses(track, B, rng, e_max):
+    return np.column_stack([rng.uniform(0, track.track_length, B), rng.uniform(-e_max, e_max, B),
+                            rng.uniform(-0.5, 0.5, B)])
+
+
+def test_global_to_local_batch(track):
+    rng = np.random.default_rng(0)
+    cl = random_poses(track, 200, rng, track.half_width)
+    # Also the start of the lap and the key points, where the segment of a point changes
+    cl = np.concatenate([cl, np.column_stack([track.key_pts[:-1, 3], np.zeros(track.n_segs), np.zeros(track.n_segs)])])
+    xy = track.local_to_global_batch(cl)
+    expected = np.array([track.global_to_local(tuple(p)) for p in xy])
+    assert track.global_to_local_batch(xy) == pytest.approx(expected, rel=0, abs=1e-9)
+    assert np.array([track.local_to_global(tuple(c)) for c in cl]) == pytest.approx(xy, rel=0, abs=1e-9)
+
+
+def brute_force_lateral_bounds(track, cl_coord, VL, VW, n=200):
+    # Lateral offsets of points along the edges of the footprint, measured from the closest point of a centerline
+    # sampled every mm around the vehicle (the part of the track the vehicle is on, not the one across a hairpin)
+    x, y, psi = track.local_to_global(tuple(cl_coord))
+    u = np.linspace(-0.5, 0.5, n)
+    corners = np.concatenate([np.column_stack([u * VL, np.full(n, sign * VW / 2)]) for sign in (-1, 1)]
+                             + [np.column_stack([np.full(n, sign * VL / 2), u * VW]) for sign in (-1, 1)])
+    points = np.array([x, y]) + corners @ np.array([[np.cos(psi), np.sin(psi)], [-np.sin(psi), np.cos(psi)]])
+    s = cl_coord[0] + np.arange(-0.6, 0.6, 1e-3)
+    center = track.local_to_global_batch(np.column_stack([s, np.zeros_like(s), np.zeros_like(s)]))
+    k = np.argmin(((points[:, None] - center[None, :, :2])**2).sum(axis=2), axis=1)
+    d = points - center[k, :2]
+    e_y = np.cos(center[k, 2]) * d[:, 1] - np.sin(center[k, 2]) * d[:, 0]
+    return e_y.min(), e_y.max()
+
+
+def test_footprint_against_brute_force(track):
+    VL, VW = 0.37, 0.195
+    cl = random_poses(track, 100, np.random.default_rng(1), track.half_width)
+    bounds = np.array([track.footprint_lateral_bounds(c, VL, VW) for c in cl])
+    expected = np.array([brute_force_lateral_bounds(track, c, VL, VW) for c in cl])
+    assert bounds == pytest.approx(expected, rel=0, abs=1e-5)
+    assert track.footprint_lateral_bounds_batch(cl, VL, VW) == pytest.approx(bounds, rel=0, abs=1e-12)
+
+    off = np.array([track.footprint_off_track(c, VL, VW) for c in cl])
+    # Skip the footprints touching the boundary within the accuracy of the brute force
+    clear = np.abs(np.abs(expected) - track.half_width).min(axis=1) > 1e-5
+    assert off[clear].tolist() == ((expected[clear, 1] > track.half_width) |
+                                   (expected[clear, 0] < -track.half_width)).tolist()
+    assert off.any() and not off.all()
+    assert track.footprint_off_track_batch(cl, VL, VW).tolist() == off.tolist()